@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Benchmark of IGService.format_prices against the json_normalize based
+implementation it replaced
+
+    python sample/bench_format_prices.py [number of bars]
+"""
+
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import pandas as pd
+from pandas import json_normalize
+
+from trading_ig import IGService
+from trading_ig.utils import DATE_FORMATS
+
+
+def format_prices_json_normalize(prices, version, flag_calc_spread=False):
+    """format_prices before vectorization"""
+
+    def cols(typ):
+        return {
+            "openPrice.%s" % typ: "Open",
+            "highPrice.%s" % typ: "High",
+            "lowPrice.%s" % typ: "Low",
+            "closePrice.%s" % typ: "Close",
+            "lastTradedVolume": "Volume",
+        }
+
+    last = prices[0]["lastTradedVolume"] or prices[0]["closePrice"]["lastTraded"]
+    df = json_normalize(prices)
+    df = df.set_index("snapshotTime")
+    df.index = pd.to_datetime(df.index, format=DATE_FORMATS[int(version)])
+    df.index.name = "DateTime"
+
+    df_ask = df[["openPrice.ask", "highPrice.ask", "lowPrice.ask", "closePrice.ask"]]
+    df_ask = df_ask.rename(columns=cols("ask"))
+
+    df_bid = df[["openPrice.bid", "highPrice.bid", "lowPrice.bid", "closePrice.bid"]]
+    df_bid = df_bid.rename(columns=cols("bid"))
+
+    if flag_calc_spread:
+        df_spread = df_ask - df_bid
+
+    if last:
+        df_last = df[
+            [
+                "openPrice.lastTraded",
+                "highPrice.lastTraded",
+                "lowPrice.lastTraded",
+                "closePrice.lastTraded",
+                "lastTradedVolume",
+            ]
+        ]
+        df_last = df_last.rename(columns=cols("lastTraded"))
+
+    data = [df_bid, df_ask]
+    keys = ["bid", "ask"]
+    if flag_calc_spread:
+        data.append(df_spread)
+        keys.append("spread")
+
+    if last:
+        data.append(df_last)
+        keys.append("last")
+
+    return pd.concat(data, axis=1, keys=keys)
+
+
+def make_prices(n):
+    start = datetime(2020, 1, 2)
+    prices = []
+    for i in range(n):
+        dt = start + timedelta(minutes=i)
+        price = 100.0 + i * 0.01
+
+        def level(offset):
+            return {
+                "bid": price + offset,
+                "ask": price + offset + 0.5,
+                "lastTraded": None,
+            }
+
+        prices.append(
+            {
+                "snapshotTime": dt.strftime("%Y/%m/%d %H:%M:%S"),
+                "openPrice": level(0.0),
+                "highPrice": level(2.0),
+                "lowPrice": level(-2.0),
+                "closePrice": level(1.0),
+                "lastTradedVolume": 10,
+            }
+        )
+    return prices
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    prices = make_prices(n)
+    ig_service = IGService("username", "password", "api_key", "DEMO")
+    number = 20
+
+    baseline = min(
+        timeit.repeat(
+            lambda: format_prices_json_normalize(prices, 3), number=number, repeat=3
+        )
+    )
+    vectorized = min(
+        timeit.repeat(
+            lambda: ig_service.format_prices(prices, 3), number=number, repeat=3
+        )
+    )
+    print("%d bars" % n)
+    print("json_normalize: %8.2f ms" % (baseline / number * 1000))
+    print("vectorized:     %8.2f ms" % (vectorized / number * 1000))
+    print("speedup:        %8.1fx" % (baseline / vectorized))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Benchmark of the time needed to import trading_ig (and the modules a
+short-lived order submission script needs)
+
+    python sample/bench_import.py [number of runs]
+"""
+
+import subprocess
+import sys
+import time
+
+STATEMENTS = [
+    "import trading_ig",
+    "from trading_ig import IGService; "
+    "IGService('username', 'password', 'api_key', 'DEMO')",
+    "import pandas",
+]
+
+
+def import_time(statement, runs):
+    """Returns the best wall time (s) of a fresh interpreter running statement,
+    minus the startup time of an empty interpreter"""
+
+    def best(code):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, "-c", code])
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return best(statement) - best("pass")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for statement in STATEMENTS:
+        print("%8.1f ms  %s" % (import_time(statement, runs) * 1000, statement))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Benchmark of the reading of a Lightstreamer Stream Connection: lines per
+second read by StreamReader against readline().decode("utf-8").rstrip()
+
+    python sample/bench_stream_reader.py [number of lines]
+"""
+
+import io
+import sys
+import time
+
+from trading_ig.lightstreamer import StreamReader
+
+
+def make_stream(n):
+    lines = []
+    for i in range(n):
+        lines.append(
+            "%d,%d|10:%02d:%02d|1.%04d|1.%04d||TRADEABLE\r\n"
+            % (1 + i % 3, 1 + i % 300, i // 60 % 60, i % 60, i % 9999, i % 9999 + 2)
+        )
+    return "".join(lines).encode("utf-8")
+
+
+def open_stream(data):
+    # buffered like the socket file of an HTTP response
+    return io.BufferedReader(io.BytesIO(data))
+
+
+def read_readline(stream):
+    n = 0
+    line = stream.readline().decode("utf-8").rstrip()
+    while line:
+        n += 1
+        line = stream.readline().decode("utf-8").rstrip()
+    return n
+
+
+def read_stream_reader(stream):
+    n = 0
+    reader = StreamReader(stream)
+    line = reader.readline()
+    while line:
+        n += 1
+        line = reader.readline()
+    return n
+
+
+def iter_stream_reader(stream):
+    n = 0
+    for line in StreamReader(stream):
+        n += 1
+    return n
+
+
+def bench(read, data, repeat=5):
+    best = None
+    for _ in range(repeat):
+        stream = open_stream(data)
+        start = time.perf_counter()
+        n = read(stream)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return n / best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    data = make_stream(n)
+    before = bench(read_readline, data)
+    after = bench(read_stream_reader, data)
+    after_iter = bench(iter_stream_reader, data)
+    print("%d lines" % n)
+    print("readline/decode/rstrip:  %12.0f lines/s" % before)
+    print("StreamReader.readline:   %12.0f lines/s (%.1fx)" % (after, after / before))
+    print(
+        "iter(StreamReader):      %12.0f lines/s (%.1fx)"
+        % (after_iter, after_iter / before)
+    )
+
+
+if __name__ == "__main__":
+    main()
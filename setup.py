@@ -81,7 +81,13 @@ setup(
     # List additional groups of dependencies here (e.g. development dependencies).
     # You can install these using the following syntax, for example:
     # $ pip install -e .[dev,test]
-    extras_require={"dev": ["check-manifest", "pytest"], "test": ["pytest", "pytest-cov"],},
+    extras_require={
+        "dev": ["check-manifest", "pytest"],
+        "test": ["pytest", "pytest-cov"],
+        "async": ["httpx"],
+        "fastjson": ["orjson"],
+        "ws": ["websockets>=11"],
+    },
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
     # have to be included in MANIFEST.in as well.
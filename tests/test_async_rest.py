@@ -0,0 +1,83 @@
+from trading_ig.async_rest import AsyncIGService
+import asyncio
+import httpx
+import json
+import pandas as pd
+import pytest
+
+"""
+unit tests for the asyncio REST client
+"""
+
+
+def mock_service(handler):
+    session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return AsyncIGService('username', 'password', 'api_key', 'DEMO', session=session)
+
+
+class TestAsyncIGService:
+
+    def test_login_and_fetch_accounts(self):
+
+        with open('tests/data/accounts.json', 'r') as file:
+            login_body = json.loads(file.read())
+        with open('tests/data/accounts_balances.json', 'r') as file:
+            accounts_body = json.loads(file.read())
+
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            if request.url.path == '/gateway/deal/session':
+                return httpx.Response(200, json=login_body,
+                                      headers={'CST': 'abc123',
+                                               'X-SECURITY-TOKEN': 'xyz987'})
+            return httpx.Response(200, json=accounts_body)
+
+        async def run():
+            async with mock_service(handler) as ig_service:
+                await ig_service.create_session()
+                return ig_service, await ig_service.fetch_accounts()
+
+        ig_service, result = asyncio.run(run())
+
+        assert ig_service.crud_session.CLIENT_TOKEN == 'abc123'
+        assert ig_service.crud_session.SECURITY_TOKEN == 'xyz987'
+        assert requests[0].method == 'POST'
+        assert requests[1].method == 'GET'
+        assert requests[1].headers['CST'] == 'abc123'
+        assert requests[1].headers['VERSION'] == '1'
+
+        assert isinstance(result, pd.DataFrame)
+        assert result.iloc[0]['accountId'] == 'XYZ987'
+        assert result.iloc[0]['balance'] == 1000.0
+
+    def test_concurrent_requests(self):
+
+        def handler(request):
+            epic = request.url.path.rsplit('/', 1)[1]
+            return httpx.Response(200, json={'instrument': {'epic': epic}})
+
+        async def run():
+            async with mock_service(handler) as ig_service:
+                ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+                epics = ['EPIC.%d' % i for i in range(10)]
+                coros = [ig_service.fetch_market_by_epic(epic) for epic in epics]
+                return epics, await asyncio.gather(*coros)
+
+        epics, results = asyncio.run(run())
+
+        assert [r['instrument']['epic'] for r in results] == epics
+
+    def test_error_code(self):
+
+        def handler(request):
+            return httpx.Response(404, json={'errorCode': 'error.not-found'})
+
+        async def run():
+            async with mock_service(handler) as ig_service:
+                ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+                await ig_service.fetch_market_by_epic('EPIC')
+
+        with pytest.raises(Exception, match='error.not-found'):
+            asyncio.run(run())
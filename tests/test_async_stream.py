@@ -0,0 +1,283 @@
+from trading_ig.async_stream import AsyncLSClient, AsyncIGStreamService
+from trading_ig.lightstreamer import Subscription, Backoff
+from trading_ig.lightstreamer_ws import TLCP_PROTOCOL
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+from websockets.asyncio.server import serve
+import asyncio
+import pytest
+import threading
+
+"""
+unit tests for the asyncio streaming client, against a local stand-in
+Lightstreamer server
+"""
+
+FIELDS = ['UPDATE_TIME', 'BID', 'OFFER']
+ITEMS = ['L1:CS.D.GBPUSD.CFD.IP', 'L1:CS.D.USDJPY.CFD.IP']
+UPDATES = [
+    'U,{0},1,10:00:00|1.2|1.3',
+    'U,{0},2,10:00:00|150.1|150.2',
+    'U,{0},1,10:00:01|^2',
+    'U,{0},1,|%241|$',
+]
+
+
+class StandInServer:
+    """Minimal TLCP server: a session, subscriptions answered with
+    scripted updates (items named BAD are rejected). With end_session,
+    the first session ends after the updates of its second subscription."""
+
+    def __init__(self, updates, conok='CONOK,S1,50000,5000,*', end_session=False):
+        self.updates = updates
+        self.conok = conok
+        self.end_session = end_session
+        self.requests = []
+        self.messages = []
+
+    async def __aenter__(self):
+        self.server = await serve(self.handler, 'localhost', 0,
+                                  subprotocols=[TLCP_PROTOCOL]).__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self):
+        port = list(self.server.sockets)[0].getsockname()[1]
+        return 'http://localhost:%d' % port
+
+    async def handler(self, ws):
+        async for message in ws:
+            self.messages.append(message)
+            name, *queries = message.split('\r\n')
+            for query in queries:
+                if not await self.request(ws, name, dict(parse_qsl(query))):
+                    return
+
+    async def request(self, ws, name, params):
+        self.requests.append((name, params))
+        if name == 'create_session':
+            await ws.send('SERVNAME,Lightstreamer\r\n%s\r\nCONS,unlimited'
+                          % self.conok)
+        elif params.get('LS_op') == 'add' and 'BAD' in params['LS_group']:
+            await ws.send('REQERR,%s,21,Bad item name' % params['LS_reqId'])
+        elif params.get('LS_op') == 'add':
+            sub_id = params['LS_subId']
+            await ws.send('REQOK,%s\r\nSUBOK,%s,2,3'
+                          % (params['LS_reqId'], sub_id))
+            await ws.send('\r\n'.join(u.format(sub_id) for u in self.updates))
+            if self.end_session and sub_id == '2':
+                self.end_session = False
+                await ws.send('END,41,session closed')
+                return False
+            await ws.send('LOOP,0')
+        elif params.get('LS_op') == 'delete':
+            await ws.send('REQOK,%s\r\nUNSUB,%s'
+                          % (params['LS_reqId'], params['LS_subId']))
+        elif params.get('LS_op') == 'destroy':
+            await ws.send('REQOK,%s' % params['LS_reqId'])
+            await ws.send('END,31,destroy')
+            return False
+        elif name == 'bind_session':
+            await ws.send('CONOK,S1,50000,5000,*\r\nPROBE')
+        return True
+
+
+class TestAsyncLSClient:
+
+    def test_stream_and_control(self):
+
+        async def run():
+            async with StandInServer(UPDATES) as server:
+                client = AsyncLSClient(server.url, user='ACC',
+                                       password='CST-a|XST-b', timeout=5)
+                await client.connect()
+                assert client._session['SessionId'] == 'S1'
+
+                subscription = Subscription('MERGE', ITEMS, FIELDS)
+                threads = []
+                subscription.addlistener(
+                    lambda item: threads.append(threading.current_thread()))
+                updates = client.updates(subscription)
+                key = await client.subscribe(subscription)
+                assert key == 1
+
+                received = []
+                async for update in updates:
+                    received.append((update.name, update.values,
+                                     update.changed_fields()))
+                    if len(received) == len(UPDATES):
+                        await client.unsubscribe(key)
+                        await client.destroy()
+                return server.requests, received, threads
+
+        requests, received, threads = asyncio.run(run())
+
+        # listeners run on the event loop thread
+        assert threads == [threading.current_thread()] * len(UPDATES)
+        assert received == [
+            (ITEMS[0], {'UPDATE_TIME': '10:00:00', 'BID': '1.2', 'OFFER': '1.3'},
+             FIELDS),
+            (ITEMS[1], {'UPDATE_TIME': '10:00:00', 'BID': '150.1',
+                        'OFFER': '150.2'}, FIELDS),
+            (ITEMS[0], {'UPDATE_TIME': '10:00:01', 'BID': '1.2', 'OFFER': '1.3'},
+             ['UPDATE_TIME']),
+            (ITEMS[0], {'UPDATE_TIME': '10:00:01', 'BID': '$1', 'OFFER': ''},
+             ['BID', 'OFFER']),
+        ]
+
+        names = [name for (name, params) in requests]
+        assert names[:2] == ['create_session', 'control']
+        assert sorted(names[2:]) == ['bind_session', 'control', 'control']
+        create, add = requests[0][1], requests[1][1]
+        assert create['LS_user'] == 'ACC'
+        assert create['LS_password'] == 'CST-a|XST-b'
+        assert add['LS_op'] == 'add'
+        assert add['LS_group'] == ' '.join(ITEMS)
+        assert add['LS_schema'] == ' '.join(FIELDS)
+        assert add['LS_snapshot'] == 'true'
+
+    def test_iterator_ends_with_session(self):
+
+        async def run():
+            async with StandInServer(UPDATES[:2]) as server:
+                client = AsyncLSClient(server.url, timeout=5)
+                await client.connect()
+                subscription = Subscription('MERGE', ITEMS, FIELDS)
+                updates = client.updates(subscription, fields=['BID'], maxsize=1)
+                await client.subscribe(subscription)
+                # the updates are read before the LOOP answered by bind_session
+                while server.requests[-1][0] != 'bind_session':
+                    await asyncio.sleep(0.01)
+                await client.disconnect()
+                return [update.name async for update in updates], updates
+
+        received, updates = asyncio.run(run())
+
+        # maxsize=1: the first update was dropped, the iterator ended
+        assert received == [ITEMS[1]]
+        assert updates.dropped == 1
+
+    def test_recovery(self):
+
+        async def run():
+            async with StandInServer(UPDATES[:2], end_session=True) as server:
+                client = AsyncLSClient(server.url, timeout=5,
+                                       recovery=Backoff(initial=0.01))
+                outages = []
+                client.addrecoverylistener(outages.append)
+                await client.connect()
+                subscriptions = [Subscription('MERGE', ITEMS, FIELDS),
+                                 Subscription('MERGE', ITEMS, FIELDS)]
+                updates = client.updates(subscriptions[1])
+                for subscription in subscriptions:
+                    await client.subscribe(subscription)
+                received = []
+                async for update in updates:
+                    received.append(update.name)
+                    if len(received) == 4:
+                        await client.disconnect()
+                return server.messages, outages, received
+
+        messages, outages, received = asyncio.run(run())
+
+        # the iterator goes on with the new session
+        assert received == ITEMS * 2
+        assert len(outages) == 1
+        assert outages[0].cause == 'END,41,session closed'
+        assert outages[0].attempts == 1
+        # the new session subscribes again in one message
+        messages = [m for m in messages if not m.startswith('bind_session')]
+        assert [m.split('\r\n', 1)[0] for m in messages[:5]] == [
+            'create_session', 'control', 'control', 'create_session', 'control']
+        batch = [dict(parse_qsl(line)) for line in messages[4].split('\r\n')[1:]]
+        assert [(p['LS_op'], p['LS_subId']) for p in batch] == [
+            ('add', '1'), ('add', '2')]
+
+    def test_subscribe_many(self):
+
+        async def run():
+            async with StandInServer([], conok='CONOK,S1,300,5000,*') as server:
+                client = AsyncLSClient(server.url, timeout=5)
+                await client.connect()
+                subscriptions = [Subscription('MERGE', ['L1:EPIC%d' % i], FIELDS)
+                                 for i in range(10)]
+                results = await client.subscribe_many(subscriptions)
+                await client.destroy()
+                return server.messages, results
+
+        messages, results = asyncio.run(run())
+
+        assert results == [(i, 'OK') for i in range(1, 11)]
+        controls = [m for m in messages if m.startswith('control')]
+        # several messages within the request limit
+        assert 1 < len(controls) < 10
+        assert all(len(m) <= 300 for m in controls)
+
+    def test_rejected_subscription(self):
+
+        async def run():
+            async with StandInServer([]) as server:
+                client = AsyncLSClient(server.url, timeout=5)
+                await client.connect()
+                subscriptions = [Subscription('MERGE', [item], FIELDS)
+                                 for item in ['L1:EPIC1', 'L1:BAD', 'L1:EPIC3']]
+                results = await client.subscribe_many(subscriptions)
+                keys = sorted(client._subscriptions)
+                ig_stream_service = AsyncIGStreamService(None)
+                ig_stream_service.ls_client = client
+                unsubscribed = await ig_stream_service.unsubscribe_all()
+                await client.destroy()
+                return server.requests, results, keys, unsubscribed
+
+        requests, results, keys, unsubscribed = asyncio.run(run())
+
+        assert results == [(1, 'OK'), (2, 'ERROR,21,Bad item name'), (3, 'OK')]
+        assert keys == [1, 3]
+        # no DELETE of the table the server didn't create
+        assert unsubscribed == [(1, 'OK'), (3, 'OK')]
+        assert [params['LS_subId'] for (name, params) in requests
+                if params.get('LS_op') == 'delete'] == ['1', '3']
+
+    def test_connection_error(self):
+
+        async def run():
+            async with StandInServer([], conok='CONERR,1,User not allowed') \
+                    as server:
+                client = AsyncLSClient(server.url, timeout=5)
+                await client.connect()
+
+        with pytest.raises(IOError, match='CONERR'):
+            asyncio.run(run())
+
+
+class TestAsyncIGStreamService:
+
+    def test_connect(self):
+
+        async def run():
+            async with StandInServer([]) as server:
+                ig_service = SimpleNamespace(
+                    crud_session=SimpleNamespace(CLIENT_TOKEN='a',
+                                                 SECURITY_TOKEN='b'))
+
+                async def create_session(encryption=False):
+                    return {'lightstreamerEndpoint': server.url}
+
+                ig_service.create_session = create_session
+                ig_stream_service = AsyncIGStreamService(ig_service)
+                await ig_stream_service.create_session()
+                await ig_stream_service.connect('ACC')
+                await ig_stream_service.ls_client.subscribe(
+                    Subscription('MERGE', ITEMS, FIELDS))
+                await ig_stream_service.disconnect()
+                return server.requests
+
+        requests = asyncio.run(run())
+
+        assert requests[0][1]['LS_password'] == 'CST-a|XST-b'
+        assert [params['LS_op'] for (name, params) in requests
+                if name == 'control'] == ['add', 'delete']
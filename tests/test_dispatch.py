@@ -0,0 +1,172 @@
+from trading_ig.lightstreamer import Subscription
+from trading_ig.dispatch import Dispatcher, BLOCK, DROP_OLDEST, CONFLATE
+import threading
+import time
+import pytest
+
+"""
+unit tests for the dispatch of streaming updates
+"""
+
+FIELDS = ['UPDATE_TIME', 'BID', 'OFFER']
+ITEMS = ['L1:CS.D.GBPUSD.CFD.IP', 'L1:CS.D.USDJPY.CFD.IP']
+
+
+class SlowListener:
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.updates = []
+
+    def __call__(self, update):
+        self.started.set()
+        self.release.wait(5)
+        self.updates.append((update['name'], dict(update['values'])))
+
+
+class TestDispatcher:
+
+    def setup_method(self):
+        self.dispatcher = Dispatcher(workers=2)
+
+    def teardown_method(self):
+        self.dispatcher.close()
+
+    def test_block(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        listener = SlowListener()
+        subscription.addlistener(listener)
+        queue = self.dispatcher.attach(subscription, maxsize=2, policy=BLOCK)
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3')
+        listener.started.wait(5)
+        subscription.notifyupdate('1|10:00:01|1.21|')
+        subscription.notifyupdate('2|10:00:01|150.1|150.2')
+        reader = threading.Thread(
+            target=subscription.notifyupdate, args=('1|10:00:02||1.31',))
+        reader.start()
+        time.sleep(0.05)
+        # the stream thread waits for room in the queue
+        assert reader.is_alive()
+        assert queue.stats()['depth'] == 2
+
+        listener.release.set()
+        reader.join(5)
+        assert queue.join(5)
+        assert [values['UPDATE_TIME'] for (_, values) in listener.updates] == \
+            ['10:00:00', '10:00:01', '10:00:01', '10:00:02']
+        assert listener.updates[3] == \
+            (ITEMS[0], {'UPDATE_TIME': '10:00:02', 'BID': '1.21', 'OFFER': '1.31'})
+        stats = queue.stats()
+        assert stats['delivered'] == 4
+        assert stats['dropped'] == 0
+        assert stats['max_depth'] == 2
+
+    def test_drop_oldest(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        listener = SlowListener()
+        subscription.addlistener(listener)
+        queue = self.dispatcher.attach(subscription, maxsize=2, policy=DROP_OLDEST)
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3')
+        listener.started.wait(5)
+        for i in range(1, 6):
+            subscription.notifyupdate('1|10:00:0%d|1.2%d|' % (i, i))
+        assert queue.stats()['dropped'] == 3
+
+        listener.release.set()
+        assert queue.join(5)
+        assert [values['BID'] for (_, values) in listener.updates] == \
+            ['1.2', '1.24', '1.25']
+        # dropped updates are still merged in the item state
+        assert listener.updates[-1][1]['OFFER'] == '1.3'
+
+    def test_conflate(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        listener = SlowListener()
+        subscription.addlistener(listener)
+        filtered = []
+        subscription.addlistener(lambda update: filtered.append(update['pos']),
+                                 fields=['OFFER'])
+        queue = self.dispatcher.attach(subscription, policy=CONFLATE)
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3')
+        listener.started.wait(5)
+        subscription.notifyupdate('1|10:00:01|1.21|')
+        subscription.notifyupdate('2|10:00:01|150.1|150.2')
+        subscription.notifyupdate('1|10:00:02||1.31')
+        subscription.notifyupdate('1|10:00:03|1.22|')
+        assert queue.stats()['depth'] == 2
+
+        listener.release.set()
+        assert queue.join(5)
+        assert listener.updates == [
+            (ITEMS[0], {'UPDATE_TIME': '10:00:00', 'BID': '1.2', 'OFFER': '1.3'}),
+            (ITEMS[0], {'UPDATE_TIME': '10:00:03', 'BID': '1.22', 'OFFER': '1.31'}),
+            (ITEMS[1], {'UPDATE_TIME': '10:00:01', 'BID': '150.1', 'OFFER': '150.2'}),
+        ]
+        # changed masks are merged too
+        assert filtered == [1, 1, 2]
+        assert queue.stats()['dropped'] == 2
+
+    def test_listener_error(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        updates = []
+
+        def listener(update):
+            updates.append(update['values']['BID'])
+            raise RuntimeError('listener error')
+
+        subscription.addlistener(listener)
+        queue = self.dispatcher.attach(subscription)
+        subscription.notifyupdate('1|10:00:00|1.2|1.3')
+        subscription.notifyupdate('1|10:00:01|1.21|')
+        assert queue.join(5)
+        assert updates == ['1.2', '1.21']
+        assert self.dispatcher.stats()[0]['delivered'] == 2
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            self.dispatcher.attach(Subscription('MERGE', ITEMS, FIELDS),
+                                   policy='drop_newest')
+
+
+class TestConflate:
+
+    def test_drain(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        listener = []
+        subscription.addlistener(listener.append)
+        updates = subscription.conflate()
+        assert updates.drain() == []
+
+        for i in range(100):
+            subscription.notifyupdate('1|10:00:%02d|1.%d|' % (i % 60, i))
+            if i == 50:
+                subscription.notifyupdate('2|10:00:50|150.1|150.2')
+        assert updates.stats()['depth'] == 2
+        assert updates.stats()['max_depth'] == 2
+
+        drained = updates.drain()
+        assert [(u['name'], u['values']) for u in drained] == [
+            (ITEMS[0], {'UPDATE_TIME': '10:00:39', 'BID': '1.99', 'OFFER': None}),
+            (ITEMS[1], {'UPDATE_TIME': '10:00:50', 'BID': '150.1', 'OFFER': '150.2'}),
+        ]
+        assert drained[0].changed_fields() == ['UPDATE_TIME', 'BID']
+        assert updates.drain() == []
+        assert listener == []
+        assert updates.stats()['dropped'] == 99
+
+    def test_drain_timeout(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        updates = subscription.conflate()
+        start = time.monotonic()
+        assert updates.drain(timeout=0.05) == []
+        assert time.monotonic() - start >= 0.04
+
+        timer = threading.Timer(
+            0.05, subscription.notifyupdate, args=('2|10:00:00|150.1|150.2',))
+        timer.start()
+        drained = updates.drain(timeout=5)
+        assert [u['pos'] for u in drained] == [2]
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+"""
+import time regression tests: heavy dependencies must only be imported
+when they are used
+"""
+
+HEAVY_MODULES = ['pandas', 'numpy', 'Crypto', 'requests', 'httpx', 'asyncio',
+                 'munch']
+
+
+def imported_modules(code):
+    output = subprocess.check_output(
+        [sys.executable, '-c', code + '; import sys; print(" ".join(sys.modules))'])
+    return set(output.decode().split())
+
+
+class TestImport:
+
+    def test_import_is_lazy(self):
+        modules = imported_modules('import trading_ig')
+        assert [m for m in HEAVY_MODULES if m in modules] == []
+
+    def test_service_without_dataframe(self):
+        modules = imported_modules(
+            'from trading_ig import IGService; '
+            'IGService("username", "password", "api_key", "DEMO")')
+        assert 'requests' in modules
+        assert 'pandas' not in modules
+        assert 'Crypto' not in modules
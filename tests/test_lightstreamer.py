@@ -0,0 +1,516 @@
+from trading_ig.lightstreamer import Subscription, TypedSubscription, time_of_day
+from trading_ig.lightstreamer import LSClient, StreamReader, Backoff, split_batches
+from trading_ig.lightstreamer import CommandSubscription
+from trading_ig.dispatch import Dispatcher, CONFLATE
+from urllib.parse import parse_qsl
+import datetime
+import threading
+import io
+import pytest
+
+"""
+unit tests for the Lightstreamer client
+"""
+
+FIELDS = ['UPDATE_TIME', 'BID', 'OFFER', 'MARKET_STATE']
+ITEMS = ['L1:CS.D.GBPUSD.CFD.IP', 'L1:CS.D.USDJPY.CFD.IP']
+
+
+class TestSubscription:
+
+    def test_notifyupdate(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        updates = []
+        subscription.addlistener(
+            lambda update: updates.append((update['pos'], update['name'],
+                                           dict(update['values']))))
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3|TRADEABLE\r\n')
+        subscription.notifyupdate('2|10:00:00|150.1|150.2|TRADEABLE')
+        subscription.notifyupdate('1|10:00:01||1.31|')
+        subscription.notifyupdate('1|||$|#')
+
+        assert updates == [
+            (1, ITEMS[0], {'UPDATE_TIME': '10:00:00', 'BID': '1.2', 'OFFER': '1.3',
+                           'MARKET_STATE': 'TRADEABLE'}),
+            (2, ITEMS[1], {'UPDATE_TIME': '10:00:00', 'BID': '150.1',
+                           'OFFER': '150.2', 'MARKET_STATE': 'TRADEABLE'}),
+            (1, ITEMS[0], {'UPDATE_TIME': '10:00:01', 'BID': '1.2', 'OFFER': '1.31',
+                           'MARKET_STATE': 'TRADEABLE'}),
+            (1, ITEMS[0], {'UPDATE_TIME': '10:00:01', 'BID': '1.2', 'OFFER': '',
+                           'MARKET_STATE': None}),
+        ]
+
+    def test_update_object_is_reused(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        updates = []
+        subscription.addlistener(updates.append)
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3|TRADEABLE')
+        subscription.notifyupdate('1|10:00:01|1.21||')
+
+        assert updates[0] is updates[1]
+        assert updates[1]['values']['BID'] == '1.21'
+        assert '{BID} {OFFER}'.format(**updates[1]['values']) == '1.21 1.3'
+
+    def test_typed_subscription(self):
+        converted = []
+
+        def price(value):
+            converted.append(value)
+            return float(value)
+
+        subscription = TypedSubscription(
+            'MERGE', ITEMS, FIELDS,
+            {'UPDATE_TIME': time_of_day, 'BID': price, 'OFFER': price})
+        updates = []
+        subscription.addlistener(lambda update: updates.append(dict(update['values'])))
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3|TRADEABLE')
+        subscription.notifyupdate('1|10:00:01||1.31|')
+        subscription.notifyupdate('1||#|abc|')
+
+        assert updates[0] == {'UPDATE_TIME': datetime.time(10, 0, 0), 'BID': 1.2,
+                              'OFFER': 1.3, 'MARKET_STATE': 'TRADEABLE'}
+        assert updates[1] == {'UPDATE_TIME': datetime.time(10, 0, 1), 'BID': 1.2,
+                              'OFFER': 1.31, 'MARKET_STATE': 'TRADEABLE'}
+        # null value, unconvertible value kept as is
+        assert updates[2]['BID'] is None
+        assert updates[2]['OFFER'] == 'abc'
+        # unchanged fields are not converted again
+        assert converted == ['1.2', '1.3', '1.31', 'abc']
+
+    def test_changed_fields(self):
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        updates, prices = [], []
+        subscription.addlistener(
+            lambda update: updates.append((update['changed'],
+                                           update.changed_fields())))
+        subscription.addlistener(
+            lambda update: prices.append(update['values']['BID']),
+            fields=['BID', 'OFFER'])
+
+        subscription.notifyupdate('1|10:00:00|1.2|1.3|TRADEABLE')
+        subscription.notifyupdate('1|10:00:01|||')
+        subscription.notifyupdate('1||||EDIT')
+        subscription.notifyupdate('1|10:00:02||1.31|')
+
+        assert updates == [(0b1111, FIELDS), (0b0001, ['UPDATE_TIME']),
+                           (0b1000, ['MARKET_STATE']),
+                           (0b0101, ['UPDATE_TIME', 'OFFER'])]
+        assert prices == ['1.2', '1.2']
+        with pytest.raises(ValueError):
+            subscription.addlistener(print, fields=['CHANGE'])
+
+    def test_command_subscription(self):
+        fields = ['key', 'command', 'SIZE', 'LEVEL']
+        items = ['POSITIONS:ACC1', 'POSITIONS:ACC2']
+        subscription = CommandSubscription(items, fields)
+        updates = []
+        subscription.addlistener(
+            lambda update: updates.append((update['pos'], update['key'],
+                                           update['command'],
+                                           update.changed_fields())))
+        sizes = []
+        subscription.addlistener(lambda update: sizes.append(update.key),
+                                 fields=['SIZE'])
+
+        subscription.notifyupdate('1|D1|ADD|1|1.20')
+        subscription.notifyupdate('1|D2||2|1.30')
+        subscription.notifyupdate('2|D3|ADD|5|150.1')
+        # unchanged values are those of the previous update of the item (D2)
+        subscription.notifyupdate('1|D1|UPDATE||1.25')
+        subscription.notifyupdate(['1', 'D2', 'DELETE', '#', '#'])
+
+        assert subscription.mode == 'COMMAND'
+        assert subscription.table(items[0]) == {
+            'D1': {'key': 'D1', 'command': 'UPDATE', 'SIZE': '2', 'LEVEL': '1.25'}}
+        assert subscription.table(2) == {
+            'D3': {'key': 'D3', 'command': 'ADD', 'SIZE': '5', 'LEVEL': '150.1'}}
+        assert updates == [
+            (1, 'D1', 'ADD', fields),
+            (1, 'D2', 'ADD', fields),
+            (2, 'D3', 'ADD', fields),
+            (1, 'D1', 'UPDATE', ['command', 'SIZE', 'LEVEL']),
+            (1, 'D2', 'DELETE', fields),
+        ]
+        assert sizes == ['D1', 'D2', 'D3', 'D1', 'D2']
+
+        subscription.notifyupdate('1|D1|UPDATE|2|1.26')
+        assert updates[-1] == (1, 'D1', 'UPDATE', ['LEVEL'])
+        assert len(sizes) == 5
+
+        subscription.clear()
+        assert subscription.tables == [{}, {}]
+
+    def test_command_subscription_dispatch(self):
+        subscription = CommandSubscription(ITEMS, ['KEY', 'COMMAND', 'SIZE'],
+                                           key_field='KEY', command_field='COMMAND')
+        dispatcher = Dispatcher()
+        try:
+            updates = []
+            subscription.addlistener(
+                lambda update: updates.append((update['key'], update['command'],
+                                               dict(update['values']))))
+            dispatcher.attach(subscription)
+            subscription.notifyupdate('1|D1|ADD|1')
+            subscription.notifyupdate('1|D1|UPDATE|2')
+            assert dispatcher.join(5)
+        finally:
+            dispatcher.close()
+
+        assert updates == [
+            ('D1', 'ADD', {'KEY': 'D1', 'COMMAND': 'ADD', 'SIZE': '1'}),
+            ('D1', 'UPDATE', {'KEY': 'D1', 'COMMAND': 'UPDATE', 'SIZE': '2'}),
+        ]
+        with pytest.raises(ValueError, match='conflated'):
+            Dispatcher(workers=0).attach(subscription, policy=CONFLATE)
+        with pytest.raises(ValueError, match='key'):
+            CommandSubscription(ITEMS, ['command', 'SIZE'])
+
+
+class TestStreamReader:
+
+    def test_split_chunks(self):
+        data = (u'OK\r\nSessionId:S1\r\n\r\n1,1|10:00:00|\u20ac|1.3\r\n'
+                u'PROBE\r\n1,2|||\r\nEND').encode('utf-8')
+        expected = ['OK', 'SessionId:S1', '', u'1,1|10:00:00|\u20ac|1.3', 'PROBE',
+                    '1,2|||', 'END']
+        # every chunk boundary, including inside CRLF and the euro sign
+        for chunk_size in (1, 2, 3, 5, 7, 64):
+            reader = StreamReader(io.BytesIO(data), chunk_size=chunk_size)
+            lines = [reader.readline() for _ in range(len(expected))]
+            assert lines == expected
+            assert reader.readline() == ''
+            assert list(StreamReader(io.BytesIO(data), chunk_size)) == expected
+
+    def test_bare_line_feeds(self):
+        data = b'OK\nSessionId:S1\r\n\n1,1|10:00:00|1.2|1.3\nPROBE\nEND'
+        expected = ['OK', 'SessionId:S1', '', '1,1|10:00:00|1.2|1.3', 'PROBE', 'END']
+        for chunk_size in (1, 2, 3, 64):
+            reader = StreamReader(io.BytesIO(data), chunk_size=chunk_size)
+            assert [reader.readline() for _ in range(len(expected))] == expected
+            assert list(StreamReader(io.BytesIO(data), chunk_size)) == expected
+        assert StreamReader(io.BytesIO(data)).readlines() == expected
+
+    def test_readline_fallback(self):
+        class Stream:
+            def __init__(self, data):
+                self.lines = io.BytesIO(data).readlines()
+
+            def readline(self):
+                return self.lines.pop(0) if self.lines else b''
+
+        reader = StreamReader(Stream(b'OK\r\nSessionId:S1\r\n\r\nLOOP\r\n'))
+        assert reader.readlines() == ['OK', 'SessionId:S1', '', 'LOOP']
+
+
+class TestLSClient:
+
+    def test_stream(self):
+        stream = (b'OK\r\nSessionId:S1\r\nControlAddress:push.example.com\r\n'
+                  b'\r\nPreamble: test\r\n1,1|10:00:00|1.2|1.3|TRADEABLE\r\n'
+                  b'PROBE\r\n1,2|10:00:00|150.1|150.2|TRADEABLE\r\n1,1|||1.31|\r\n')
+        client = LSClient('https://push.example.com')
+        calls = []
+
+        def call(base_url, url, body):
+            calls.append((base_url.geturl(), url, body))
+            if url.endswith('create_session.txt'):
+                return io.BufferedReader(io.BytesIO(stream))
+            return io.BytesIO(b'OK\r\n')
+
+        client._call = call
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        updates = []
+        subscription.addlistener(lambda update: updates.append(
+            (update['name'], update['values']['OFFER'])))
+        # subscribe before the stream thread reads the updates
+        client._session['SessionId'] = 'S1'
+        client._control_url = client._base_url
+        client.subscribe(subscription)
+        client.connect()
+        client._join()
+
+        assert client._session == {}
+        assert calls[0][2]['LS_op'] == 'add'
+        assert calls[0][2]['LS_id'] == ' '.join(ITEMS)
+        assert updates == [(ITEMS[0], '1.3'), (ITEMS[1], '150.2'), (ITEMS[0], '1.31')]
+
+    def test_recovery(self):
+        streams = [
+            b'OK\r\nSessionId:S1\r\n\r\n1,1|10:00:00|1.2|1.3|TRADEABLE\r\n'
+            b'SYNC ERROR\r\n',
+            b'OK\r\nSessionId:S2\r\n\r\n2,1|10:00:05|150.1|150.2|TRADEABLE\r\n',
+        ]
+        client = LSClient('https://push.example.com',
+                          recovery=Backoff(initial=0.01, attempts=2))
+        calls = []
+
+        def call(base_url, url, body):
+            calls.append((url, body))
+            if url.endswith('create_session.txt'):
+                if not streams:
+                    raise IOError('no more sessions')
+                return io.BufferedReader(io.BytesIO(streams.pop(0)))
+            return io.BytesIO(b'OK\r\nOK\r\n')
+
+        client._call = call
+        subscriptions = [Subscription('MERGE', ITEMS[:1], FIELDS),
+                         Subscription('MERGE', ITEMS[1:], FIELDS)]
+        updates = []
+        for subscription in subscriptions:
+            subscription.addlistener(lambda update: updates.append(
+                (update['name'], update['values']['BID'])))
+        outages = []
+        client.addrecoverylistener(outages.append)
+        client._session['SessionId'] = 'S1'
+        client._control_url = client._base_url
+        keys = [client.subscribe(subscription) for subscription in subscriptions]
+        client.connect()
+        client._join()
+
+        assert updates == [(ITEMS[0], '1.2'), (ITEMS[1], '150.1')]
+        assert len(outages) == 1
+        assert outages[0].cause == 'SYNC ERROR'
+        assert outages[0].attempts == 1
+        assert outages[0].start <= outages[0].end
+        # one batch subscribing again with the same keys
+        urls = [url for (url, body) in calls]
+        assert urls == ['lightstreamer/control.txt'] * 2 + [
+            'lightstreamer/create_session.txt', 'lightstreamer/create_session.txt',
+            'lightstreamer/control.txt', 'lightstreamer/create_session.txt',
+            'lightstreamer/create_session.txt']
+        batch = [dict(parse_qsl(line)) for line in calls[4][1].split(b'\r\n')]
+        assert [(p[b'LS_Table'], p[b'LS_session'], p[b'LS_id']) for p in batch] == [
+            (str(key).encode(), b'S2', item.encode())
+            for (key, item) in zip(keys, ITEMS)]
+        # the second session ended, recovery gave up after 2 attempts
+        assert client._session == {}
+        assert client._subscriptions == {}
+
+    def test_backoff(self):
+        delays = list(Backoff(initial=1, maximum=5, factor=2, jitter=0.5,
+                              attempts=5).delays())
+        assert len(delays) == 5
+        for delay, maximum in zip(delays, [1, 2, 4, 5, 5]):
+            assert maximum / 2 <= delay <= maximum
+        assert list(Backoff(initial=1, jitter=0, attempts=3).delays()) == [1, 2, 4]
+
+    def test_rebind_in_place(self):
+        streams = {
+            'create_session.txt':
+                b'OK\r\nSessionId:S1\r\n\r\n1,1|10:00:00|1.2|1.3|TRADEABLE\r\n'
+                b'LOOP\r\n',
+            'bind_session.txt':
+                b'OK\r\nSessionId:S1\r\n\r\n1,1|10:00:01|1.3|1.4|TRADEABLE\r\n',
+        }
+        client = LSClient('https://push.example.com')
+        calls = []
+
+        def call(base_url, url, body):
+            calls.append(url.rsplit('/', 1)[1])
+            return io.BufferedReader(io.BytesIO(streams[calls[-1]]))
+
+        client._call = call
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        threads = []
+        subscription.addlistener(lambda update: threads.append(
+            (threading.current_thread(), update['values']['BID'])))
+        client._subscriptions[1] = subscription
+        client.connect()
+        client._join()
+
+        assert calls == ['create_session.txt', 'bind_session.txt']
+        # both Stream Connections are read by the same thread
+        assert threads == [(threads[0][0], '1.2'), (threads[0][0], '1.3')]
+        assert threads[0][0].name == 'STREAM-CONN-THREAD'
+
+    def test_prebind(self):
+        first = (b'OK\r\nSessionId:S1\r\n\r\n' +
+                 b''.join(b'1,1|10:00:0%d|1.%d||\r\n' % (i, i) for i in range(8)))
+        streams = {
+            'create_session.txt': first,
+            'bind_session.txt':
+                b'OK\r\nSessionId:S1\r\n\r\n1,1|10:00:08|1.8||\r\n',
+        }
+        client = LSClient('https://push.example.com')
+        client.content_length = len(first)
+        client.prebind = 0.5
+        subscription = Subscription('MERGE', ITEMS, FIELDS)
+        bids = []
+        subscription.addlistener(lambda update: bids.append(
+            update['values']['BID']))
+        calls = []
+
+        class Stream(io.BytesIO):
+            # without read1, read by lines
+            read1 = None
+
+        def call(base_url, url, body):
+            calls.append((url.rsplit('/', 1)[1], len(bids)))
+            return Stream(streams[calls[-1][0]])
+
+        client._call = call
+        client._subscriptions[1] = subscription
+        client.connect()
+        client._join()
+
+        # the next Stream Connection was opened before the end of the first
+        # one, which ended without LOOP
+        assert calls[0] == ('create_session.txt', 0)
+        assert calls[1][0] == 'bind_session.txt'
+        assert 0 < calls[1][1] < 8
+        assert bids == ['1.%d' % i for i in range(9)]
+
+    def test_subscribe_many(self):
+        client = LSClient('https://push.example.com')
+        client._session.update(SessionId='S1', RequestLimit='400')
+        client._control_url = client._base_url
+        bodies = []
+
+        def call(base_url, url, body):
+            bodies.append(body)
+            lines = body.split(b'\r\n')
+            responses = [b'ERROR,17,Bad Data Adapter' if b'LS_data_adapter=BAD' in line
+                         else b'OK' for line in lines]
+            return io.BytesIO(b'\r\n'.join(responses) + b'\r\n')
+
+        client._call = call
+        subscriptions = [Subscription('MERGE', ['L1:EPIC%d' % i], FIELDS)
+                         for i in range(10)]
+        subscriptions[3].adapter = 'BAD'
+        results = client.subscribe_many(subscriptions)
+
+        assert results == [(i, 'ERROR,17,Bad Data Adapter' if i == 4 else 'OK')
+                           for i in range(1, 11)]
+        # batches of lines fitting the request limit
+        assert len(bodies) > 1
+        assert all(len(body) <= 400 for body in bodies)
+        lines = [dict(parse_qsl(line.decode())) for body in bodies
+                 for line in body.split(b'\r\n')]
+        assert [line['LS_Table'] for line in lines] == [str(i) for i in range(1, 11)]
+        assert {line['LS_session'] for line in lines} == {'S1'}
+
+        # the rejected subscription is unregistered
+        assert 4 not in client._subscriptions
+        bodies.clear()
+        results = client.unsubscribe_many([1, 2, 4, 42])
+        assert results == [(1, 'OK'), (2, 'OK')]
+        assert len(bodies) == 1
+        assert sorted(client._subscriptions) == [3] + list(range(5, 11))
+
+    def test_batch_errors(self):
+        client = LSClient('https://push.example.com')
+        client._session.update(SessionId='S1')
+        client._control_url = client._base_url
+
+        def call(base_url, url, body):
+            # errors of the text protocol: ERROR, code and message lines
+            responses = [b'ERROR\r\n17\r\nBad Data Adapter'
+                         if b'LS_data_adapter=BAD' in line else b'OK'
+                         for line in body.split(b'\r\n')]
+            return io.BytesIO(b'\r\n'.join(responses) + b'\r\n')
+
+        client._call = call
+        subscriptions = [Subscription('MERGE', ['L1:EPIC%d' % i], FIELDS)
+                         for i in range(5)]
+        subscriptions[1].adapter = 'BAD'
+        subscriptions[2].adapter = 'BAD'
+        results = client.subscribe_many(subscriptions)
+
+        assert results == [(1, 'OK'), (2, 'ERROR,17,Bad Data Adapter'),
+                           (3, 'ERROR,17,Bad Data Adapter'), (4, 'OK'), (5, 'OK')]
+        assert sorted(client._subscriptions) == [1, 4, 5]
+
+        def call(base_url, url, body):
+            responses = [b'ERROR\r\n19\r\nUnknown table'
+                         if b'LS_Table=4&' in line + b'&' else b'OK'
+                         for line in body.split(b'\r\n')]
+            return io.BytesIO(b'\r\n'.join(responses) + b'\r\n')
+
+        client._call = call
+        results = client.unsubscribe_many([1, 4, 5])
+        assert results == [(1, 'OK'), (4, 'ERROR,19,Unknown table'), (5, 'OK')]
+        assert sorted(client._subscriptions) == [4]
+
+        # a single control request
+        client._call = lambda base_url, url, body: io.BytesIO(
+            b'ERROR\r\n19\r\nUnknown table\r\n')
+        assert client.reconfigure(4, 1) == 'ERROR,19,Unknown table'
+
+    def test_rejected_not_resubscribed(self):
+        client = LSClient('https://push.example.com')
+        client._session.update(SessionId='S1')
+        client._control_url = client._base_url
+        bodies = []
+
+        def call(base_url, url, body):
+            bodies.append(body)
+            responses = [b'ERROR\r\n21\r\nBad item name' if b'BAD' in line
+                         else b'OK' for line in body.split(b'\r\n')]
+            return io.BytesIO(b'\r\n'.join(responses) + b'\r\n')
+
+        client._call = call
+        subscriptions = [Subscription('MERGE', [item], FIELDS)
+                         for item in ['L1:EPIC1', 'L1:BAD', 'L1:EPIC3']]
+        results = client.subscribe_many(subscriptions)
+
+        assert [response for (_, response) in results] == [
+            'OK', 'ERROR,21,Bad item name', 'OK']
+        assert sorted(client._subscriptions) == [1, 3]
+        assert client._subscriptions[3] is subscriptions[2]
+
+        # a new session only subscribes to the tables the server created
+        bodies.clear()
+        client._session.update(SessionId='S2')
+        client._resubscribe()
+        lines = [dict(parse_qsl(line.decode())) for line in bodies[0].split(b'\r\n')]
+        assert [(p['LS_Table'], p['LS_id'], p['LS_session']) for p in lines] == [
+            ('1', 'L1:EPIC1', 'S2'), ('3', 'L1:EPIC3', 'S2')]
+
+    def test_options_and_reconfigure(self):
+        client = LSClient('https://push.example.com')
+        client._session.update(SessionId='S1')
+        client._control_url = client._base_url
+        requests = []
+
+        def call(base_url, url, body):
+            requests.append(dict(body))
+            return io.BytesIO(b'ERROR,13,Unknown table\r\n'
+                              if body['LS_Table'] == 2 else b'OK\r\n')
+
+        client._call = call
+        subscription = Subscription('MERGE', ITEMS, FIELDS, max_frequency=1.0,
+                                    buffer_size=1)
+        key = client.subscribe(subscription)
+        client.subscribe(Subscription('DISTINCT', ITEMS, FIELDS,
+                                      snapshot_length=10))
+
+        assert requests[0]['LS_requested_max_frequency'] == 1.0
+        assert requests[0]['LS_requested_buffer_size'] == 1
+        # the snapshot length in place of true
+        assert requests[0]['LS_snapshot'] == 'true'
+        assert requests[1]['LS_snapshot'] == 10
+        assert 'LS_snapshot_length' not in requests[1]
+        assert requests[1]['LS_requested_max_frequency'] is None
+
+        assert client.reconfigure(key, 'unlimited') == 'OK'
+        assert requests[2] == {'LS_Table': key, 'LS_op': 'reconf',
+                               'LS_requested_max_frequency': 'unlimited',
+                               'LS_session': 'S1'}
+        # kept for the recovery of the session
+        assert subscription.max_frequency == 'unlimited'
+        assert client._subscribe_params(key, subscription)[
+            'LS_requested_max_frequency'] == 'unlimited'
+
+        assert client.reconfigure(2, 5) == 'ERROR,13,Unknown table'
+        assert client._subscriptions[2].max_frequency is None
+        assert client.reconfigure(42, 5) is None
+        assert len(requests) == 4
+
+    def test_split_batches(self):
+        lines = ['a' * 3, 'b' * 4, 'c' * 10, 'd', 'e']
+        assert list(split_batches(lines, 9)) == [
+            ['aaa', 'bbbb'], ['cccccccccc'], ['d', 'e']]
+        assert list(split_batches([], 9)) == []
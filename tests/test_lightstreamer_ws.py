@@ -0,0 +1,136 @@
+from trading_ig.lightstreamer import Subscription
+from trading_ig.lightstreamer_ws import WSLSClient, TLCP_PROTOCOL, parse_update
+from trading_ig.lightstreamer_ws import control_params
+from urllib.parse import parse_qsl
+from websockets.sync.server import serve
+import threading
+
+"""
+unit tests for the WebSocket transport, against a local stand-in
+Lightstreamer server
+"""
+
+FIELDS = ['UPDATE_TIME', 'BID', 'OFFER']
+ITEMS = ['L1:CS.D.GBPUSD.CFD.IP', 'L1:CS.D.USDJPY.CFD.IP']
+
+
+class StandInServer:
+    """Minimal TLCP server: a session, subscriptions answered with
+    scripted updates"""
+
+    def __init__(self, updates):
+        self.updates = updates
+        self.requests = []
+        self.server = serve(self.handler, 'localhost', 0,
+                            subprotocols=[TLCP_PROTOCOL])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://localhost:%d' % self.server.socket.getsockname()[1]
+
+    def handler(self, ws):
+        for message in ws:
+            name, _, query = message.partition('\r\n')
+            params = dict(parse_qsl(query))
+            self.requests.append((name, params))
+            if name == 'create_session':
+                ws.send('SERVNAME,Lightstreamer\r\nCONOK,S1,50000,5000,*\r\n'
+                        'CONS,unlimited\r\n')
+            elif params.get('LS_op') == 'add':
+                sub_id = params['LS_subId']
+                ws.send('REQOK,%s\r\nSUBOK,%s,2,3' % (params['LS_reqId'], sub_id))
+                ws.send('\r\n'.join(u.format(sub_id) for u in self.updates))
+                ws.send('LOOP,0')
+            elif params.get('LS_op') == 'delete':
+                ws.send('REQERR,%s,19,Specified subscription not found'
+                        % params['LS_reqId'])
+            elif params.get('LS_op') == 'destroy':
+                ws.send('REQOK,%s' % params['LS_reqId'])
+                ws.send('END,31,destroy')
+                break
+            elif name == 'bind_session':
+                ws.send('CONOK,S1,50000,5000,*\r\nPROBE')
+
+    def close(self):
+        self.server.shutdown()
+
+
+class TestWSLSClient:
+
+    def test_parse_update(self):
+        assert parse_update('U,3,1,10:00:00|1.2|^2|#|$|%23a|a%7Cb') == \
+            (3, ['1', '10:00:00', '1.2', '', '', '#', '$', '$#a', 'a|b'])
+
+    def test_control_params(self):
+        distinct = Subscription('DISTINCT', ITEMS, FIELDS, snapshot_length=10)
+        merge = Subscription('MERGE', ITEMS, FIELDS, max_frequency=0.5)
+        client = WSLSClient('http://localhost')
+
+        params = control_params(client._subscribe_params(1, distinct))
+        # the snapshot length in place of true
+        assert params['LS_snapshot'] == 10
+        assert 'LS_snapshot_length' not in params
+        assert params['LS_subId'] == 1
+        assert params['LS_group'] == ' '.join(ITEMS)
+        params = control_params(client._subscribe_params(2, merge))
+        assert params['LS_snapshot'] == 'true'
+        assert params['LS_requested_max_frequency'] == 0.5
+        params = control_params(client._reconfigure_params(2, 2))
+        assert params == {'LS_subId': 2, 'LS_op': 'reconf',
+                          'LS_requested_max_frequency': 2}
+
+    def test_stream_and_control(self):
+        server = StandInServer([
+            'U,{0},1,10:00:00|1.2|1.3',
+            'U,{0},2,10:00:00|150.1|150.2',
+            'U,{0},1,10:00:01|^2',
+            'U,{0},1,|%241|$',
+        ])
+        try:
+            client = WSLSClient(server.url, user='ACC', password='CST-a|XST-b',
+                                timeout=5)
+            client.connect()
+            assert client._session['SessionId'] == 'S1'
+
+            subscription = Subscription('MERGE', ITEMS, FIELDS)
+            updates = []
+            done = threading.Event()
+
+            def listener(update):
+                updates.append((update['name'], dict(update['values'])))
+                if len(updates) == 4:
+                    done.set()
+
+            subscription.addlistener(listener)
+            key = client.subscribe(subscription)
+            assert done.wait(5)
+            assert updates == [
+                (ITEMS[0], {'UPDATE_TIME': '10:00:00', 'BID': '1.2', 'OFFER': '1.3'}),
+                (ITEMS[1], {'UPDATE_TIME': '10:00:00', 'BID': '150.1',
+                            'OFFER': '150.2'}),
+                (ITEMS[0], {'UPDATE_TIME': '10:00:01', 'BID': '1.2', 'OFFER': '1.3'}),
+                (ITEMS[0], {'UPDATE_TIME': '10:00:01', 'BID': '$1', 'OFFER': ''}),
+            ]
+
+            # error response to a control request
+            client.unsubscribe(key)
+            assert key in client._subscriptions
+
+            client.destroy()
+            assert client._session == {}
+
+            names = [name for (name, _) in server.requests]
+            # the rebind after LOOP is sent by the stream thread
+            assert names[:2] == ['create_session', 'control']
+            assert sorted(names[2:]) == ['bind_session', 'control', 'control']
+            create, add = server.requests[0][1], server.requests[1][1]
+            assert create['LS_user'] == 'ACC'
+            assert create['LS_password'] == 'CST-a|XST-b'
+            assert add['LS_group'] == ' '.join(ITEMS)
+            assert add['LS_schema'] == ' '.join(FIELDS)
+            assert add['LS_mode'] == 'MERGE'
+            assert add['LS_snapshot'] == 'true'
+        finally:
+            server.close()
@@ -0,0 +1,377 @@
+from trading_ig.rest import IGService
+from trading_ig.async_rest import AsyncIGService
+from trading_ig.bar_store import BarStore
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+import asyncio
+import httpx
+import json
+import pandas as pd
+import re
+import responses
+import threading
+
+"""
+unit tests for historical prices methods
+"""
+
+PRICES_URL = 'https://demo-api.ig.com/gateway/deal/prices/CS.D.EURUSD.MINI.IP'
+
+
+def make_bar(dt, price, fmt='%Y/%m/%d %H:%M:%S'):
+    def level(offset):
+        return {'bid': price + offset, 'ask': price + offset + 0.5,
+                'lastTraded': None}
+    return {
+        'snapshotTime': dt.strftime(fmt),
+        'snapshotTimeUTC': dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        'openPrice': level(0.0),
+        'highPrice': level(2.0),
+        'lowPrice': level(-2.0),
+        'closePrice': level(1.0),
+        'lastTradedVolume': 10,
+    }
+
+
+def make_bars(n, start=datetime(2020, 1, 2), fmt='%Y/%m/%d %H:%M:%S'):
+    return [make_bar(start + timedelta(minutes=i), 100.0 + i, fmt) for i in range(n)]
+
+
+def paged_body(bars, page_size, page_number):
+    pages = (len(bars) + page_size - 1) // page_size
+    page = bars[(page_number - 1) * page_size:page_number * page_size]
+    return {
+        'prices': page,
+        'instrumentType': 'CURRENCIES',
+        'metadata': {
+            'allowance': {'remainingAllowance': 9000, 'totalAllowance': 10000,
+                          'allowanceExpiry': 600000},
+            'size': len(page),
+            'pageData': {'pageSize': page_size, 'pageNumber': page_number,
+                         'totalPages': pages},
+        },
+    }
+
+
+def query(url):
+    return dict((k, v[0]) for (k, v) in parse_qs(urlparse(url).query).items())
+
+
+class TestHistoricalPrices:
+
+    def mock_pages(self, bars):
+        requested = []
+
+        def callback(request):
+            params = query(request.url)
+            requested.append(int(params['pageNumber']))
+            body = paged_body(bars, int(params['pageSize']), int(params['pageNumber']))
+            return (200, {}, json.dumps(body))
+
+        responses.add_callback(responses.GET, PRICES_URL, callback=callback)
+        return requested
+
+    @responses.activate
+    def test_iter_historical_prices(self):
+        bars = make_bars(25)
+        requested = self.mock_pages(bars)
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+
+        pages = list(ig_service.iter_historical_prices(
+            'CS.D.EURUSD.MINI.IP', '1Min', datetime(2020, 1, 2),
+            datetime(2020, 1, 3), pagesize=10))
+
+        assert requested == [1, 2, 3]
+        assert [len(page) for page in pages] == [10, 10, 5]
+        df = pd.concat(pages)
+        assert df.index.is_monotonic_increasing
+        assert df['bid']['Open'].tolist() == [100.0 + i for i in range(25)]
+        assert query(responses.calls[0].request.url)['from'] == '2020-01-02T00:00:00'
+
+    @responses.activate
+    def test_iter_historical_prices_prefetch(self):
+        bars = make_bars(95)
+        requested = self.mock_pages(bars)
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+
+        pages = ig_service.iter_historical_prices(
+            'CS.D.EURUSD.MINI.IP', '1Min', '2020-01-02T00:00:00',
+            '2020-01-03T00:00:00', pagesize=10, prefetch=3)
+        df = pd.concat(pages)
+
+        assert sorted(requested) == list(range(1, 11))
+        assert len(df) == 95
+        assert df['ask']['Close'].tolist() == [101.5 + i for i in range(95)]
+
+    def test_iter_historical_prices_async(self):
+        bars = make_bars(25)
+
+        def handler(request):
+            params = request.url.params
+            body = paged_body(bars, int(params['pageSize']), int(params['pageNumber']))
+            return httpx.Response(200, json=body)
+
+        async def run():
+            session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            async with AsyncIGService('username', 'password', 'api_key', 'DEMO',
+                                      session=session) as ig_service:
+                ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+                pages = ig_service.iter_historical_prices(
+                    'CS.D.EURUSD.MINI.IP', '1Min', datetime(2020, 1, 2),
+                    datetime(2020, 1, 3), pagesize=10, prefetch=2)
+                return [page async for page in pages]
+
+        pages = asyncio.run(run())
+        assert [len(page) for page in pages] == [10, 10, 5]
+
+    # bulk download
+
+    def mock_v1_prices(self, failing=()):
+        requested = []
+
+        def callback(request):
+            epic = urlparse(request.url).path.split('/')[-2]
+            requested.append(epic)
+            if epic in failing:
+                return (500, {}, json.dumps({'errorCode': 'error.unexpected'}))
+            body = {'prices': make_bars(5, fmt='%Y:%m:%d-%H:%M:%S'),
+                    'instrumentType': 'SHARES',
+                    'allowance': {'remainingAllowance': 9000,
+                                  'totalAllowance': 10000,
+                                  'allowanceExpiry': 600000}}
+            return (200, {}, json.dumps(body))
+
+        url = re.compile('https://demo-api.ig.com/gateway/deal/prices/.*/MINUTE')
+        responses.add_callback(responses.GET, url, callback=callback)
+        return requested
+
+    @responses.activate
+    def test_fetch_historical_prices_bulk(self, tmp_path):
+        epics = ['EPIC.%d' % i for i in range(6)]
+        requested = self.mock_v1_prices(failing=['EPIC.3'])
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+        calls = []
+
+        def progress(done, total, epic, error):
+            calls.append((done, total, epic, error is None))
+
+        result = ig_service.fetch_historical_prices_bulk(
+            epics, '1Min', datetime(2020, 1, 2), datetime(2020, 1, 3),
+            max_workers=3, checkpoint=str(tmp_path), progress=progress)
+
+        assert sorted(requested) == epics
+        assert sorted(result['results']) == [e for e in epics if e != 'EPIC.3']
+        assert list(result['errors']) == ['EPIC.3']
+        assert len(result['results']['EPIC.0']['prices']) == 5
+        assert [c[0] for c in calls] == [1, 2, 3, 4, 5, 6]
+        assert ('EPIC.3' in [c[2] for c in calls if not c[3]])
+
+        # resume: only the failed epic is fetched again
+        del requested[:]
+        result = ig_service.fetch_historical_prices_bulk(
+            epics, '1Min', datetime(2020, 1, 2), datetime(2020, 1, 3),
+            checkpoint=str(tmp_path))
+        assert requested == ['EPIC.3']
+        assert len(result['results']) == 5
+        assert len(result['results']['EPIC.5']['prices']) == 5
+
+    @responses.activate
+    def test_fetch_historical_prices_bulk_parameters(self, tmp_path):
+        requested = []
+
+        def callback(request):
+            epic, resolution = urlparse(request.url).path.split('/')[-2:]
+            requested.append((epic, resolution))
+            start = datetime(2020, 1, 2) if resolution == 'MINUTE' else \
+                datetime(2021, 1, 4)
+            body = {'prices': make_bars(2, start, fmt='%Y:%m:%d-%H:%M:%S'),
+                    'instrumentType': 'SHARES'}
+            return (200, {}, json.dumps(body))
+
+        url = re.compile('https://demo-api.ig.com/gateway/deal/prices/.*')
+        responses.add_callback(responses.GET, url, callback=callback)
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+
+        ig_service.fetch_historical_prices_bulk(
+            ['EPIC.1'], '1Min', datetime(2020, 1, 2), datetime(2020, 1, 3),
+            checkpoint=str(tmp_path))
+        # same checkpoint directory, other resolution and date range
+        result = ig_service.fetch_historical_prices_bulk(
+            ['EPIC.1'], 'D', datetime(2021, 1, 1), datetime(2021, 12, 31),
+            checkpoint=str(tmp_path))
+
+        assert requested == [('EPIC.1', 'MINUTE'), ('EPIC.1', 'DAY')]
+        prices = result['results']['EPIC.1']['prices']
+        assert prices.index[0] == pd.Timestamp('2021-01-04')
+
+        # the checkpoint now holds the daily prices
+        del requested[:]
+        result = ig_service.fetch_historical_prices_bulk(
+            ['EPIC.1'], 'D', datetime(2021, 1, 1), datetime(2021, 12, 31),
+            checkpoint=str(tmp_path))
+        assert requested == []
+        assert result['results']['EPIC.1']['prices'].index[0] == \
+            pd.Timestamp('2021-01-04')
+
+    def test_fetch_historical_prices_bulk_async(self, tmp_path):
+
+        def handler(request):
+            body = {'prices': make_bars(5, fmt='%Y:%m:%d-%H:%M:%S'),
+                    'instrumentType': 'SHARES'}
+            return httpx.Response(200, json=body)
+
+        async def run():
+            session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            async with AsyncIGService('username', 'password', 'api_key', 'DEMO',
+                                      session=session) as ig_service:
+                ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+                return await ig_service.fetch_historical_prices_bulk(
+                    ['EPIC.1', 'EPIC.2'], '1Min', datetime(2020, 1, 2),
+                    datetime(2020, 1, 3), checkpoint=str(tmp_path))
+
+        result = asyncio.run(run())
+        assert sorted(result['results']) == ['EPIC.1', 'EPIC.2']
+        assert sorted(p.name for p in tmp_path.iterdir()) == \
+            ['EPIC.1.pickle', 'EPIC.2.pickle']
+
+    # bar store
+
+    def mock_v1_range(self):
+        requested = []
+
+        def callback(request):
+            params = query(request.url)
+            start = datetime.strptime(params['startdate'], '%Y:%m:%d-%H:%M:%S')
+            end = datetime.strptime(params['enddate'], '%Y:%m:%d-%H:%M:%S')
+            requested.append((start, end))
+            bars = []
+            dt = start
+            while dt <= end:
+                hours = (dt - datetime(2020, 1, 1)).total_seconds() / 3600
+                bars.append(make_bar(dt, 100.0 + hours, '%Y:%m:%d-%H:%M:%S'))
+                dt += timedelta(hours=1)
+            return (200, {}, json.dumps({'prices': bars, 'instrumentType': 'SHARES'}))
+
+        url = re.compile('https://demo-api.ig.com/gateway/deal/prices/EPIC/HOUR')
+        responses.add_callback(responses.GET, url, callback=callback)
+        return requested
+
+    @responses.activate
+    def test_bar_store(self, tmp_path):
+        requested = self.mock_v1_range()
+        store = BarStore(str(tmp_path / 'prices.sqlite'))
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO',
+                               bar_store=store)
+        ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+
+        first = ig_service.fetch_historical_prices_by_epic_and_date_range(
+            'EPIC', '1H', datetime(2020, 1, 2), datetime(2020, 1, 3))
+        assert requested == [(datetime(2020, 1, 2), datetime(2020, 1, 3))]
+        assert len(first['prices']) == 25
+        assert first['prices']['bid']['Open'].iloc[0] == 124.0
+
+        # only the missing sub-ranges are downloaded
+        second = ig_service.fetch_historical_prices_by_epic_and_date_range(
+            'EPIC', '1H', '2020-01-01 12:00:00', '2020-01-04')
+        assert requested[1:] == [(datetime(2020, 1, 1, 12), datetime(2020, 1, 2)),
+                                 (datetime(2020, 1, 3), datetime(2020, 1, 4))]
+        assert len(second['prices']) == 61
+        assert second['prices'].index.is_unique
+        pd.testing.assert_frame_equal(second['prices'].loc[first['prices'].index],
+                                      first['prices'])
+
+        # fully covered range: no request
+        ig_service.fetch_historical_prices_by_epic_and_date_range(
+            'EPIC', '1H', datetime(2020, 1, 2, 6), datetime(2020, 1, 3, 6))
+        assert len(requested) == 3
+
+    def test_bar_store_missing(self, tmp_path):
+        store = BarStore(str(tmp_path / 'prices.sqlite'))
+        store.save('EPIC', 'DAY', None, '2020-01-10', '2020-01-20')
+        store.save('EPIC', 'DAY', None, '2020-01-15', '2020-01-25')
+        store.save('EPIC', 'DAY', None, '2020-02-01', '2020-02-10')
+        assert store.missing('EPIC', 'DAY', '2020-01-01', '2020-02-15') == [
+            (pd.Timestamp('2020-01-01'), pd.Timestamp('2020-01-10')),
+            (pd.Timestamp('2020-01-25'), pd.Timestamp('2020-02-01')),
+            (pd.Timestamp('2020-02-10'), pd.Timestamp('2020-02-15')),
+        ]
+        assert store.missing('EPIC', 'DAY', '2020-01-12', '2020-01-22') == []
+        assert store.missing('EPIC', 'HOUR', '2020-01-12', '2020-01-22') == [
+            (pd.Timestamp('2020-01-12'), pd.Timestamp('2020-01-22'))]
+
+    def test_bar_store_recent(self, tmp_path):
+        # 2020-01-03 12:00 UTC
+        now = datetime(2020, 1, 3, 12).replace(tzinfo=timezone.utc).timestamp()
+        store = BarStore(str(tmp_path / 'prices.sqlite'), clock=lambda: now)
+        index = pd.DatetimeIndex([datetime(2020, 1, 3, 22), datetime(2020, 1, 3, 23)],
+                                 name='DateTime')
+        prices = pd.DataFrame({('bid', 'Open'): [1.0, 2.0]}, index=index)
+
+        # snapshot times ahead of UTC: covered up to the last bar
+        store.save('EPIC', 'HOUR', prices, '2020-01-03 20:00', '2020-01-04')
+        assert store.missing('EPIC', 'HOUR', '2020-01-03 20:00', '2020-01-04') == [
+            (pd.Timestamp('2020-01-03 23:00'), pd.Timestamp('2020-01-04'))]
+        # no bar yet: only covered up to 12 hours before UTC
+        store.save('EPIC', 'DAY', None, '2020-01-01', '2020-01-04')
+        assert store.missing('EPIC', 'DAY', '2020-01-01', '2020-01-04') == [
+            (pd.Timestamp('2020-01-03'), pd.Timestamp('2020-01-04'))]
+
+    def test_bar_store_async(self, tmp_path):
+        threads = []
+
+        class Store(BarStore):
+            def _connect(self):
+                threads.append(threading.current_thread())
+                return super(Store, self)._connect()
+
+        def handler(request):
+            bars = [make_bar(datetime(2020, 1, 2, h), 100.0 + h, '%Y:%m:%d-%H:%M:%S')
+                    for h in range(3)]
+            return httpx.Response(200, json={'prices': bars,
+                                             'instrumentType': 'SHARES'})
+
+        store = Store(str(tmp_path / 'prices.sqlite'))
+        threads.clear()
+
+        async def run():
+            session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            async with AsyncIGService('username', 'password', 'api_key', 'DEMO',
+                                      session=session, bar_store=store) as ig_service:
+                ig_service.crud_session.HEADERS["LOGGED_IN"] = {}
+                data = await ig_service.fetch_historical_prices_by_epic_and_date_range(
+                    'EPIC', '1H', datetime(2020, 1, 2), datetime(2020, 1, 2, 2))
+                return data, threading.current_thread()
+
+        data, loop_thread = asyncio.run(run())
+        assert len(data['prices']) == 3
+        # missing, save and load, off the event loop
+        assert len(threads) == 3
+        assert loop_thread not in threads
+
+    # formatting
+
+    def test_format_prices(self):
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        bars = make_bars(3, fmt='%Y:%m:%d-%H:%M:%S')
+        bars[1]['closePrice']['bid'] = None
+        df = ig_service.format_prices(bars, 1, flag_calc_spread=True)
+
+        assert list(df.columns.get_level_values(0).unique()) == \
+            ['bid', 'ask', 'spread', 'last']
+        assert df.index.name == 'DateTime'
+        assert df.index[2] == pd.Timestamp('2020-01-02 00:02:00')
+        assert df['ask']['High'].tolist() == [102.5, 103.5, 104.5]
+        assert df['spread']['Open'].tolist() == [0.5, 0.5, 0.5]
+        assert pd.isnull(df['bid']['Close'].iloc[1])
+        assert df['last']['Volume'].tolist() == [10, 10, 10]
+
+        bars = make_bars(2)
+        for bar in bars:
+            bar['lastTradedVolume'] = None
+        df = ig_service.format_prices(bars, 3)
+        assert list(df.columns.get_level_values(0).unique()) == ['bid', 'ask']
+        assert df.index[1] == pd.Timestamp('2020-01-02 00:01:00')
@@ -0,0 +1,151 @@
+from trading_ig.scheduler import TokenBucket, RequestScheduler, RateLimitException
+from trading_ig.rest import IGService
+import asyncio
+import time
+import threading
+import pytest
+
+"""
+unit tests for the request scheduler
+"""
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(30, 60.0, clock)
+        assert bucket.level == 30
+        bucket.consume(30)
+        assert bucket.level == 0
+        assert bucket.wait_time(1) == pytest.approx(2.0)
+        clock.now = 10.0
+        assert bucket.level == pytest.approx(5)
+        assert bucket.wait_time(1) == 0
+        clock.now = 1000.0
+        assert bucket.level == 30
+
+    def test_set_level(self):
+        bucket = TokenBucket(10000, 7 * 24 * 3600.0, FakeClock())
+        bucket.set_level(250)
+        assert bucket.level == 250
+        bucket.set_level(20000)
+        assert bucket.level == 10000
+
+
+class TestRequestScheduler:
+
+    def test_classify(self):
+        scheduler = RequestScheduler()
+        assert scheduler.classify('create', '/positions/otc') == {'trading': 1}
+        assert scheduler.classify('delete', '/workingorders/otc/DIAAA') == \
+            {'trading': 1}
+        assert scheduler.classify('read', '/positions') == {'non_trading': 1}
+        assert scheduler.classify('read', '/prices/CS.D.EURUSD.MINI.IP',
+                                  {'max': 500}) == \
+            {'non_trading': 1, 'historical': 500}
+        assert scheduler.classify('read', '/prices/CS.D.EURUSD.MINI.IP/DAY/10',
+                                  {}) == {'non_trading': 1, 'historical': 10}
+        # at most the capacity of the allowance
+        assert scheduler.classify('read', '/prices/CS.D.EURUSD.MINI.IP',
+                                  {'pageSize': 20000})['historical'] == 10000
+
+    def test_large_request(self):
+        scheduler = RequestScheduler({'historical': (100, 3600.0)}, max_wait=1.0)
+        assert scheduler.acquire('read', '/prices/EPIC', {'max': 500}) < 0.05
+        # the bucket is empty, not below zero
+        assert scheduler.stats()['historical']['level'] == pytest.approx(0, abs=0.1)
+
+    def test_acquire_queues(self):
+        scheduler = RequestScheduler({'non_trading': (2, 0.2)})
+        start = time.monotonic()
+        for i in range(4):
+            scheduler.acquire('read', '/accounts')
+        # 2 requests immediately, then one every 0.1 s
+        assert time.monotonic() - start >= 0.18
+
+    def test_allowances_are_independent(self):
+        scheduler = RequestScheduler({'trading': (1, 60.0), 'non_trading': (5, 60.0)})
+        scheduler.acquire('create', '/positions/otc')
+        waiter = threading.Thread(target=scheduler.acquire,
+                                  args=('create', '/positions/otc'), daemon=True)
+        waiter.start()
+        time.sleep(0.05)
+        assert scheduler.stats()['trading']['queued'] == 1
+        # data reads don't wait behind the queued trading request
+        assert scheduler.acquire('read', '/accounts') < 0.05
+
+    def test_max_wait(self):
+        scheduler = RequestScheduler({'historical': (100, 3600.0)}, max_wait=1.0)
+        scheduler.acquire('read', '/prices/EPIC', {'max': 100})
+        with pytest.raises(RateLimitException):
+            scheduler.acquire('read', '/prices/EPIC', {'max': 100})
+        assert scheduler.stats()['historical']['queued'] == 0
+
+    def test_acquire_async(self):
+        scheduler = RequestScheduler({'non_trading': (2, 0.2)})
+
+        async def run():
+            coros = [scheduler.acquire_async('read', '/accounts') for i in range(4)]
+            return await asyncio.gather(*coros)
+
+        waits = asyncio.run(run())
+        assert max(waits) >= 0.09
+
+    def test_stats(self):
+        scheduler = RequestScheduler()
+        scheduler.acquire('read', '/accounts')
+        stats = scheduler.stats()
+        assert stats['non_trading']['capacity'] == 30
+        assert stats['non_trading']['level'] == pytest.approx(29, abs=0.1)
+        assert stats['trading']['level'] == 100
+        assert scheduler.limits['historical'] == (10000, 7 * 24 * 3600.0)
+
+    def test_default_off(self):
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        assert ig_service.scheduler is None
+        ig_service._update_allowance({'allowance': {'remainingAllowance': 1}})
+
+    def test_update_allowance(self):
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO',
+                               rate_limit=True)
+        ig_service._update_allowance({'metadata': {'allowance': {
+            'remainingAllowance': 1234, 'totalAllowance': 10000,
+            'allowanceExpiry': 600000}}})
+        level = ig_service.scheduler.stats()['historical']['level']
+        assert level == pytest.approx(1234, abs=1)
+
+    def test_dealing_lane_first(self):
+        scheduler = RequestScheduler({'non_trading': (1, 0.3)})
+        scheduler.acquire('read', '/markets')
+        granted = []
+
+        def acquire(endpoint):
+            scheduler.acquire('read', endpoint)
+            granted.append(endpoint)
+
+        threads = []
+        for endpoint in ['/markets', '/markets', '/confirms/REF']:
+            thread = threading.Thread(target=acquire, args=(endpoint,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.02)
+        assert scheduler.lane_stats()['dealing']['queued'] == 1
+        for thread in threads:
+            thread.join(2)
+
+        assert granted == ['/confirms/REF', '/markets', '/markets']
+        stats = scheduler.lane_stats()
+        assert stats['dealing']['requests'] == 1
+        assert stats['data']['requests'] == 3
+        assert stats['data']['max_wait'] > stats['dealing']['max_wait'] > 0
+        assert stats['data']['queued'] == 0
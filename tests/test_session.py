@@ -2,6 +2,7 @@ from trading_ig.rest import IGService, IGException
 import responses
 import json
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 
 """
 unit tests for session methods
@@ -287,3 +288,54 @@ class TestSession:
 
         assert result['trailingStopsEnabled'] is True
         assert result['dealingEnabled'] is True
+
+    # per request headers
+
+    @responses.activate
+    def test_headers_per_instance(self):
+
+        responses.add(responses.POST, 'https://demo-api.ig.com/gateway/deal/session',
+                      headers={'CST': 'abc123', 'X-SECURITY-TOKEN': 'xyz987'},
+                      json={},
+                      status=200)
+
+        ig_service_1 = IGService('username', 'password', 'api_key_1', 'DEMO')
+        ig_service_2 = IGService('username', 'password', 'api_key_2', 'DEMO')
+        ig_service_1.create_session()
+
+        assert ig_service_1.crud_session.HEADERS['BASIC']['X-IG-API-KEY'] == 'api_key_1'
+        assert ig_service_2.crud_session.HEADERS['BASIC']['X-IG-API-KEY'] == 'api_key_2'
+        assert 'LOGGED_IN' in ig_service_1.crud_session.HEADERS
+        assert 'LOGGED_IN' not in ig_service_2.crud_session.HEADERS
+        assert ig_service_2.crud_session.CLIENT_TOKEN is None
+
+    @responses.activate
+    def test_version_headers_thread_pool(self):
+
+        responses.add(responses.POST, 'https://demo-api.ig.com/gateway/deal/session',
+                      headers={'CST': 'abc123', 'X-SECURITY-TOKEN': 'xyz987'},
+                      json={},
+                      status=200)
+
+        def callback(request):
+            body = {'version': request.headers['VERSION']}
+            return (200, {}, json.dumps(body))
+
+        responses.add_callback(responses.GET,
+                               'https://demo-api.ig.com/gateway/deal/session',
+                               callback=callback)
+
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO',
+                               rate_limit=False)
+        ig_service.create_session()
+
+        def read(version):
+            response = ig_service._req('read', '/session', {}, None, version)
+            return json.loads(response.text)['version']
+
+        versions = [str(i % 3 + 1) for i in range(60)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(read, versions))
+
+        assert results == versions
+        assert 'VERSION' not in ig_service.crud_session.HEADERS['LOGGED_IN']
@@ -0,0 +1,195 @@
+from trading_ig.lightstreamer import Subscription, LSClient, Outage
+from trading_ig.sharding import ShardedLSClient, item_shard
+from trading_ig.stream import IGStreamService
+from types import SimpleNamespace
+import io
+import pytest
+
+"""
+unit tests for the subscriptions spread over several Lightstreamer sessions
+"""
+
+FIELDS = ['UPDATE_TIME', 'BID', 'OFFER']
+
+
+def make_client(session_id):
+    """LSClient of a session answering OK to every control request"""
+    client = LSClient('https://push.example.com')
+    client._session.update(SessionId=session_id, RequestLimit='50000')
+    client._control_url = client._base_url
+    client.bodies = []
+
+    def call(base_url, url, body):
+        client.bodies.append(body)
+        if isinstance(body, dict):
+            return io.BytesIO(b'OK\r\n')
+        return io.BytesIO(b'\r\n'.join(b'OK' for _ in body.split(b'\r\n')) + b'\r\n')
+
+    client._call = call
+    return client
+
+
+def subscribed_items(client):
+    return sorted(s.item_names[0] for s in client._subscriptions.values())
+
+
+def epic_subscriptions(count):
+    return [Subscription('MERGE', ['L1:EPIC%d' % i], FIELDS) for i in range(count)]
+
+
+class TestShardedLSClient:
+
+    def test_hash(self):
+        clients = [make_client('S%d' % i) for i in range(3)]
+        ls_client = ShardedLSClient(clients)
+        subscriptions = epic_subscriptions(12)
+
+        key = ls_client.subscribe(subscriptions[0])
+        results = ls_client.subscribe_many(subscriptions[1:])
+
+        assert key == 1
+        assert results == [(i, 'OK') for i in range(2, 13)]
+        # every subscription in the shard of its items
+        for shard, client in enumerate(clients):
+            assert subscribed_items(client) == sorted(
+                s.item_names[0] for s in subscriptions
+                if item_shard(s.item_names, 3) == shard)
+        assert sum(len(c._subscriptions) for c in clients) == 12
+        # one batch of control requests per shard
+        shards = [item_shard(s.item_names, 3) for s in subscriptions]
+        assert [len(c.bodies) for c in clients] == [
+            (shards[0] == shard) + (shard in shards[1:]) for shard in range(3)]
+
+        results = ls_client.unsubscribe_many([1, 5, 42])
+        assert results == [(1, 'OK'), (5, 'OK')]
+        ls_client.unsubscribe(2)
+        assert sorted(ls_client._subscriptions) == [3, 4] + list(range(6, 13))
+        assert sum(len(c._subscriptions) for c in clients) == 9
+        assert sum(s['items'] for s in ls_client.stats()) == 9
+
+        shard, shard_key = ls_client._shard_keys[3]
+        assert ls_client.reconfigure(3, 1.0) == 'OK'
+        assert clients[shard].bodies[-1]['LS_op'] == 'reconf'
+        assert clients[shard].bodies[-1]['LS_Table'] == shard_key
+        assert ls_client._subscriptions[3].max_frequency == 1.0
+        assert ls_client.reconfigure(42, 1.0) is None
+
+    def test_load(self):
+        clients = [make_client('S%d' % i) for i in range(3)]
+        ls_client = ShardedLSClient(clients, strategy='load')
+        ls_client.subscribe(Subscription('MERGE', ['L1:A', 'L1:B', 'L1:C'], FIELDS))
+        ls_client.subscribe_many(epic_subscriptions(5))
+
+        # the other shards get the single items
+        assert [len(c._subscriptions) for c in clients] == [1, 3, 2]
+        assert [s['items'] for s in ls_client.stats()] == [3, 3, 2]
+
+        ls_client.unsubscribe(1)
+        ls_client.subscribe(Subscription('MERGE', ['L1:D'], FIELDS))
+        assert subscribed_items(clients[0]) == ['L1:D']
+        assert [s['items'] for s in ls_client.stats()] == [1, 3, 2]
+
+    def test_stats(self):
+        clients = [make_client('S%d' % i) for i in range(2)]
+        ls_client = ShardedLSClient(clients)
+        subscription = Subscription('MERGE', ['L1:EPIC0'], FIELDS)
+        received = []
+        subscription.addlistener(lambda item: received.append(item['values']))
+        ls_client.subscribe(subscription)
+        shard = item_shard(subscription.item_names, 2)
+        client = clients[shard]
+
+        # the listeners of the subscription get the updates of its shard
+        client._forward_update_message('1,1|10:00:00|1.2|1.3')
+        client._forward_update_message('1,1|10:00:01|1.3|')
+        client._recovery_listeners[0](Outage(None, None, 'END,41', 1))
+
+        assert received[-1] == {'UPDATE_TIME': '10:00:01', 'BID': '1.3',
+                                'OFFER': '1.3'}
+        stats = ls_client.stats()
+        assert [s['session'] for s in stats] == ['S0', 'S1']
+        assert stats[shard]['updates'] == 2
+        assert stats[shard]['updates_per_second'] > 0
+        assert stats[shard]['outages'] == 1
+        assert stats[shard]['subscriptions'] == 1
+        assert stats[1 - shard]['updates'] == 0
+        assert stats[1 - shard]['outages'] == 0
+        assert not any(s['connected'] for s in stats)
+        # the rate is measured since the previous call
+        assert ls_client.stats()[shard]['updates_per_second'] == 0
+
+    def test_subscribe_many_error(self):
+        clients = [make_client('S%d' % i) for i in range(2)]
+        ls_client = ShardedLSClient(clients, strategy='load')
+
+        def call(base_url, url, body):
+            raise IOError('connection reset')
+
+        clients[1]._call = call
+        results = ls_client.subscribe_many(epic_subscriptions(4))
+
+        # shard 1 failed: its subscriptions are dropped
+        assert results == [(1, 'OK'), (2, 'ERROR,connection reset'),
+                           (3, 'OK'), (4, 'ERROR,connection reset')]
+        assert sorted(ls_client._subscriptions) == [1, 3]
+        assert sorted(ls_client._shard_keys) == [1, 3]
+        assert [s['items'] for s in ls_client.stats()] == [2, 0]
+        assert [len(c._subscriptions) for c in clients] == [2, 0]
+        assert ls_client.unsubscribe_many([1, 2, 3]) == [(1, 'OK'), (3, 'OK')]
+
+    def test_rejected_subscription(self):
+        clients = [make_client('S%d' % i) for i in range(2)]
+        ls_client = ShardedLSClient(clients, strategy='load')
+
+        def call(base_url, url, body):
+            return io.BytesIO(b'ERROR\r\n21\r\nBad item name\r\n')
+
+        clients[1]._call = call
+        results = ls_client.subscribe_many(epic_subscriptions(2))
+
+        # unregistered by the shard client and by the sharded client
+        assert results == [(1, 'OK'), (2, 'ERROR,21,Bad item name')]
+        assert sorted(ls_client._subscriptions) == [1]
+        assert [len(c._subscriptions) for c in clients] == [1, 0]
+        assert [s['items'] for s in ls_client.stats()] == [1, 0]
+        assert ls_client.unsubscribe_many([1, 2]) == [(1, 'OK')]
+
+    def test_strategy(self):
+        with pytest.raises(ValueError, match='strategy'):
+            ShardedLSClient([make_client('S0')], strategy='random')
+
+
+class TestIGStreamService:
+
+    def make_service(self, **kwargs):
+        ig_service = SimpleNamespace(
+            crud_session=SimpleNamespace(CLIENT_TOKEN='a', SECURITY_TOKEN='b'))
+        ig_stream_service = IGStreamService(ig_service, **kwargs)
+        ig_stream_service.ig_session = {
+            'lightstreamerEndpoint': 'https://push.example.com'}
+        return ig_stream_service
+
+    def test_shards(self):
+        ls_client = self.make_service()._new_ls_client('ACC')
+        assert isinstance(ls_client, LSClient)
+
+        ls_client = self.make_service(shards=3, sharding='load')._new_ls_client('ACC')
+        assert isinstance(ls_client, ShardedLSClient)
+        assert ls_client.strategy == 'load'
+        assert len(ls_client.clients) == 3
+        assert len({id(c) for c in ls_client.clients}) == 3
+        assert {c._user for c in ls_client.clients} == {'ACC'}
+        assert {c._password for c in ls_client.clients} == {'CST-a|XST-b'}
+
+    def test_invalid(self):
+        with pytest.raises(ValueError, match='shards'):
+            self.make_service(shards=0)
+        with pytest.raises(ValueError, match='sharding'):
+            self.make_service(shards=2, sharding='random')
+
+
+def test_item_shard():
+    # the same shard in every process (unlike hash())
+    assert item_shard(['L1:CS.D.GBPUSD.CFD.IP'], 4) == item_shard(
+        ['L1:CS.D.GBPUSD.CFD.IP'], 4)
+    assert {item_shard(['L1:EPIC%d' % i], 4) for i in range(100)} == {0, 1, 2, 3}
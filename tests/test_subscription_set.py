@@ -0,0 +1,177 @@
+from trading_ig.lightstreamer import LSClient
+from trading_ig.subscription_set import SubscriptionSet
+from urllib.parse import parse_qsl
+import io
+import pytest
+
+"""
+unit tests for the subscriptions to a changing set of epics
+"""
+
+FIELDS = ['UPDATE_TIME', 'BID', 'OFFER']
+EPICS = ['CS.D.GBPUSD.CFD.IP', 'CS.D.USDJPY.CFD.IP', 'CS.D.EURUSD.CFD.IP']
+
+
+def make_client():
+    """LSClient of a session answering OK to every control request, except
+    those unsubscribing subscription keys of client.failing and those
+    subscribing to items of client.rejected"""
+    client = LSClient('https://push.example.com')
+    client._session.update(SessionId='S1', RequestLimit='50000')
+    client._control_url = client._base_url
+    client.requests = []
+    client.failing = set()
+    client.rejected = set()
+
+    def call(base_url, url, body):
+        lines = [dict(parse_qsl(line)) for line in body.decode().split('\r\n')]
+        client.requests.append([(p['LS_op'], p.get('LS_id', p['LS_Table']))
+                                for p in lines])
+        responses = [b'ERROR\r\n19\r\nUnknown table'
+                     if p['LS_op'] == 'delete' and int(p['LS_Table']) in client.failing
+                     else b'ERROR\r\n21\r\nBad item name'
+                     if p['LS_op'] == 'add' and p['LS_id'] in client.rejected
+                     else b'OK' for p in lines]
+        return io.BytesIO(b'\r\n'.join(responses) + b'\r\n')
+
+    client._call = call
+    return client
+
+
+class TestSubscriptionSet:
+
+    def test_update(self):
+        client = make_client()
+        watched = SubscriptionSet(client, FIELDS)
+
+        added, removed = watched.update(EPICS[:2])
+
+        assert (added, removed) == (EPICS[:2], [])
+        assert watched.epics == EPICS[:2]
+        assert client.requests == [[('add', 'L1:' + EPICS[0]),
+                                    ('add', 'L1:' + EPICS[1])]]
+
+        kept = watched.subscriptions[EPICS[0]]
+        client._forward_update_message('1,1|10:00:00|1.2|1.3')
+        client.requests.clear()
+        added, removed = watched.update(EPICS[0::2])
+
+        # only the changed epics
+        assert (added, removed) == ([EPICS[2]], [EPICS[1]])
+        assert client.requests == [[('delete', '2')], [('add', 'L1:' + EPICS[2])]]
+        assert watched.epics == EPICS[0::2]
+        assert EPICS[0] in watched and EPICS[1] not in watched
+        assert sorted(client._subscriptions) == [1, 3]
+        # the epic which stays keeps its subscription and item state
+        assert watched.subscriptions[EPICS[0]] is kept
+        assert kept._items[0].values['BID'] == '1.2'
+
+        client.requests.clear()
+        assert watched.update(reversed(EPICS[0::2])) == ([], [])
+        assert client.requests == []
+
+    def test_fields(self):
+        client = make_client()
+        watched = SubscriptionSet(client, FIELDS)
+        watched.update(EPICS[:2])
+        client.requests.clear()
+
+        added, removed = watched.update(EPICS[:2], fields=['BID', 'OFFER'])
+
+        # the fields of a subscription can't change, every epic again
+        assert (added, removed) == (EPICS[:2], EPICS[:2])
+        assert client.requests == [
+            [('delete', '1'), ('delete', '2')],
+            [('add', 'L1:' + EPICS[0]), ('add', 'L1:' + EPICS[1])]]
+        assert [s.field_names for s in watched.subscriptions.values()] == [
+            ['BID', 'OFFER']] * 2
+
+    def test_listeners(self):
+        client = make_client()
+        watched = SubscriptionSet(client, FIELDS)
+        received = []
+
+        def listener(item):
+            received.append((item.name, item.values['BID']))
+
+        watched.update(EPICS[:1])
+        watched.addlistener(listener, fields=['BID'])
+        watched.update(EPICS[:2])
+
+        client._forward_update_message('1,1|10:00:00|1.2|1.3')
+        client._forward_update_message('2,1|10:00:00|150.1|150.2')
+        client._forward_update_message('2,1|10:00:01||150.3')
+        assert received == [('L1:' + EPICS[0], '1.2'), ('L1:' + EPICS[1], '150.1')]
+
+        with pytest.raises(ValueError, match='BID'):
+            watched.update(EPICS[:2], fields=['OFFER'])
+        assert watched.fields == FIELDS
+
+        watched.removelistener(listener)
+        client._forward_update_message('1,1|10:00:01|1.3|')
+        assert len(received) == 2
+
+    def test_failed_unsubscribe(self):
+        client = make_client()
+        watched = SubscriptionSet(client, FIELDS)
+        watched.update(EPICS)
+        client.failing.add(2)
+
+        added, removed = watched.update([])
+
+        # an epic which can't be unsubscribed stays in the set
+        assert (added, removed) == ([], [EPICS[0], EPICS[2]])
+        assert watched.epics == [EPICS[1]]
+        client.failing.clear()
+        assert watched.clear() == [EPICS[1]]
+        assert len(watched) == 0
+
+    def test_failed_subscribe(self):
+        client = make_client()
+        watched = SubscriptionSet(client, FIELDS)
+        client.rejected.add('L1:' + EPICS[1])
+
+        received = []
+        watched.addlistener(lambda item: received.append(item.name))
+        added, removed = watched.update(EPICS)
+
+        # an epic which can't be subscribed stays out of the set
+        assert (added, removed) == ([EPICS[0], EPICS[2]], [])
+        assert watched.failed == {EPICS[1]: 'ERROR,21,Bad item name'}
+        assert watched.epics == [EPICS[0], EPICS[2]]
+        assert EPICS[1] not in watched
+        # and out of the client
+        assert sorted(client._subscriptions) == [1, 3]
+        client.rejected.clear()
+        client.requests.clear()
+        added, removed = watched.update(EPICS)
+        # and is subscribed again by the next update
+        assert (added, removed) == ([EPICS[1]], [])
+        assert watched.failed == {}
+        assert client.requests == [[('add', 'L1:' + EPICS[1])]]
+        assert watched.epics == [EPICS[0], EPICS[2], EPICS[1]]
+        # a single subscription of each epic
+        assert sorted(client._subscriptions) == [1, 3, 4]
+        assert [s.item_names for s in client._subscriptions.values()] == [
+            ['L1:' + EPICS[0]], ['L1:' + EPICS[2]], ['L1:' + EPICS[1]]]
+
+        # a new session subscribes again to the subscriptions of the client
+        client.requests.clear()
+        client._resubscribe()
+        assert client.requests == [[('add', 'L1:' + epic) for epic in watched.epics]]
+        client._forward_update_message('4,1|10:00:00|150.1|150.2')
+        assert received == ['L1:' + EPICS[1]]
+
+    def test_unknown_keys(self):
+        client = make_client()
+        watched = SubscriptionSet(client, FIELDS)
+        watched.update(EPICS)
+        # the client dropped its subscriptions
+        client._subscriptions.clear()
+
+        added, removed = watched.update(EPICS[:1])
+
+        assert (added, removed) == ([], EPICS[1:])
+        assert watched.epics == EPICS[:1]
+        assert watched.clear() == EPICS[:1]
+        assert len(watched) == 0
@@ -1,4 +1,7 @@
-from trading_ig.utils import conv_datetime
+from trading_ig.utils import conv_datetime, json_decoder
+from trading_ig.rest import IGService
+import json
+import pytest
 
 """
 Unit tests for utils module
@@ -18,3 +21,28 @@ class TestUtils:
     def test_conv_datetime_format_3(self):
         result = conv_datetime('2020/03/01', 3)
         assert result == '2020/03/01 00:00:00'
+
+    def test_json_decoder(self):
+        content = '{"epic": "CS.D.EURUSD.MINI.IP", "bid": 1.1, "name": "\u20ac"}'
+        expected = json.loads(content)
+        assert json_decoder()(content.encode('utf-8')) == expected
+        assert json_decoder('json')(content.encode('utf-8')) == expected
+        with pytest.raises(ValueError):
+            json_decoder('yaml')
+
+    def test_parse_response_bytes(self):
+        ig_service = IGService('username', 'password', 'api_key', 'DEMO')
+        decoded = []
+
+        def json_loads(content):
+            decoded.append(content)
+            return json.loads(content)
+
+        ig_service.json_loads = json_loads
+        assert ig_service.parse_response(b'{"dealReference": "REF"}') == \
+            {'dealReference': 'REF'}
+        with pytest.raises(Exception) as error:
+            ig_service.parse_response(b'{"errorCode": "error.security.invalid"}')
+        assert str(error.value) == 'error.security.invalid'
+        assert decoded == [b'{"dealReference": "REF"}',
+                           b'{"errorCode": "error.security.invalid"}']
@@ -23,11 +23,15 @@ from .version import (
 )
 
 from .rest import IGService
+from .async_rest import AsyncIGService
 from .stream import IGStreamService
+from .async_stream import AsyncIGStreamService
 
 __all__ = [
     "IGService",
+    "AsyncIGService",
     "IGStreamService",
+    "AsyncIGStreamService",
     "__author__",
     "__copyright__",
     "__credits__",
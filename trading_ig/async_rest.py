@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+IG Markets REST API Library for Python - asyncio client
+AsyncIGService runs the request flows of IGService as coroutines, so both
+clients share the same endpoint, params and DataFrame logic.
+"""
+
+import functools
+import logging
+from collections import deque
+from importlib.util import find_spec
+from itertools import islice
+
+from .rest import IGService
+
+# httpx and asyncio are only imported when they are used, so that
+# importing trading_ig stays fast for synchronous clients
+_HAS_HTTPX = find_spec("httpx") is not None
+
+logger = logging.getLogger(__name__)
+
+
+def _httpx_kwargs(kwargs):
+    """Converts requests style keyword arguments (see IGSessionCRUD.prepare)
+    to httpx ones"""
+    kwargs = dict(kwargs)
+    if "data" in kwargs:
+        kwargs["content"] = kwargs.pop("data")
+    # requests silently drops headers set to None (X-SECURITY-TOKEN can be)
+    kwargs["headers"] = dict(
+        (k, v) for (k, v) in kwargs["headers"].items() if v is not None
+    )
+    return kwargs
+
+
+class AsyncIGService(IGService):
+    """asyncio version of IGService, every method sending requests
+    is a coroutine (same name, same parameters, same return value)
+
+        async with AsyncIGService(username, password, api_key, "DEMO") as ig:
+            await ig.create_session()
+            accounts = await ig.fetch_accounts()
+
+    Requests are sent with an httpx.AsyncClient whose connection pool
+    is shared by all the coroutines of the service.
+    """
+
+    MAX_CONNECTIONS = 20
+
+    def __init__(
+        self,
+        username,
+        password,
+        api_key,
+        acc_type="demo",
+        session=None,
+        rate_limit=False,
+        bar_store=None,
+        max_connections=None,
+    ):
+        if not _HAS_HTTPX:
+            raise ImportError("AsyncIGService requires httpx (pip install httpx)")
+        if max_connections is None:
+            max_connections = self.MAX_CONNECTIONS
+        self.max_connections = max_connections
+        super(AsyncIGService, self).__init__(
+            username, password, api_key, acc_type, session, rate_limit, bar_store
+        )
+
+    def _new_session(self):
+        """Returns an httpx AsyncClient with a connection pool of
+        max_connections"""
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+        )
+        return httpx.AsyncClient(limits=limits, timeout=None)
+
+    def _get_session(self, session):
+        """Returns an httpx AsyncClient (from self.session) if session is None
+        or session if it's not None"""
+        import httpx
+
+        if session is None:
+            session = self.session
+        else:
+            assert isinstance(
+                session, httpx.AsyncClient
+            ), "session must be <httpx.AsyncClient object> not %s" % type(session)
+        return session
+
+    async def _req(self, action, endpoint, params, session, version="1"):
+        """Creates a CRUD request and returns response"""
+        session = self._get_session(session)
+        if self.scheduler is not None:
+            await self.scheduler.acquire_async(action, endpoint, params)
+        crud_session = self.crud_session
+        method, url, kwargs = crud_session.prepare(action, endpoint, params, version)
+        response = await session.request(method, url, **_httpx_kwargs(kwargs))
+        response = crud_session.handle(action, response)
+        response.encoding = "utf-8"
+        return response
+
+    def _sleep(self, seconds):
+        """Pauses a request flow"""
+        import asyncio
+
+        return asyncio.sleep(seconds)
+
+    def _blocking(self, func, *args):
+        """Runs a blocking call of a request flow in the default executor,
+        off the event loop"""
+        import asyncio
+
+        return asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(func, *args)
+        )
+
+    async def _run(self, flow):
+        """Runs a request flow as a coroutine: awaitable steps (requests,
+        sleeps, nested flows) are awaited and their result, or exception,
+        is sent back to the flow"""
+        import inspect
+
+        result, error = None, None
+        while True:
+            try:
+                if error is None:
+                    step = flow.send(result)
+                else:
+                    step = flow.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = step, None
+            if inspect.isawaitable(step):
+                try:
+                    result = await step
+                except Exception as e:
+                    result, error = None, e
+
+    async def iter_historical_prices(
+        self,
+        epic,
+        resolution,
+        start_date,
+        end_date,
+        pagesize=500,
+        prefetch=0,
+        session=None,
+    ):
+        """Async generator version of IGService.iter_historical_prices,
+        with prefetch > 0 next pages are fetched by concurrent tasks"""
+        import asyncio
+
+        fetch_page = functools.partial(
+            self._fetch_price_page,
+            epic,
+            resolution,
+            start_date,
+            end_date,
+            pagesize,
+            session,
+        )
+
+        data = await fetch_page(1)
+        pagenumbers = iter(range(2, self._price_pages(data) + 1))
+        prices = data["prices"]
+        del data
+
+        tasks = deque(
+            asyncio.ensure_future(fetch_page(pagenumber))
+            for pagenumber in islice(pagenumbers, prefetch)
+        )
+        try:
+            yield prices
+            while tasks:
+                prices = (await tasks.popleft())["prices"]
+                for pagenumber in islice(pagenumbers, 1):
+                    tasks.append(asyncio.ensure_future(fetch_page(pagenumber)))
+                yield prices
+            for pagenumber in pagenumbers:
+                yield (await fetch_page(pagenumber))["prices"]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def fetch_historical_prices_bulk(
+        self,
+        epics,
+        resolution,
+        start_date,
+        end_date,
+        max_workers=4,
+        checkpoint=None,
+        progress=None,
+        session=None,
+    ):
+        """Coroutine version of IGService.fetch_historical_prices_bulk,
+        at most max_workers epics are fetched at a time"""
+        import asyncio
+
+        epics = list(epics)
+        params = self._checkpoint_params(resolution, start_date, end_date)
+        results = await self._blocking(
+            self._load_checkpoint, checkpoint, epics, params
+        )
+        errors = {}
+        todo = [epic for epic in epics if epic not in results]
+        total = len(epics)
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(epic):
+            async with semaphore:
+                try:
+                    data = await self.fetch_historical_prices_by_epic_and_date_range(
+                        epic, resolution, start_date, end_date, session
+                    )
+                except Exception as e:
+                    logger.warning("Can't fetch prices of %s: %r" % (epic, e))
+                    errors[epic] = e
+                else:
+                    results[epic] = data
+                    await self._blocking(
+                        self._save_checkpoint, checkpoint, epic, params, data
+                    )
+            if progress is not None:
+                progress(len(results) + len(errors), total, epic, errors.get(epic))
+
+        await asyncio.gather(*[fetch(epic) for epic in todo])
+        return {"results": results, "errors": errors}
+
+    async def close(self):
+        """Closes the connection pool"""
+        await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+IG Markets Streaming API Library for Python - asyncio client
+AsyncLSClient speaks TLCP over one WebSocket connection (as WSLSClient)
+from the event loop: the stream is read by a task, listeners are called on
+the loop and updates can be consumed by coroutines with an async iterator,
+without any thread.
+"""
+
+import itertools
+import logging
+import time
+import traceback
+
+from .lightstreamer import (
+    OP_DELETE,
+    OP_DESTROY,
+    OK_CMD,
+    ERROR_CMD,
+    LOOP_CMD,
+    _BaseLSClient,
+)
+from .lightstreamer_ws import (
+    TLCP_PROTOCOL,
+    _HAS_WEBSOCKETS,
+    _TLCPClient,
+    parse_response,
+    ws_url,
+)
+from .stream import IGStreamService
+
+log = logging.getLogger(__name__)
+
+
+class UpdateIterator(object):
+    """Async iterator of the updates of a subscription (see
+    AsyncLSClient.updates), ends when the session ends or when closed.
+
+    Each update is a new ItemUpdate. With maxsize > 0, at most maxsize
+    updates wait for the consumer, the oldest one is dropped to queue a
+    new one (counted in dropped).
+    """
+
+    def __init__(self, subscription, fields=None, maxsize=0):
+        import asyncio
+
+        self.subscription = subscription
+        self.maxsize = maxsize
+        self.dropped = 0
+        # unbounded: maxsize is enforced by _put, so that there is always
+        # room for the None ending the iteration
+        self._queue = asyncio.Queue()
+        self._closed = False
+        subscription.addlistener(self._put, fields)
+
+    def _put(self, item):
+        """Listener queueing a copy of the item update"""
+        queue = self._queue
+        if self.maxsize and queue.qsize() >= self.maxsize:
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(
+            self.subscription._update(item.pos, dict(item.values), item.changed)
+        )
+
+    def close(self):
+        """Stops the iteration once the queued updates are consumed"""
+        if not self._closed:
+            self._closed = True
+            self.subscription.removelistener(self._put)
+            self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        update = await self._queue.get()
+        if update is None:
+            # put it back for the next calls
+            self._queue.put_nowait(None)
+            raise StopAsyncIteration
+        return update
+
+
+class AsyncLSClient(_TLCPClient, _BaseLSClient):
+    """asyncio version of LSClient (requires websockets), the methods
+    sending requests are coroutines with the same semantics
+
+        ls_client = AsyncLSClient(url, user=user, password=password)
+        await ls_client.connect()
+        subscription = Subscription("MERGE", items, fields)
+        updates = ls_client.updates(subscription)
+        await ls_client.subscribe(subscription)
+        async for update in updates:
+            ...
+
+    Listeners added with Subscription.addlistener are called on the event
+    loop, by the task reading the stream: they must not block.
+
+    With a recovery Backoff, a lost session is replaced by a new one as
+    with LSClient, update iterators go on with the new session.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        adapter_set="",
+        user="",
+        password="",
+        timeout=10.0,
+        recovery=None,
+    ):
+        if not _HAS_WEBSOCKETS:
+            raise ImportError(
+                "AsyncLSClient requires websockets (pip install websockets)"
+            )
+        super(AsyncLSClient, self).__init__(
+            base_url, adapter_set, user, password, recovery
+        )
+        self.timeout = timeout
+        self._receiver = None
+        self._req_ids = itertools.count(1)
+        self._requests = {}
+        self._iterators = []
+        # asyncio.Event set by disconnect and destroy
+        self._closing = None
+
+    async def _read_lines(self):
+        """Yields the lines of the stream (WebSocket messages can hold
+        several) until the connection is closed"""
+        from websockets.exceptions import ConnectionClosed
+
+        while True:
+            try:
+                message = await self._stream_connection.recv()
+            except ConnectionClosed:
+                return
+            for line in message.split("\r\n"):
+                if line:
+                    yield line
+
+    async def connect(self):
+        """Opens the WebSocket connection and creates a new session"""
+        import asyncio
+        import websockets
+
+        if self._closing is None:
+            self._closing = asyncio.Event()
+        self._closing.clear()
+        self._stream_connection = await websockets.connect(
+            ws_url(self._base_url),
+            subprotocols=[TLCP_PROTOCOL],
+            open_timeout=self.timeout,
+        )
+        await self._send(self._create_session_request())
+        lines = self._read_lines()
+        try:
+            stream_line = await asyncio.wait_for(self._first_line(lines), self.timeout)
+        except asyncio.TimeoutError:
+            stream_line = "No response to create_session"
+        if not stream_line.startswith("CONOK"):
+            await lines.aclose()
+            await self._stream_connection.close()
+            self._stream_connection = None
+            log.error("Server response error: \n{0}".format(stream_line))
+            raise IOError(stream_line)
+        self._set_session(stream_line)
+        self._receiver = asyncio.ensure_future(self._receive(lines))
+
+    async def _first_line(self, lines):
+        """Returns the first line of lines which is not an information"""
+        async for stream_line in lines:
+            if not stream_line.startswith(self.INFORMATION):
+                return stream_line
+        return "Connection closed"
+
+    async def _send(self, request):
+        await self._stream_connection.send(request)
+
+    async def bind(self):
+        """Rebinds the session on the same WebSocket connection (after a
+        LOOP message)"""
+        await self._send(self._bind_request())
+
+    async def _control(self, params):
+        """Sends a control request and waits for its response, returns OK
+        or ERROR,<code>,<message>"""
+        return (await self._control_batch([params]))[0]
+
+    async def _control_batch(self, params_list):
+        """Sends several control requests in one WebSocket message, returns
+        their responses"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        req_ids = [next(self._req_ids) for _ in params_list]
+        responses = [loop.create_future() for _ in params_list]
+        self._requests.update(zip(req_ids, responses))
+        try:
+            for message in self._control_messages(params_list, req_ids):
+                await self._send(message)
+            return await asyncio.wait_for(asyncio.gather(*responses), self.timeout)
+        except asyncio.TimeoutError:
+            raise IOError("No response to requests {0}".format(req_ids))
+        finally:
+            for req_id in req_ids:
+                self._requests.pop(req_id, None)
+
+    def _resolve_request(self, message):
+        """Passes REQOK or REQERR to the waiting request"""
+        req_id, response = parse_response(message)
+        request = self._requests.get(req_id)
+        if request is None or request.done():
+            log.warning("Response to an unknown request: {0}".format(message))
+            return
+        request.set_result(response)
+
+    async def disconnect(self):
+        """Closes the connection, the session ends with it"""
+        if self._closing is not None:
+            self._closing.set()
+        if self._stream_connection is not None:
+            await self._stream_connection.close()
+            await self._join()
+            log.debug("Connection closed")
+        else:
+            log.warning("No connection to Lightstreamer")
+
+    async def destroy(self):
+        """Destroys the session previously opened with connect()"""
+        if self._closing is not None:
+            self._closing.set()
+        if self._stream_connection is not None:
+            server_response = await self._control({"LS_op": OP_DESTROY})
+            if server_response == OK_CMD:
+                # the server closes the stream, which ends the receiver
+                await self._join()
+            else:
+                log.warning("No connection to Lightstreamer")
+
+    async def _join(self):
+        """Awaits the end of the task reading the stream"""
+        # a recovery replaces the task by a new one
+        while self._receiver is not None:
+            receiver = self._receiver
+            await receiver
+            if self._receiver is receiver:
+                self._receiver = None
+
+    async def subscribe(self, subscription):
+        """Performs a subscription request, returns its subscription key"""
+        (subscription_key,) = self._register([subscription])
+        server_response = await self._control(
+            self._subscribe_params(subscription_key, subscription)
+        )
+        log.debug("Server response ---> <{0}>".format(server_response))
+        return subscription_key
+
+    async def subscribe_many(self, subscriptions):
+        """Subscribes to several subscriptions with batched control
+        requests, returns a list of (subscription key, server response),
+        the subscriptions whose request failed are unregistered"""
+        subscriptions = list(subscriptions)
+        keys = self._register(subscriptions)
+        responses = await self._control_batch(
+            [self._subscribe_params(key, s) for (key, s) in zip(keys, subscriptions)]
+        )
+        return self._subscribed(keys, responses)
+
+    async def unsubscribe_many(self, subcription_keys):
+        """Unregisters the Subscriptions of several subscription keys with
+        batched control requests, returns a list of (subscription key,
+        server response)"""
+        keys = self._known_keys(subcription_keys)
+        responses = await self._control_batch(
+            [{"LS_Table": key, "LS_op": OP_DELETE} for key in keys]
+        )
+        return self._unsubscribed(keys, responses)
+
+    async def reconfigure(self, subcription_key, max_frequency):
+        """Changes the requested max frequency of an active subscription,
+        returns the server response"""
+        if subcription_key not in self._subscriptions:
+            log.warning("No subscription key {0} found!".format(subcription_key))
+            return None
+        server_response = await self._control(
+            self._reconfigure_params(subcription_key, max_frequency)
+        )
+        return self._reconfigured(subcription_key, max_frequency, server_response)
+
+    async def unsubscribe(self, subcription_key):
+        """Unregisters the Subscription associated to the
+        specified subscription_key"""
+        await self.unsubscribe_many([subcription_key])
+
+    def updates(self, subscription, fields=None, maxsize=0):
+        """Returns an UpdateIterator of the updates of subscription (or of
+        those changing one of fields), which ends with the session"""
+        iterator = UpdateIterator(subscription, fields, maxsize)
+        self._iterators.append(iterator)
+        return iterator
+
+    async def _receive(self, lines):
+        cause = "connection closed"
+        try:
+            async for message in lines:
+                event = self._handle_message(message)
+                if event == LOOP_CMD:
+                    await self.bind()
+                elif event is not None:
+                    cause = event
+                    break
+            else:
+                log.warning("Connection closed")
+        except Exception:
+            log.error("Communication error")
+            log.error(traceback.format_exc())
+            cause = "communication error"
+        finally:
+            await lines.aclose()
+            await self._close(cause)
+
+    async def _resubscribe(self):
+        """Subscribes the new session to every subscription, in one batch
+        of control requests"""
+        keys, params_list = self._resubscribe_params()
+        if keys:
+            self._resubscribed(keys, await self._control_batch(params_list))
+
+    async def _recover(self, cause):
+        """Replaces the lost session by a new one subscribed to the same
+        subscriptions, retrying with the delays of self.recovery. Returns
+        False if the client gave up or was disconnected meanwhile."""
+        import asyncio
+
+        start = self._last_message_time or time.time()
+        log.warning("Session lost ({0}), recovering".format(cause))
+        attempts = 0
+        for delay in self.recovery.delays():
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)
+                return False
+            except asyncio.TimeoutError:
+                pass
+            attempts += 1
+            try:
+                await self.connect()
+            except Exception:
+                log.warning(
+                    "Recovery attempt {0} failed\n{1}".format(
+                        attempts, traceback.format_exc()
+                    )
+                )
+                continue
+            try:
+                await self._resubscribe()
+            except Exception:
+                # the new session is recovered by its own task if the
+                # connection was lost again
+                log.error("Can't subscribe again\n" + traceback.format_exc())
+            self._recovered(start, cause, attempts)
+            return True
+        log.error("Can't recover the session after {0} attempts".format(attempts))
+        return False
+
+    async def _close(self, cause):
+        """Ends the session: closes the connection, fails the pending
+        requests and ends the update iterators, unless the session is
+        recovered"""
+        log.debug("Closing connection")
+        await self._stream_connection.close()
+        for request in list(self._requests.values()):
+            if not request.done():
+                request.set_result(ERROR_CMD + ",closed")
+        if self.recovery is not None and not self._closing.is_set():
+            if await self._recover(cause):
+                return
+        for iterator in self._iterators:
+            iterator.close()
+        self._iterators = []
+        self._clear()
+
+
+class AsyncIGStreamService(IGStreamService):
+    """asyncio version of IGStreamService, to be used with an
+    AsyncIGService
+
+        ig_stream_service = AsyncIGStreamService(ig_service)
+        await ig_stream_service.create_session()
+        await ig_stream_service.connect(account_id)
+        ls_client = ig_stream_service.ls_client
+    """
+
+    TRANSPORTS = {"ws": AsyncLSClient}
+
+    def __init__(self, ig_service, transport="ws", recovery=True):
+        super(AsyncIGStreamService, self).__init__(ig_service, transport, recovery)
+
+    async def create_session(self, encryption=False):
+        ig_session = await self.ig_service.create_session(encryption=encryption)
+        self.ig_session = ig_session
+        return ig_session
+
+    async def connect(self, accountId):
+        self.ls_client = self._new_ls_client(accountId)
+        try:
+            await self.ls_client.connect()
+        except Exception:
+            log.error("Unable to connect to Lightstreamer Server")
+            log.error(traceback.format_exc())
+            raise
+
+    async def unsubscribe_all(self):
+        subcription_keys = list(self.ls_client._subscriptions)
+        return await self.ls_client.unsubscribe_many(subcription_keys)
+
+    async def disconnect(self):
+        await self.unsubscribe_all()
+        await self.ls_client.disconnect()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Local persistent store of historical prices
+
+BarStore keeps the bars already downloaded in a SQLite database, keyed by
+(epic, resolution, time), together with the date ranges already covered, so
+that IGService only downloads the missing sub-ranges (see
+IGService.fetch_historical_prices_by_epic_and_date_range).
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from .utils import _HAS_PANDAS
+
+if _HAS_PANDAS:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# snapshot times are in the time zone of the account, at most 12 hours
+# behind UTC: older bars are complete whatever the time zone
+CLOCK_MARGIN = timedelta(hours=12)
+PRICE_TYPES = ("bid", "ask", "last")
+OHLC = ("Open", "High", "Low", "Close")
+COLUMNS = ["%s_%s" % (typ, col.lower()) for typ in PRICE_TYPES for col in OHLC] + [
+    "volume"
+]
+
+
+def _to_timestamp(dt):
+    return pd.Timestamp(dt).floor("s")
+
+
+class BarStore(object):
+    """SQLite store of historical bars (DataFrame formatted by
+    IGService.format_prices) keyed by (epic, resolution, time)"""
+
+    def __init__(self, filename="prices.sqlite", clock=time.time):
+        if not _HAS_PANDAS:
+            raise ImportError("BarStore requires pandas")
+        self.filename = filename
+        self._clock = clock
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bars ("
+                "epic TEXT, resolution TEXT, time TEXT, %s, "
+                "PRIMARY KEY (epic, resolution, time))"
+                % ", ".join("%s REAL" % col for col in COLUMNS)
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "epic TEXT, resolution TEXT, start TEXT, end TEXT)"
+            )
+        # sqlite3 context manager commits but doesn't close
+        conn.close()
+
+    def _connect(self):
+        """Returns a new connection (sqlite connections can't be shared
+        between threads)"""
+        return sqlite3.connect(self.filename)
+
+    def _coverage(self, conn, epic, resolution):
+        rows = conn.execute(
+            "SELECT start, end FROM coverage WHERE epic=? AND resolution=? "
+            "ORDER BY start",
+            (epic, resolution),
+        ).fetchall()
+        return [(pd.Timestamp(start), pd.Timestamp(end)) for (start, end) in rows]
+
+    def missing(self, epic, resolution, start, end):
+        """Returns the list of (start, end) sub-ranges of [start, end]
+        which are not covered by the store yet"""
+        start, end = _to_timestamp(start), _to_timestamp(end)
+        conn = self._connect()
+        try:
+            coverage = self._coverage(conn, epic, resolution)
+        finally:
+            conn.close()
+        ranges = []
+        for (covered_start, covered_end) in coverage:
+            if covered_end < start:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > start:
+                ranges.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            ranges.append((start, end))
+        return ranges
+
+    def save(self, epic, resolution, prices, start, end):
+        """Saves prices (DataFrame, None if there was no bar) downloaded
+        for [start, end] and marks the range as covered. Coverage stops at
+        the last bar returned (which may still change), or earlier than
+        the current time in any time zone if it is later."""
+        start = _to_timestamp(start)
+        covered = pd.Timestamp(self._clock(), unit="s") - CLOCK_MARGIN
+        if prices is not None and len(prices):
+            covered = max(covered, _to_timestamp(prices.index.max()))
+        end = min(_to_timestamp(end), covered.floor("s"))
+        rows = []
+        if prices is not None and len(prices):
+            values = dict(
+                (
+                    "%s_%s" % (typ, col.lower()),
+                    prices[typ][col].tolist()
+                    if typ in prices and col in prices[typ]
+                    else [None] * len(prices),
+                )
+                for typ in PRICE_TYPES
+                for col in OHLC
+            )
+            if "last" in prices and "Volume" in prices["last"]:
+                values["volume"] = prices["last"]["Volume"].tolist()
+            else:
+                values["volume"] = [None] * len(prices)
+            times = prices.index.strftime(TIME_FORMAT)
+            for i, bar_time in enumerate(times):
+                row = [epic, resolution, bar_time]
+                row.extend(values[col][i] for col in COLUMNS)
+                rows.append(row)
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO bars VALUES (%s)"
+                        % ", ".join(["?"] * (len(COLUMNS) + 3)),
+                        rows,
+                    )
+                    if start < end:
+                        self._add_coverage(conn, epic, resolution, start, end)
+            finally:
+                conn.close()
+
+    def _add_coverage(self, conn, epic, resolution, start, end):
+        """Merges [start, end] with the overlapping covered ranges"""
+        merged = []
+        for (covered_start, covered_end) in self._coverage(conn, epic, resolution):
+            if covered_end < start or covered_start > end:
+                merged.append((covered_start, covered_end))
+            else:
+                start, end = min(start, covered_start), max(end, covered_end)
+        merged.append((start, end))
+        conn.execute(
+            "DELETE FROM coverage WHERE epic=? AND resolution=?", (epic, resolution)
+        )
+        conn.executemany(
+            "INSERT INTO coverage VALUES (?, ?, ?, ?)",
+            [
+                (epic, resolution, s.strftime(TIME_FORMAT), e.strftime(TIME_FORMAT))
+                for (s, e) in sorted(merged)
+            ],
+        )
+
+    def load(self, epic, resolution, start, end):
+        """Returns the bars of [start, end] as a DataFrame with hierarchical
+        columns, like IGService.format_prices"""
+        start, end = _to_timestamp(start), _to_timestamp(end)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT time, %s FROM bars WHERE epic=? AND resolution=? "
+                "AND time >= ? AND time <= ? ORDER BY time" % ", ".join(COLUMNS),
+                (
+                    epic,
+                    resolution,
+                    start.strftime(TIME_FORMAT),
+                    end.strftime(TIME_FORMAT),
+                ),
+            ).fetchall()
+        finally:
+            conn.close()
+        df = pd.DataFrame(rows, columns=["DateTime"] + COLUMNS)
+        df.index = pd.DatetimeIndex(
+            pd.to_datetime(df.pop("DateTime"), format=TIME_FORMAT), name="DateTime"
+        )
+        df = df.astype(float)
+        data, keys = [], []
+        for typ in PRICE_TYPES:
+            cols = ["%s_%s" % (typ, col.lower()) for col in OHLC]
+            if typ == "last":
+                if df[cols + ["volume"]].isnull().all().all():
+                    continue
+                cols.append("volume")
+            data.append(df[cols].rename(columns=dict(zip(cols, OHLC + ("Volume",)))))
+            keys.append(typ)
+        return pd.concat(data, axis=1, keys=keys)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Dispatch of streaming updates to Subscription listeners by a worker pool
+
+By default Subscription.notifyupdate calls the listeners on the thread
+reading the Lightstreamer stream, so a slow listener delays the reading of
+the stream. A Dispatcher attaches a bounded DispatchQueue to a
+Subscription: the stream thread only merges the update into the item
+state and queues it, listeners are called by the worker threads of the
+Dispatcher. Updates of a subscription are delivered in order, by one
+worker at a time.
+
+When a queue is full, its policy decides what happens:
+ - BLOCK: the stream thread waits for the listeners to catch up
+ - DROP_OLDEST: the oldest queued update is dropped
+ - CONFLATE: at most one update per item is queued, newer updates are
+   merged into it and listeners get the latest state of the item
+
+Without a Dispatcher, a subscription can also keep its updates conflated
+until a consumer drains them (see Subscription.conflate).
+"""
+
+import logging
+import threading
+import traceback
+from collections import deque, OrderedDict
+
+from six.moves import queue
+
+logger = logging.getLogger(__name__)
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+CONFLATE = "conflate"
+POLICIES = (BLOCK, DROP_OLDEST, CONFLATE)
+
+
+class DispatchQueue(object):
+    """Bounded queue of the updates of a Subscription waiting for its
+    listeners (see Dispatcher.attach), or waiting to be drained by a
+    consumer when there is no dispatcher (see Subscription.conflate)"""
+
+    def __init__(self, subscription, dispatcher, maxsize=1000, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError(
+                "policy must be one of %s not %r" % (", ".join(POLICIES), policy)
+            )
+        if policy == CONFLATE and subscription.mode == "COMMAND":
+            # merging the updates of an item would merge different rows
+            raise ValueError("COMMAND mode updates can't be conflated")
+        self.subscription = subscription
+        self.dispatcher = dispatcher
+        self.maxsize = maxsize
+        self.policy = policy
+        self._cond = threading.Condition()
+        # BLOCK and DROP_OLDEST: (pos, values, changed) of queued updates
+        self._events = deque()
+        # CONFLATE: {pos: changed fields mask} of items with an update
+        self._pending = OrderedDict()
+        self._scheduled = False
+        self.delivered = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        """Number of updates waiting for the listeners"""
+        return len(self._pending) if self.policy == CONFLATE else len(self._events)
+
+    def put(self, item_line):
+        """Merges an item line into the subscription item state and queues
+        the update (called by Subscription.notifyupdate)"""
+        with self._cond:
+            item = self.subscription._merge(item_line)
+            if self.policy == CONFLATE:
+                pending = self._pending
+                if item.pos in pending:
+                    pending[item.pos] |= item.changed
+                    self.dropped += 1
+                else:
+                    pending[item.pos] = item.changed
+            else:
+                events = self._events
+                if len(events) >= self.maxsize:
+                    if self.policy == BLOCK:
+                        while len(events) >= self.maxsize:
+                            self._cond.wait()
+                    else:
+                        events.popleft()
+                        self.dropped += 1
+                events.append((item.pos, dict(item.values), item.changed))
+            self.max_depth = max(self.max_depth, self.depth)
+            schedule = not self._scheduled
+            self._scheduled = True
+            if self.dispatcher is None:
+                self._cond.notify_all()
+                return
+        if schedule:
+            self.dispatcher._schedule(self)
+
+    def _pop(self):
+        """Returns the next (pos, values, changed) update or None.
+        Must be called with the lock held."""
+        if self.policy == CONFLATE:
+            if not self._pending:
+                return None
+            pos, changed = self._pending.popitem(last=False)
+            return pos, dict(self.subscription._items[pos - 1].values), changed
+        if not self._events:
+            return None
+        event = self._events.popleft()
+        self._cond.notify_all()
+        return event
+
+    def _drain(self, batch=100):
+        """Delivers up to batch updates to the listeners (on a worker)"""
+        for _ in range(batch):
+            with self._cond:
+                event = self._pop()
+                if event is None:
+                    self._scheduled = False
+                    self._cond.notify_all()
+                    return
+            try:
+                self.subscription._notify(self.subscription._update(*event))
+            except Exception:
+                logger.error("Listener error\n%s" % traceback.format_exc())
+            self.delivered += 1
+        # let the other queues have a worker before delivering the rest
+        self.dispatcher._schedule(self)
+
+    def drain(self, timeout=0):
+        """Returns the queued updates as ItemUpdate objects (oldest first),
+        waiting up to timeout seconds (None to wait forever) for one if
+        there is none. With the CONFLATE policy there is at most one per
+        item, with the latest state of the item."""
+        with self._cond:
+            if timeout != 0:
+                self._cond.wait_for(lambda: self.depth, timeout)
+            updates = []
+            event = self._pop()
+            while event is not None:
+                updates.append(self.subscription._update(*event))
+                event = self._pop()
+            self.delivered += len(updates)
+            self._scheduled = False
+            self._cond.notify_all()
+        return updates
+
+    def join(self, timeout=None):
+        """Waits until every queued update is delivered, returns False
+        on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._scheduled, timeout)
+
+    def stats(self):
+        """Returns {policy, maxsize, depth, max_depth, delivered, dropped},
+        dropped being the updates dropped (DROP_OLDEST) or merged into a
+        queued update (CONFLATE)"""
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "maxsize": self.maxsize,
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+            }
+
+
+class Dispatcher(object):
+    """Pool of worker threads calling the listeners of the subscriptions
+    attached to it
+
+        dispatcher = Dispatcher(workers=4)
+        dispatcher.attach(subscription, maxsize=1000, policy=DROP_OLDEST)
+        ls_client.subscribe(subscription)
+    """
+
+    def __init__(self, workers=1):
+        self._ready = queue.Queue()
+        self._queues = []
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                name="DISPATCH-THREAD-{0}".format(i), target=self._work
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def attach(self, subscription, maxsize=1000, policy=BLOCK):
+        """Delivers the updates of subscription with the workers, through
+        a queue of maxsize updates, returns the DispatchQueue"""
+        dispatch_queue = DispatchQueue(subscription, self, maxsize, policy)
+        subscription._dispatch_queue = dispatch_queue
+        self._queues.append(dispatch_queue)
+        return dispatch_queue
+
+    def _schedule(self, dispatch_queue):
+        self._ready.put(dispatch_queue)
+
+    def _work(self):
+        while True:
+            dispatch_queue = self._ready.get()
+            if dispatch_queue is None:
+                break
+            dispatch_queue._drain()
+
+    def join(self, timeout=None):
+        """Waits until the queued updates of every subscription are
+        delivered"""
+        return all(q.join(timeout) for q in list(self._queues))
+
+    def stats(self):
+        """Returns the stats of each DispatchQueue, in attach order"""
+        return [q.stats() for q in list(self._queues)]
+
+    def close(self):
+        """Stops the workers once the updates already scheduled are
+        delivered"""
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
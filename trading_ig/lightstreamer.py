@@ -14,13 +14,21 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import codecs
+import datetime
+import itertools
 import logging
+import random
 import threading
+import time
 import traceback
+from collections import deque, namedtuple
 
 from six.moves.urllib.request import urlopen as _urlopen
 from six.moves.urllib.parse import urlparse as parse_url, urljoin, urlencode
 
+from .dispatch import DispatchQueue, CONFLATE
+
 try:
     from systemd.daemon import notify
 except ImportError:
@@ -35,6 +43,20 @@ def _iteritems(d):
     return iter(d.items())
 
 
+def split_batches(lines, limit, separator_length=2):
+    """Groups lines into batches whose length, once joined with a
+    separator, is at most limit (a longer line is a batch on its own)"""
+    batch, length = [], 0
+    for line in lines:
+        if batch and length + separator_length + len(line) > limit:
+            yield batch
+            batch, length = [], 0
+        length += len(line) + (separator_length if batch else 0)
+        batch.append(line)
+    if batch:
+        yield batch
+
+
 CONNECTION_URL_PATH = "lightstreamer/create_session.txt"
 BIND_URL_PATH = "lightstreamer/bind_session.txt"
 CONTROL_URL_PATH = "lightstreamer/control.txt"
@@ -44,6 +66,8 @@ OP_ADD = "add"
 OP_DELETE = "delete"
 # Request parameter to force closure of an existing session.
 OP_DESTROY = "destroy"
+# Request parameter to change the max frequency of an active Table.
+OP_RECONF = "reconf"
 # List of possible server responses
 PROBE_CMD = "PROBE"
 END_CMD = "END"
@@ -51,21 +75,98 @@ LOOP_CMD = "LOOP"
 ERROR_CMD = "ERROR"
 SYNC_ERROR_CMD = "SYNC ERROR"
 OK_CMD = "OK"
+# Commands of the updates of a COMMAND mode subscription
+COMMAND_ADD = "ADD"
+COMMAND_UPDATE = "UPDATE"
+COMMAND_DELETE = "DELETE"
+# Length limit of a control request when the session doesn't tell it
+# (RequestLimit), batches of control requests are split to fit it
+REQUEST_LIMIT = 50000
 
 log = logging.getLogger(__name__)
 
 
+class ItemUpdate(object):
+    """Update of a subscribed item passed to the Subscription listeners:
+    update["pos"], update["name"], update["values"] (dict of field name:
+    last value) and update["changed"] (bit mask of the fields changed by
+    the update, bit i for the field at index i, see changed_fields).
+
+    There is one ItemUpdate per item, which is updated in place and passed
+    to the listeners on every update of the item: copy values (for example
+    dict(update["values"])) to keep them after the listener returns. Updates
+    delivered by a Dispatcher are new ItemUpdate objects.
+    """
+
+    __slots__ = ("pos", "name", "values", "changed", "_fields")
+
+    def __init__(self, pos, name, fields):
+        self.pos = pos
+        self.name = name
+        self.values = dict.fromkeys(fields)
+        self.changed = 0
+        self._fields = fields
+
+    def __getitem__(self, key):
+        if key in ("pos", "name", "values", "changed"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def changed_fields(self):
+        """Returns the names of the fields changed by the update"""
+        return [
+            field
+            for (i, field) in enumerate(self._fields)
+            if self.changed & (1 << i)
+        ]
+
+    def __repr__(self):
+        return "ItemUpdate(pos=%r, name=%r, values=%r, changed=%r)" % (
+            self.pos,
+            self.name,
+            self.values,
+            self.changed_fields(),
+        )
+
+
 class Subscription(object):
-    """Represents a Subscription to be submitted to a Lightstreamer Server."""
+    """Represents a Subscription to be submitted to a Lightstreamer Server.
+
+    Options requested to the server, None for its default:
+     - max_frequency: updates per second of each item (a number,
+       "unlimited" or "unfiltered"), see LSClient.reconfigure
+     - buffer_size: updates of each item the server keeps while they can't
+       be sent (a number or "unlimited")
+     - snapshot_length: events of the snapshot (DISTINCT mode)
+    """
 
-    def __init__(self, mode, items, fields, adapter=""):
+    def __init__(
+        self,
+        mode,
+        items,
+        fields,
+        adapter="",
+        max_frequency=None,
+        buffer_size=None,
+        snapshot_length=None,
+    ):
         self.item_names = items
-        self._items_map = {}
         self.field_names = fields
         self.adapter = adapter
         self.mode = mode
         self.snapshot = "true"
+        self.max_frequency = max_frequency
+        self.buffer_size = buffer_size
+        self.snapshot_length = snapshot_length
         self._listeners = []
+        # state of the item at position pos is self._items[pos - 1]
+        self._items = [
+            ItemUpdate(pos, name, fields) for (pos, name) in enumerate(items, 1)
+        ]
+        # converter of each field (None to keep the string value)
+        self._converters = [None] * len(fields)
+        # set by Dispatcher.attach to call listeners from worker threads
+        self._dispatch_queue = None
 
     def _decode(self, value, last):
         """Decode the field value according to
@@ -82,45 +183,381 @@ class Subscription(object):
 
         return value
 
-    def addlistener(self, listener):
-        self._listeners.append(listener)
+    def field_mask(self, fields):
+        """Returns the bit mask of fields (see ItemUpdate.changed)"""
+        mask = 0
+        for field in fields:
+            try:
+                mask |= 1 << self.field_names.index(field)
+            except ValueError:
+                raise ValueError("{0} is not a subscribed field".format(field))
+        return mask
+
+    def addlistener(self, listener, fields=None):
+        """Adds a listener called with the ItemUpdate of each update, or
+        only of the updates changing one of fields if fields is not None"""
+        mask = None if fields is None else self.field_mask(fields)
+        self._listeners.append((listener, mask))
+
+    def removelistener(self, listener):
+        """Removes a listener added with addlistener"""
+        self._listeners = [(f, m) for (f, m) in self._listeners if f != listener]
+
+    def conflate(self):
+        """Switches to conflating delivery: updates are no longer passed to
+        the listeners, they are kept (at most one per item, merged with the
+        newer ones) until drained from the returned DispatchQueue
+
+            updates = subscription.conflate()
+            while True:
+                for update in updates.drain(timeout=1.0):
+                    ...  # latest state of each item updated since last drain
+        """
+        self._dispatch_queue = DispatchQueue(self, None, policy=CONFLATE)
+        return self._dispatch_queue
 
     def notifyupdate(self, item_line):
         """Invoked by LSClient each time Lightstreamer Server pushes
         a new item event.
         """
-        # Tokenize the item line as sent by Lightstreamer
-        toks = item_line.rstrip("\r\n").split("|")
-        undecoded_item = dict(list(zip(self.field_names, toks[1:])))
-
-        # Retrieve the previous item stored into the map, if present.
-        # Otherwise create a new empty dict.
-        item_pos = int(toks[0])
-        curr_item = self._items_map.get(item_pos, {})
-        # Update the map with new values, merging with the
-        # previous ones if any.
-        self._items_map[item_pos] = dict(
-            [
-                (k, self._decode(v, curr_item.get(k)))
-                for k, v in list(undecoded_item.items())
-            ]
+        if self._dispatch_queue is None:
+            self._notify(self._merge(item_line))
+        else:
+            self._dispatch_queue.put(item_line)
+
+    def _merge(self, item_line):
+        """Merges an item line into the item state, returns the ItemUpdate
+        of the item. item_line can also be the list of its tokens (item
+        position and encoded values), already split by the transport."""
+        if isinstance(item_line, list):
+            toks = item_line
+        else:
+            # Tokenize the item line as sent by Lightstreamer
+            toks = item_line.rstrip("\r\n").split("|")
+
+        # Merge the changed values into the item state, an empty token
+        # means the value is unchanged
+        item = self._items[int(toks[0]) - 1]
+        values = item.values
+        fields = self.field_names
+        converters = self._converters
+        changed = 0
+        for i in range(1, min(len(toks), len(fields) + 1)):
+            value = toks[i]
+            if value:
+                changed |= 1 << (i - 1)
+                field = fields[i - 1]
+                value = self._decode(value, values[field])
+                convert = converters[i - 1]
+                if convert is not None:
+                    value = self._convert(convert, field, value)
+                values[field] = value
+        item.changed = changed
+        return item
+
+    def _update(self, pos, values, changed):
+        """Returns a new ItemUpdate (for updates delivered later than
+        they are merged)"""
+        update = ItemUpdate(pos, self.item_names[pos - 1], self.field_names)
+        update.values = values
+        update.changed = changed
+        return update
+
+    def _notify(self, item):
+        """Update the registered listeners with the item state, skipping
+        those filtering on fields which didn't change"""
+        changed = item.changed
+        for on_item_update, mask in self._listeners:
+            if mask is None or changed & mask:
+                on_item_update(item)
+
+    def _convert(self, convert, field, value):
+        """Converts a changed value, empty and null values become None"""
+        if not value:
+            return None
+        try:
+            return convert(value)
+        except ValueError:
+            log.warning("Can't convert {0} value {1!r}".format(field, value))
+            return value
+
+
+def time_of_day(value):
+    """Converts a HH:MM:SS string (like UPDATE_TIME) to datetime.time"""
+    return datetime.time(int(value[0:2]), int(value[3:5]), int(value[6:8]))
+
+
+class TypedSubscription(Subscription):
+    """Subscription whose values are converted according to a schema
+    {field name: converter}, like
+
+        {"BID": float, "OFFER": float, "UPDATE_TIME": time_of_day}
+
+    A converter is any callable taking the string value (float, int,
+    time_of_day...), fields missing from the schema stay strings. Values are
+    converted once, when they change, so unchanged fields cost nothing.
+    Options are those of Subscription.
+    """
+
+    def __init__(self, mode, items, fields, schema, adapter="", **options):
+        super(TypedSubscription, self).__init__(mode, items, fields, adapter, **options)
+        self.schema = schema
+        self._converters = [
+            None if schema.get(field, str) is str else schema[field]
+            for field in fields
+        ]
+
+
+class RowUpdate(ItemUpdate):
+    """Update of a row of the table of an item of a CommandSubscription,
+    passed to its listeners: update["key"], update["command"] (ADD, UPDATE
+    or DELETE) and the ItemUpdate keys, values being the row (its last
+    values for DELETE) and changed the fields changed by the command (all
+    of them for ADD and DELETE).
+
+    Unlike ItemUpdate, there is a new RowUpdate for each update, but values
+    is the row of the table, updated in place.
+    """
+
+    __slots__ = ("key", "command")
+
+    def __init__(self, pos, name, fields, key, command, values, changed):
+        self.pos = pos
+        self.name = name
+        self.values = values
+        self.changed = changed
+        self._fields = fields
+        self.key = key
+        self.command = command
+
+    def __getitem__(self, key):
+        if key in ("key", "command"):
+            return getattr(self, key)
+        return super(RowUpdate, self).__getitem__(key)
+
+    def __repr__(self):
+        return "RowUpdate(pos=%r, name=%r, key=%r, command=%r, changed=%r)" % (
+            self.pos,
+            self.name,
+            self.key,
+            self.command,
+            self.changed_fields(),
         )
-        # Make an item info as a new event to be passed to listeners
-        item_info = {
-            "pos": item_pos,
-            "name": self.item_names[item_pos - 1],
-            "values": self._items_map[item_pos],
-        }
 
-        # Update each registered listener with new event
-        for on_item_update in self._listeners:
-            on_item_update(item_info)
 
+class CommandSubscription(Subscription):
+    """Subscription in COMMAND mode: each item is a table of rows, keyed by
+    the value of key_field, which updates add, update or delete according
+    to the value of command_field
+
+        positions = CommandSubscription(items, ["key", "command", "size"])
+        positions.addlistener(on_row_update)
+        ...
+        positions.table(items[0])  # {key: {field: value}}
+
+    Each update is applied to the table of its item with a dict lookup,
+    listeners are called with the RowUpdate. Options are those of
+    Subscription. After a recovery, the new session sends the rows again:
+    use clear (see LSClient.addrecoverylistener) to drop the rows deleted
+    during the outage.
+    """
+
+    def __init__(
+        self,
+        items,
+        fields,
+        adapter="",
+        key_field="key",
+        command_field="command",
+        **options
+    ):
+        for field in (key_field, command_field):
+            if field not in fields:
+                raise ValueError("{0} is not a subscribed field".format(field))
+        super(CommandSubscription, self).__init__(
+            "COMMAND", items, fields, adapter, **options
+        )
+        self.key_field = key_field
+        self.command_field = command_field
+        # {key: row values} table of the item at position pos is
+        # self.tables[pos - 1]
+        self.tables = [{} for _ in items]
+        self._all_fields = (1 << len(fields)) - 1
+
+    def table(self, item):
+        """Returns the {key: row values} table of an item (name or
+        position)"""
+        if not isinstance(item, int):
+            item = self.item_names.index(item) + 1
+        return self.tables[item - 1]
+
+    def clear(self):
+        """Empties the tables of every item"""
+        for table in self.tables:
+            table.clear()
+
+    def _merge(self, item_line):
+        """Merges an item line into the item state and applies its command
+        to the table of the item, returns the RowUpdate"""
+        item = super(CommandSubscription, self)._merge(item_line)
+        values = item.values
+        key = values[self.key_field]
+        command = values[self.command_field]
+        table = self.tables[item.pos - 1]
+        row = table.get(key)
+        if command == COMMAND_DELETE:
+            if row is None:
+                row = dict(values)
+            else:
+                del table[key]
+                row[self.command_field] = command
+            changed = self._all_fields
+        elif row is None:
+            if command != COMMAND_ADD:
+                log.warning("{0} of unknown key {1!r}".format(command, key))
+            row = table[key] = dict(values)
+            changed = self._all_fields
+        else:
+            # the changes of the row, the item state being shared by its rows
+            changed = 0
+            for i, field in enumerate(self.field_names):
+                value = values[field]
+                if row[field] != value:
+                    row[field] = value
+                    changed |= 1 << i
+        return RowUpdate(
+            item.pos, item.name, self.field_names, key, command, row, changed
+        )
+
+    def _update(self, pos, values, changed):
+        """Returns a new RowUpdate (for updates delivered later than they
+        are merged)"""
+        return RowUpdate(
+            pos,
+            self.item_names[pos - 1],
+            self.field_names,
+            values[self.key_field],
+            values[self.command_field],
+            values,
+            changed,
+        )
+
+
+class StreamReader(object):
+    """Reads the lines of a Stream Connection by large chunks: a chunk is
+    decoded at once and split into lines, a partial line at the end of
+    a chunk is completed by the next one (an incremental decoder also
+    handles UTF-8 characters split between chunks). Lines end with CRLF
+    or a bare LF."""
+
+    CHUNK_SIZE = 65536
 
-class LSClient(object):
-    """Manages the communication with Lightstreamer Server"""
+    def __init__(self, stream, chunk_size=None):
+        self._stream = stream
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        # read1 returns what is available instead of waiting for a full
+        # chunk (file objects without it are read line by line)
+        self._read = getattr(stream, "read1", None)
+        self._decode = codecs.getincrementaldecoder("utf-8")().decode
+        self._lines = deque()
+        self._partial = u""
+        self.bytes_read = 0
 
-    def __init__(self, base_url, adapter_set="", user="", password=""):
+    def _fill(self):
+        """Reads the next chunk, returns False at the end of the stream"""
+        if self._read is not None:
+            chunk = self._read(self.chunk_size)
+        else:
+            chunk = self._stream.readline()
+        if not chunk:
+            return False
+        self.bytes_read += len(chunk)
+        text = self._partial + self._decode(chunk)
+        lines = text.replace("\r\n", "\n").split("\n")
+        self._partial = lines.pop()
+        self._lines.extend(lines)
+        return True
+
+    def readline(self):
+        """Returns the next line without line terminator, u"" at the end
+        of the stream"""
+        lines = self._lines
+        while not lines:
+            if not self._fill():
+                line, self._partial = self._partial.rstrip(), u""
+                return line
+        return lines.popleft()
+
+    def __iter__(self):
+        """Yields the lines until the end of the stream"""
+        lines = self._lines
+        while True:
+            while lines:
+                yield lines.popleft()
+            if not self._fill():
+                break
+        line, self._partial = self._partial.rstrip(), u""
+        if line:
+            yield line
+
+    def readlines(self):
+        """Returns the remaining lines of the stream"""
+        while self._fill():
+            pass
+        lines = list(self._lines)
+        self._lines.clear()
+        if self._partial:
+            lines.append(self._partial.rstrip())
+            self._partial = u""
+        return lines
+
+
+class Backoff(object):
+    """Delays between the attempts to recover a session: from initial
+    seconds, multiplied by factor after each attempt up to maximum seconds.
+    Each delay is reduced by a random part of up to jitter (0 to 1) of it,
+    so that clients disconnected together don't reconnect together.
+    attempts is the number of attempts before giving up (None to retry
+    forever)."""
+
+    def __init__(
+        self, initial=0.5, maximum=60.0, factor=2.0, jitter=0.5, attempts=None
+    ):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = attempts
+
+    def delays(self):
+        """Yields the delay before each attempt"""
+        if self.attempts is None:
+            attempts = itertools.count()
+        else:
+            attempts = range(self.attempts)
+        delay = self.initial
+        for _ in attempts:
+            yield delay * (1.0 - self.jitter * random.random())
+            delay = min(delay * self.factor, self.maximum)
+
+
+# Reported to the recovery listeners of LSClient once a lost session is
+# recovered: updates between start and end (UTC datetimes, start being the
+# last message received) were missed and can be backfilled.
+Outage = namedtuple("Outage", ["start", "end", "cause", "attempts"])
+
+
+def _utc(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+class _BaseLSClient(object):
+    """Session and subscriptions of a Lightstreamer client, shared by
+    LSClient, WSLSClient and AsyncLSClient: subscription keys, params of
+    the control requests and what their responses change, whatever the
+    way the requests are sent"""
+
+    def __init__(self, base_url, adapter_set="", user="", password="", recovery=None):
         self._base_url = parse_url(base_url)
         self._adapter_set = adapter_set
         self._user = user
@@ -129,9 +566,155 @@ class LSClient(object):
         self._subscriptions = {}
         self._current_subscription_key = 0
         self._stream_connection = None
+        self.recovery = recovery
+        self._recovery_listeners = []
+        self._last_message_time = None
+        # updates received since the client was created
+        self.update_count = 0
+
+    def _register(self, subscriptions):
+        """Registers subscriptions with new subscription keys, returns
+        the keys"""
+        keys = []
+        for subscription in subscriptions:
+            self._current_subscription_key += 1
+            self._subscriptions[self._current_subscription_key] = subscription
+            keys.append(self._current_subscription_key)
+        return keys
+
+    def _subscribed(self, keys, responses):
+        """Unregisters the subscriptions of keys whose request failed (the
+        server has no such table to resubscribe or delete), returns a
+        list of (subscription key, server response)"""
+        for key, response in zip(keys, responses):
+            if response != OK_CMD:
+                log.warning("Can't subscribe {0}: {1}".format(key, response))
+                del self._subscriptions[key]
+        return list(zip(keys, responses))
+
+    def _unsubscribed(self, keys, responses):
+        """Unregisters the subscriptions of keys whose request succeeded,
+        returns a list of (subscription key, server response)"""
+        for key, response in zip(keys, responses):
+            if response == OK_CMD:
+                del self._subscriptions[key]
+            else:
+                log.warning("Can't unsubscribe {0}: {1}".format(key, response))
+        return list(zip(keys, responses))
+
+    def _reconfigured(self, subcription_key, max_frequency, response):
+        """Keeps the max frequency of a reconfigured subscription, returns
+        the server response"""
+        if response == OK_CMD:
+            # kept when the subscription is made again by a recovery
+            self._subscriptions[subcription_key].max_frequency = max_frequency
+        else:
+            log.warning("Can't reconfigure {0}: {1}".format(subcription_key, response))
+        return response
+
+    def _known_keys(self, subcription_keys):
+        """Returns the subscription keys which are registered"""
+        keys = []
+        for key in subcription_keys:
+            if key in self._subscriptions:
+                keys.append(key)
+            else:
+                log.warning("No subscription key {0} found!".format(key))
+        return keys
+
+    def _subscribe_params(self, subcription_key, subscription):
+        """Returns the params of the control request subscribing to
+        subscription with subcription_key"""
+        return {
+            "LS_Table": subcription_key,
+            "LS_op": OP_ADD,
+            "LS_data_adapter": subscription.adapter,
+            "LS_mode": subscription.mode,
+            "LS_schema": " ".join(subscription.field_names),
+            "LS_id": " ".join(subscription.item_names),
+            "LS_requested_max_frequency": subscription.max_frequency,
+            "LS_requested_buffer_size": subscription.buffer_size,
+            # the snapshot length in place of true
+            "LS_snapshot": subscription.snapshot_length
+            if subscription.snapshot_length and subscription.snapshot == "true"
+            else subscription.snapshot,
+        }
+
+    def _reconfigure_params(self, subcription_key, max_frequency):
+        """Returns the params of the control request changing the max
+        frequency of the subscription with subcription_key"""
+        return {
+            "LS_Table": subcription_key,
+            "LS_op": OP_RECONF,
+            "LS_requested_max_frequency": max_frequency,
+        }
+
+    def _request_limit(self):
+        """Returns the length limit of a control request"""
+        return int(self._session.get("RequestLimit", REQUEST_LIMIT))
+
+    def _resubscribe_params(self):
+        """Returns the subscription keys and the params of the control
+        requests subscribing a new session to every subscription"""
+        keys = sorted(self._subscriptions)
+        params_list = [
+            self._subscribe_params(key, self._subscriptions[key]) for key in keys
+        ]
+        return keys, params_list
+
+    def _resubscribed(self, keys, responses):
+        """Logs the subscriptions a new session can't subscribe to again"""
+        for key, response in zip(keys, responses):
+            if response != OK_CMD:
+                log.error("Can't subscribe again {0}: {1}".format(key, response))
+
+    def addrecoverylistener(self, listener):
+        """Adds a listener called with an Outage each time a lost session
+        is recovered (from the thread, or task, reading the stream)"""
+        self._recovery_listeners.append(listener)
+
+    def _recovered(self, start, cause, attempts):
+        """Notifies the recovery listeners of the Outage of a recovered
+        session, lost after the last message received at start"""
+        outage = Outage(_utc(start), _utc(time.time()), cause, attempts)
+        log.info("Session recovered: {0}".format(outage))
+        for listener in self._recovery_listeners:
+            try:
+                listener(outage)
+            except Exception:
+                log.error("Recovery listener error\n" + traceback.format_exc())
+
+    def _clear(self):
+        """Clears the session and the subscriptions"""
+        self._stream_connection = None
+        self._session.clear()
+        self._subscriptions.clear()
+        self._current_subscription_key = 0
+
+
+class LSClient(_BaseLSClient):
+    """Manages the communication with Lightstreamer Server
+
+    With a recovery Backoff, a session lost on SYNC ERROR, END, ERROR or
+    a communication error is replaced by a new session, subscribed to the
+    same subscriptions with the same subscription keys (see
+    addrecoverylistener to be notified of the outage).
+    """
+
+    def __init__(self, base_url, adapter_set="", user="", password="", recovery=None):
+        super(LSClient, self).__init__(
+            base_url, adapter_set, user, password, recovery
+        )
+        self._stream_reader = None
         self._stream_connection_thread = None
         self._bind_counter = 0
         self.content_length = 1000000000
+        # part of content_length read when the next Stream Connection is
+        # opened (see _prebind), None to bind once the stream ends
+        self.prebind = 0.9
+        self._next_stream_connection = None
+        # set by disconnect and destroy: the end of the session is expected
+        self._closing = threading.Event()
 
     def _encode_params(self, params):
         """Encode the parameter for HTTP POST submissions, but
@@ -145,7 +728,9 @@ class LSClient(object):
         # Combines the "base_url" with the
         # required "url" to be used for the specific request.
         url = urljoin(base_url.geturl(), url)
-        return _urlopen(url, data=self._encode_params(body))
+        if not isinstance(body, bytes):
+            body = self._encode_params(body)
+        return _urlopen(url, data=body)
 
     def _set_control_link_url(self, custom_address=None):
         """Set the address to use for the Control Connection
@@ -163,12 +748,47 @@ class LSClient(object):
         """
         params["LS_session"] = self._session["SessionId"]
         response = self._call(self._control_url, CONTROL_URL_PATH, params)
-        return response.readline().decode("utf-8").rstrip()
+        return self._read_response(response)
+
+    def _read_response(self, response):
+        """Reads the response to one control request: OK, or ERROR followed
+        by the lines of the error code and message, returned as
+        ERROR,<code>,<message>"""
+
+        def readline():
+            return response.readline().decode("utf-8").rstrip()
+
+        line = readline()
+        if line == ERROR_CMD:
+            code = readline()
+            message = readline()
+            return ",".join((ERROR_CMD, code, message))
+        return line
+
+    def _control_batch(self, params_list):
+        """Sends control requests in batches (one line each) fitting the
+        request limit, returns their responses"""
+        session_id = self._session["SessionId"]
+        lines = [
+            self._encode_params(dict(params, LS_session=session_id))
+            for params in params_list
+        ]
+        responses = []
+        for batch in split_batches(lines, self._request_limit()):
+            response = self._call(
+                self._control_url, CONTROL_URL_PATH, b"\r\n".join(batch)
+            )
+            responses.extend(self._read_response(response) for _ in batch)
+        return responses
 
     def _read_from_stream(self):
         """Read a single line of content of the Stream Connection."""
-        line = self._stream_connection.readline().decode("utf-8").rstrip()
-        return line
+        return self._stream_reader.readline()
+
+    def _open_stream(self, stream_connection):
+        """Sets the Stream Connection to read from"""
+        self._stream_connection = stream_connection
+        self._stream_reader = StreamReader(stream_connection)
 
     def connect(self):
         """Establish a connection to Lightstreamer Server to create
@@ -181,7 +801,13 @@ class LSClient(object):
                 "no watchdog notifications will be sent."
             )
 
-        self._stream_connection = self._call(
+        self._closing.clear()
+        self._create_session()
+        self._start_reader()
+
+    def _create_session(self):
+        """Opens a Stream Connection creating a new session"""
+        stream_connection = self._call(
             self._base_url,
             CONNECTION_URL_PATH,
             {
@@ -193,14 +819,18 @@ class LSClient(object):
                 "LS_content_length": self.content_length,
             },
         )
-        stream_line = self._read_from_stream()
-        self._handle_stream(stream_line)
+        self._open_session(stream_connection)
 
     def bind(self):
         """Replace a completely consumed connection in listening for an active
         Session.
         """
-        self._stream_connection = self._call(
+        self._open_session(self._bind_stream())
+
+    def _bind_stream(self):
+        """Opens a new Stream Connection bound to the active session"""
+        self._bind_counter += 1
+        return self._call(
             self._control_url,
             BIND_URL_PATH,
             {
@@ -209,7 +839,10 @@ class LSClient(object):
             },
         )
 
-        self._bind_counter += 1
+    def _open_session(self, stream_connection):
+        """Reads from stream_connection, starting with the session
+        information"""
+        self._open_stream(stream_connection)
         stream_line = self._read_from_stream()
         self._handle_stream(stream_line)
 
@@ -226,21 +859,45 @@ class LSClient(object):
 
             # Setup of the control link url
             self._set_control_link_url(self._session.get("ControlAddress"))
-
-            # Start a new thread to handle real time updates sent
-            # by Lightstreamer Server on the stream connection.
-            self._stream_connection_thread = threading.Thread(
-                name="STREAM-CONN-THREAD-{0}".format(self._bind_counter),
-                target=self._receive,
-            )
-            self._stream_connection_thread.setDaemon(True)
-            self._stream_connection_thread.start()
         else:
-            lines = self._stream_connection.readlines()
+            lines = self._stream_reader.readlines()
             lines.insert(0, stream_line)
-            log.error("Server response error: \n{0}".format("".join(lines)))
+            log.error("Server response error: \n{0}".format("\n".join(lines)))
             raise IOError()
 
+    def _start_reader(self):
+        """Start the thread handling the real time updates sent by
+        Lightstreamer Server, for the whole session (rebinds and
+        recoveries replace the Stream Connection it reads from)."""
+        self._stream_connection_thread = threading.Thread(
+            name="STREAM-CONN-THREAD", target=self._run
+        )
+        self._stream_connection_thread.daemon = True
+        self._stream_connection_thread.start()
+
+    def _prebind(self):
+        """Opens the next Stream Connection in advance, when the current
+        one is about to reach its content length: the server closes the
+        current one and goes on with the next one, whose updates wait in
+        the socket until the current one is read up to its end, so that
+        updates don't wait for a bind request at each rebind."""
+        try:
+            self._next_stream_connection = self._bind_stream()
+        except Exception:
+            # the session is bound again once the stream ends
+            log.warning(
+                "Can't open the next Stream Connection\n" + traceback.format_exc()
+            )
+
+    def _rebind(self):
+        """Swaps the ended Stream Connection for the next one"""
+        stream_connection = self._next_stream_connection
+        self._next_stream_connection = None
+        self._stream_connection.close()
+        if stream_connection is None:
+            stream_connection = self._bind_stream()
+        self._open_session(stream_connection)
+
     def _join(self):
         """Await the natural STREAM-CONN-THREAD termination."""
         if self._stream_connection_thread:
@@ -253,6 +910,7 @@ class LSClient(object):
         """Request to close the session previously opened with
         the connect() invocation.
         """
+        self._closing.set()
         if self._stream_connection is not None:
             # Close the HTTP connection
             self._stream_connection.close()
@@ -265,6 +923,7 @@ class LSClient(object):
         """Destroy the session previously opened with
         the connect() invocation.
         """
+        self._closing.set()
         if self._stream_connection is not None:
             server_response = self._control({"LS_op": OP_DESTROY})
             if server_response == OK_CMD:
@@ -277,22 +936,91 @@ class LSClient(object):
     def subscribe(self, subscription):
         """"Perform a subscription request to Lightstreamer Server."""
         # Register the Subscription with a new subscription key
-        self._current_subscription_key += 1
-        self._subscriptions[self._current_subscription_key] = subscription
+        (subscription_key,) = self._register([subscription])
 
         # Send the control request to perform the subscription
         server_response = self._control(
-            {
-                "LS_Table": self._current_subscription_key,
-                "LS_op": OP_ADD,
-                "LS_data_adapter": subscription.adapter,
-                "LS_mode": subscription.mode,
-                "LS_schema": " ".join(subscription.field_names),
-                "LS_id": " ".join(subscription.item_names),
-            }
+            self._subscribe_params(subscription_key, subscription)
         )
         log.debug("Server response ---> <{0}>".format(server_response))
-        return self._current_subscription_key
+        return subscription_key
+
+    def subscribe_many(self, subscriptions):
+        """Subscribes to several subscriptions with batched control
+        requests, returns a list of (subscription key, server response)
+        in the order of subscriptions, the response being OK or
+        ERROR,<code>,<message>. The subscriptions whose request failed
+        are unregistered."""
+        subscriptions = list(subscriptions)
+        keys = self._register(subscriptions)
+        responses = self._control_batch(
+            [self._subscribe_params(key, s) for (key, s) in zip(keys, subscriptions)]
+        )
+        return self._subscribed(keys, responses)
+
+    def unsubscribe_many(self, subcription_keys):
+        """Unregisters the Subscriptions of several subscription keys with
+        batched control requests, returns a list of (subscription key,
+        server response)"""
+        keys = self._known_keys(subcription_keys)
+        responses = self._control_batch(
+            [{"LS_Table": key, "LS_op": OP_DELETE} for key in keys]
+        )
+        return self._unsubscribed(keys, responses)
+
+    def reconfigure(self, subcription_key, max_frequency):
+        """Changes the requested max frequency (see Subscription) of an
+        active subscription, returns the server response (OK or
+        ERROR,<code>,<message>)"""
+        if subcription_key not in self._subscriptions:
+            log.warning("No subscription key {0} found!".format(subcription_key))
+            return None
+        server_response = self._control(
+            self._reconfigure_params(subcription_key, max_frequency)
+        )
+        return self._reconfigured(subcription_key, max_frequency, server_response)
+
+    def _resubscribe(self):
+        """Subscribes the new session to every subscription, in one batch
+        of control requests"""
+        keys, params_list = self._resubscribe_params()
+        if keys:
+            self._resubscribed(keys, self._control_batch(params_list))
+
+    def _recover(self, cause):
+        """Replaces the lost session by a new one subscribed to the same
+        subscriptions, retrying with the delays of self.recovery. Returns
+        False if the client gave up or was disconnected meanwhile."""
+        start = self._last_message_time or time.time()
+        log.warning("Session lost ({0}), recovering".format(cause))
+        attempts = 0
+        for delay in self.recovery.delays():
+            if self._closing.wait(delay):
+                return False
+            attempts += 1
+            try:
+                self._create_session()
+            except Exception:
+                log.warning(
+                    "Recovery attempt {0} failed\n{1}".format(
+                        attempts, traceback.format_exc()
+                    )
+                )
+                continue
+            try:
+                self._resubscribe()
+            except Exception:
+                # the new session is recovered again if the connection was
+                # lost meanwhile
+                log.error("Can't subscribe again\n" + traceback.format_exc())
+            self._recovered(start, cause, attempts)
+            return True
+        log.error("Can't recover the session after {0} attempts".format(attempts))
+        return False
+
+    def _can_recover(self):
+        """Whether the end of the session is unexpected and recoverable"""
+        return self.recovery is not None and not self._closing.is_set()
 
     def unsubscribe(self, subcription_key):
         """Unregister the Subscription associated to the
@@ -317,6 +1045,7 @@ class LSClient(object):
         Subscription instance for further dispatching to its listeners.
         """
         log.debug("Received update message ---> <{0}>".format(update_message))
+        self.update_count += 1
         tok = update_message.split(",", 1)
         table, item = int(tok[0]), tok[1]
         if table in self._subscriptions:
@@ -324,9 +1053,44 @@ class LSClient(object):
         else:
             log.warning("No subscription found!")
 
+    def _run(self):
+        """Reads the Stream Connections of the session until it ends,
+        rebinding or recovering the session in place"""
+        while True:
+            rebind, cause = self._receive()
+            if rebind:
+                log.debug("Binding to this active session")
+                try:
+                    self._rebind()
+                    continue
+                except Exception:
+                    log.error("Unable to bind the session\n" + traceback.format_exc())
+                    cause = "bind failed"
+            log.debug("Closing connection")
+            self._stream_connection.close()
+            if self._next_stream_connection is not None:
+                self._next_stream_connection.close()
+                self._next_stream_connection = None
+            if self._can_recover() and self._recover(cause):
+                continue
+            # Clear internal data structures for session
+            # and subscriptions management.
+            self._clear()
+            return
+
     def _receive(self):
+        """Reads the messages of the Stream Connection until it ends,
+        returns (rebind, cause): whether the session is to be bound to a
+        new Stream Connection, or why it ended"""
         rebind = False
         receive = True
+        cause = None
+        reader = self._stream_reader
+        if self.prebind is None:
+            prebind_at = None
+        else:
+            # content_length counts from the start of the Stream Connection
+            prebind_at = self.prebind * self.content_length
         while receive:
             log.debug("Waiting for a new message")
             try:
@@ -340,55 +1104,56 @@ class LSClient(object):
             if notify:
                 notify("WATCHDOG=1")
 
-            if message is None:
+            if not message:
+                # Communication error or end of the stream
                 receive = False
+                cause = "no new message received"
                 log.warning("No new message received")
-            elif message == PROBE_CMD:
+                continue
+            self._last_message_time = time.time()
+            if prebind_at is not None and reader.bytes_read >= prebind_at:
+                prebind_at = None
+                self._prebind()
+            if message == PROBE_CMD:
                 # Skipping the PROBE message, keep on receiving messages.
                 log.debug("PROBE message")
             elif message.startswith(ERROR_CMD):
                 # Terminate the receiving loop on ERROR message
                 receive = False
+                cause = message
                 log.error("ERROR")
             elif message.startswith(LOOP_CMD):
-                # Terminate the the receiving loop on LOOP message.
-                # A complete implementation should proceed with
-                # a rebind of the session.
+                # Terminate the the receiving loop on LOOP message,
+                # the session is bound to a new Stream Connection.
                 log.debug("LOOP")
                 rebind = True
                 receive = False
             elif message.startswith(SYNC_ERROR_CMD):
-                # Terminate the receiving loop on SYNC ERROR message.
-                # A complete implementation should create a new session
-                # and re-subscribe to all the old items and relative fields.
+                # Terminate the receiving loop on SYNC ERROR message,
+                # the session is recovered if there is a recovery Backoff.
                 log.error("SYNC ERROR")
                 receive = False
+                cause = message
             elif message.startswith(END_CMD):
                 # Terminate the receiving loop on END message.
-                # The session has been forcibly closed on the server side.
-                # A complete implementation should handle the
-                # "cause_code" if present.
+                # The session has been forcibly closed on the server side,
+                # it is recovered if there is a recovery Backoff.
                 log.info("Connection closed by the server")
                 receive = False
+                cause = message
             elif message.startswith("Preamble"):
                 # Skipping Preamble message, keep on receiving messages.
                 log.debug("Preamble")
             else:
                 self._forward_update_message(message)
 
-        if not rebind:
-            log.debug("Closing connection")
-            # Clear internal data structures for session
-            # and subscriptions management.
-            self._stream_connection.close()
-            self._stream_connection = None
-            self._session.clear()
-            self._subscriptions.clear()
-            self._current_subscription_key = 0
-        else:
-            log.debug("Binding to this active session")
-            self._stream_connection = None
-            self.bind()
+        if self._closing.is_set():
+            rebind = False
+        elif self._next_stream_connection is not None:
+            # the server closed the Stream Connection because of the next
+            # one (see _prebind), its first line tells if the session ended
+            rebind = True
+        return rebind, cause
 
 
 if __name__ == "__main__":
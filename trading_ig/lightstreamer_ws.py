@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+WebSocket transport for the Lightstreamer client
+
+WSLSClient speaks TLCP (the Lightstreamer protocol over WebSocket) on a
+single persistent connection carrying both the stream and the control
+requests: subscribing doesn't open a new HTTP connection and there is no
+content length after which the stream has to be rebound.
+
+Subscriptions and listeners are the same as with LSClient.
+"""
+
+import itertools
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from importlib.util import find_spec
+
+from six.moves.urllib.parse import quote, unquote, urlencode
+
+from .lightstreamer import (
+    LSClient,
+    OK_CMD,
+    ERROR_CMD,
+    LOOP_CMD,
+    notify,
+    split_batches,
+)
+
+log = logging.getLogger(__name__)
+
+# websockets is only imported when a WSLSClient connects
+_HAS_WEBSOCKETS = find_spec("websockets") is not None
+
+TLCP_PROTOCOL = "TLCP-2.1.0.lightstreamer.com"
+WS_PATH = "lightstreamer"
+
+
+def encode_params(params):
+    """Returns the percent encoded non empty params of a TLCP request"""
+    params = [(k, v) for (k, v) in params.items() if v not in (None, "")]
+    return urlencode(params, quote_via=quote)
+
+
+def encode_request(name, params):
+    """Returns a TLCP request: name and percent encoded non empty params"""
+    return name + "\r\n" + encode_params(params)
+
+
+def encode_batches(name, params_list, limit):
+    """Yields the messages of a batch of TLCP requests of the same name:
+    name and one line of params per request, split to fit limit"""
+    lines = [encode_params(params) for params in params_list]
+    for batch in split_batches(lines, limit - len(name) - 2):
+        yield "\r\n".join([name] + batch)
+
+
+def parse_update(message):
+    """Parses a TLCP update message U,<table>,<item>,<values>, returns
+    (table, tokens) where tokens are the item position and the values
+    encoded as expected by Subscription.notifyupdate"""
+    _, table, item, values = message.split(",", 3)
+    toks = [item]
+    for value in values.split("|"):
+        if not value or value == "#" or value == "$":
+            # unchanged, null or empty value
+            toks.append(value)
+        elif value[0] == "^":
+            # ^n: n unchanged values
+            toks.extend([""] * int(value[1:]))
+        else:
+            if "%" in value:
+                value = unquote(value)
+            if value[0] in "#$":
+                # Subscription._decode removes this escape character
+                value = "$" + value
+            toks.append(value)
+    return int(table), toks
+
+
+def ws_url(base_url):
+    """Returns the WebSocket URL of a server from its parsed base url"""
+    scheme = {"http": "ws", "https": "wss"}.get(base_url.scheme, base_url.scheme)
+    path = base_url.path.rstrip("/") + "/" + WS_PATH
+    return base_url._replace(scheme=scheme, path=path).geturl()
+
+
+def control_params(params):
+    """Returns the TLCP params of a control request given with the
+    LSClient names (LS_Table, LS_id)"""
+    params = dict(params)
+    if "LS_Table" in params:
+        params["LS_subId"] = params.pop("LS_Table")
+    if "LS_id" in params:
+        params["LS_group"] = params.pop("LS_id")
+    return params
+
+
+def parse_response(message):
+    """Parses REQOK,<id> or REQERR,<id>,<code>,<message>, returns
+    (id, response) where response is OK or ERROR,<code>,<message> as
+    returned by LSClient control requests"""
+    toks = message.split(",", 2)
+    if toks[0] == "REQOK":
+        return int(toks[1]), OK_CMD
+    return int(toks[1]), ERROR_CMD + "," + toks[2]
+
+
+class _Request(object):
+    """A control request waiting for its response"""
+
+    __slots__ = ("event", "response")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+
+
+class _TLCPClient(object):
+    """TLCP messages of the WebSocket clients (WSLSClient and
+    AsyncLSClient), whatever the way they are sent and received: the
+    subclass sends the requests and resolves their responses
+    (_resolve_request)"""
+
+    # messages received before the response to create_session
+    INFORMATION = ("SERVNAME", "CLIENTIP", "CONS", "NOOP")
+
+    def _create_session_request(self):
+        return encode_request(
+            "create_session",
+            {
+                "LS_cid": "mgQkwtwdysogQz2BJ4Ji kOj2Bg",
+                "LS_adapter_set": self._adapter_set,
+                "LS_user": self._user,
+                "LS_password": self._password,
+            },
+        )
+
+    def _bind_request(self):
+        return encode_request(
+            "bind_session", {"LS_session": self._session["SessionId"]}
+        )
+
+    def _set_session(self, message):
+        """Sets the session from CONOK,<id>,<request limit>,<keep alive>,
+        <control link>"""
+        toks = message.split(",")
+        self._session["SessionId"] = toks[1]
+        self._session["RequestLimit"] = toks[2]
+        self._session["KeepAlive"] = toks[3]
+        if len(toks) > 4 and toks[4] != "*":
+            self._session["ControlAddress"] = toks[4]
+
+    def _control_messages(self, params_list, req_ids):
+        """Returns the messages of a batch of control requests given with
+        the LSClient names, numbered with req_ids"""
+        params_list = [
+            dict(control_params(params), LS_reqId=req_id)
+            for (params, req_id) in zip(params_list, req_ids)
+        ]
+        return list(encode_batches("control", params_list, self._request_limit()))
+
+    def _forward_update_message(self, update_message):
+        """Forwards a TLCP update to its Subscription"""
+        self.update_count += 1
+        table, toks = parse_update(update_message)
+        if table in self._subscriptions:
+            self._subscriptions[table].notifyupdate(toks)
+        else:
+            log.warning("No subscription found!")
+
+    def _handle_message(self, message):
+        """Handles a message of the stream, returns LOOP_CMD when the
+        session is to be bound again, the message when it ends the
+        session, None otherwise"""
+        self._last_message_time = time.time()
+        if message.startswith("U,"):
+            self._forward_update_message(message)
+        elif message.startswith(("REQOK", "REQERR")):
+            self._resolve_request(message)
+        elif message.startswith(LOOP_CMD):
+            log.debug("LOOP")
+            return LOOP_CMD
+        elif message.startswith("CONOK"):
+            self._set_session(message)
+        elif message.startswith(("END", "CONERR", "ERROR")):
+            log.info("Session closed by the server: {0}".format(message))
+            return message
+        elif message.startswith("OV,"):
+            log.warning("Updates lost by the server: {0}".format(message))
+        else:
+            # PROBE, NOOP, SUBOK, UNSUB, EOS, CS, CONF, SYNC, PROG...
+            log.debug("Received message ---> <{0}>".format(message))
+        return None
+
+
+class WSLSClient(_TLCPClient, LSClient):
+    """LSClient using one WebSocket connection for the stream and the
+    control requests (requires websockets)"""
+
+    def __init__(
+        self,
+        base_url,
+        adapter_set="",
+        user="",
+        password="",
+        timeout=10.0,
+        recovery=None,
+    ):
+        if not _HAS_WEBSOCKETS:
+            raise ImportError("WSLSClient requires websockets (pip install websockets)")
+        super(WSLSClient, self).__init__(
+            base_url, adapter_set, user, password, recovery
+        )
+        self.timeout = timeout
+        self._lines = deque()
+        self._send_lock = threading.Lock()
+        self._req_ids = itertools.count(1)
+        self._requests = {}
+
+    def _ws_url(self):
+        """Returns the WebSocket URL of the server"""
+        return ws_url(self._base_url)
+
+    def _send(self, request):
+        with self._send_lock:
+            self._stream_connection.send(request)
+
+    def _read_from_stream(self):
+        """Read a single line (WebSocket messages can hold several)"""
+        while not self._lines:
+            try:
+                message = self._stream_connection.recv()
+            except self._connection_closed:
+                return u""
+            self._lines.extend(line for line in message.split("\r\n") if line)
+        return self._lines.popleft()
+
+    def _create_session(self):
+        """Opens the WebSocket connection and creates a new session"""
+        from websockets.exceptions import ConnectionClosed
+        from websockets.sync.client import connect
+
+        self._connection_closed = ConnectionClosed
+        connection = connect(
+            self._ws_url(), subprotocols=[TLCP_PROTOCOL], open_timeout=self.timeout
+        )
+        # recent websockets expect connect() to be used as a context manager,
+        # the connection is closed by disconnect() or at the end of the stream
+        self._stream_connection = connection.__enter__()
+        self._lines.clear()
+        self._send(self._create_session_request())
+        while True:
+            stream_line = self._read_from_stream()
+            if not stream_line.startswith(self.INFORMATION):
+                break
+        self._handle_stream(stream_line)
+
+    def _handle_stream(self, stream_line):
+        if stream_line.startswith("CONOK"):
+            self._set_session(stream_line)
+        else:
+            self._stream_connection.close()
+            self._stream_connection = None
+            log.error("Server response error: \n{0}".format(stream_line))
+            raise IOError(stream_line)
+
+    def bind(self):
+        """Rebinds the session on the same WebSocket connection (after a
+        LOOP message), in place: the CONOK response is read by the stream
+        thread like any other message"""
+        self._bind_counter += 1
+        self._send(self._bind_request())
+
+    def _control(self, params):
+        """Sends a control request on the WebSocket connection and waits for
+        its response, returns OK or ERROR,<code>,<message>"""
+        return self._control_batch([params])[0]
+
+    def _control_batch(self, params_list):
+        """Sends several control requests in one WebSocket message, returns
+        their responses"""
+        req_ids = [next(self._req_ids) for _ in params_list]
+        requests = [_Request() for _ in params_list]
+        self._requests.update(zip(req_ids, requests))
+        deadline = time.time() + self.timeout
+        try:
+            for message in self._control_messages(params_list, req_ids):
+                self._send(message)
+            for req_id, request in zip(req_ids, requests):
+                if not request.event.wait(max(deadline - time.time(), 0)):
+                    raise IOError("No response to request {0}".format(req_id))
+        finally:
+            for req_id in req_ids:
+                self._requests.pop(req_id, None)
+        return [request.response for request in requests]
+
+    def _resubscribe(self):
+        """Subscribes the new session to every subscription, in one batch
+        of control requests. Called by the stream thread, which reads the
+        responses: they are not waited for, errors are logged."""
+        keys, params_list = self._resubscribe_params()
+        req_ids = [next(self._req_ids) for _ in keys]
+        for message in self._control_messages(params_list, req_ids):
+            self._send(message)
+
+    def _resolve_request(self, message):
+        """Passes REQOK,<id> or REQERR,<id>,<code>,<message> to the waiting
+        request"""
+        req_id, response = parse_response(message)
+        request = self._requests.get(req_id)
+        if request is None:
+            # not waited for (see _resubscribe), or timed out
+            if response != OK_CMD:
+                log.error("Request {0} failed: {1}".format(req_id, response))
+            return
+        request.response = response
+        request.event.set()
+
+    def _receive(self):
+        """Reads the messages of the WebSocket connection until the session
+        ends, returns (False, cause) (the session is rebound in place)"""
+        receive = True
+        cause = None
+        while receive:
+            try:
+                message = self._read_from_stream()
+            except Exception:
+                log.error("Communication error")
+                log.error(traceback.format_exc())
+                message = None
+
+            if notify:
+                notify("WATCHDOG=1")
+
+            if not message:
+                receive = False
+                cause = "connection closed"
+                log.warning("Connection closed")
+                continue
+            event = self._handle_message(message)
+            if event == LOOP_CMD:
+                self.bind()
+            elif event is not None:
+                receive = False
+                cause = event
+
+        for request in list(self._requests.values()):
+            if not request.event.is_set():
+                request.response = ERROR_CMD + ",closed"
+                request.event.set()
+        return False, cause
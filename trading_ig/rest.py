@@ -8,21 +8,22 @@ Original version by Lewis Barber - 2014 - http://uk.linkedin.com/in/lewisbarber/
 Modified by Femto Trader - 2014-2015 - https://github.com/femtotrader/
 """  # noqa
 
+import functools
 import json
 import logging
+import os
+import pickle
+import threading
 import time
 from base64 import b64encode, b64decode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 
-from Crypto.Cipher import PKCS1_v1_5
-from Crypto.PublicKey import RSA
-from requests import Session
-import pandas as pd
-
-import numpy as np
-from pandas import json_normalize
-
+from .scheduler import RequestScheduler
 from .utils import _HAS_PANDAS, _HAS_MUNCH
 from .utils import conv_resol, conv_datetime, conv_to_ms, DATE_FORMATS, munchify
+from .utils import json_decoder
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +32,27 @@ class IGException(Exception):
     pass
 
 
+def _flow(method):
+    """Decorates an IGService method written as a request flow.
+
+    A flow is a generator yielding the result of each ``self._req(...)``,
+    ``self._sleep(...)`` or nested flow call and receiving it back, so the
+    same endpoint/param/DataFrame logic is run synchronously by IGService
+    and as a coroutine by AsyncIGService (see ``_run``)."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self._run(method(self, *args, **kwargs))
+
+    return wrapper
+
+
 class IGSessionCRUD(object):
-    """Session with CRUD operation"""
+    """Session with CRUD operation
+
+    Session tokens and HEADERS belong to the instance and are only replaced
+    when tokens change. Headers of a request (including its VERSION) are
+    built per request, so one session can be used from several threads."""
 
     CLIENT_TOKEN = None
     SECURITY_TOKEN = None
@@ -43,12 +63,12 @@ class IGSessionCRUD(object):
 
     BASE_URL = None
 
-    HEADERS = {}
-
     def __init__(self, base_url, api_key, session):
         self.BASE_URL = base_url
         self.API_KEY = api_key
 
+        self._lock = threading.Lock()
+        self.HEADERS = {}
         self.HEADERS["BASIC"] = {
             "X-IG-API-KEY": self.API_KEY,
             "Content-Type": "application/json",
@@ -77,16 +97,16 @@ class IGSessionCRUD(object):
         """Returns url from endpoint and base url"""
         return self.BASE_URL + endpoint
 
-    def _create_first(self, endpoint, params, session, version):
+    def _prepare_create_first(self, endpoint, params, version):
         """Create first = POST with headers=BASIC_HEADERS"""
-        url = self._url(endpoint)
-        session = self._get_session(session)
         if type(params["password"]) is bytes:
             params["password"] = params["password"].decode()
-        response = session.post(
-            url, data=json.dumps(params), headers=self.HEADERS["BASIC"]
-        )
-        if not response.ok:
+        headers = self._headers("BASIC")
+        return "POST", {"data": json.dumps(params), "headers": headers}
+
+    def _handle_create_first(self, response):
+        """Stores session tokens of a successful login"""
+        if response.status_code >= 400:
             raise (
                 Exception(
                     "HTTP status code %s %s " % (response.status_code, response.text)
@@ -96,80 +116,118 @@ class IGSessionCRUD(object):
         self.create = self._create_logged_in
         return response
 
-    def _create_logged_in(self, endpoint, params, session, version):
+    def _prepare_create_logged_in(self, endpoint, params, version):
         """Create when logged in = POST with headers=LOGGED_IN_HEADERS"""
-        url = self._url(endpoint)
-        session = self._get_session(session)
-        self.HEADERS["LOGGED_IN"]["VERSION"] = version
-        response = session.post(
-            url, data=json.dumps(params), headers=self.HEADERS["LOGGED_IN"]
-        )
+        headers = self._headers("LOGGED_IN", version)
+        return "POST", {"data": json.dumps(params), "headers": headers}
+
+    def _prepare_read(self, endpoint, params, version):
+        """Read = GET with headers=LOGGED_IN_HEADERS"""
+        headers = self._headers("LOGGED_IN", version)
+        return "GET", {"params": params, "headers": headers}
+
+    def _prepare_read_basic(self, endpoint, params, version):
+        """Read without being logged in = GET with headers=BASIC_HEADERS"""
+        return "GET", {"params": params, "headers": self._headers("BASIC")}
+
+    def _prepare_update(self, endpoint, params, version):
+        """Update = PUT with headers=LOGGED_IN_HEADERS"""
+        headers = self._headers("LOGGED_IN", version)
+        return "PUT", {"data": json.dumps(params), "headers": headers}
+
+    def _prepare_delete(self, endpoint, params, version):
+        """Delete = POST with DELETE_HEADERS"""
+        headers = self._headers("DELETE", version)
+        return "POST", {"data": json.dumps(params), "headers": headers}
+
+    def _headers(self, name, version=None):
+        """Returns the named headers for one request, HEADERS itself is
+        never modified so concurrent requests don't race on VERSION"""
+        with self._lock:
+            headers = dict(self.HEADERS[name])
+        if version is not None:
+            headers["VERSION"] = version
+        return headers
+
+    def prepare(self, action, endpoint, params, version):
+        """Returns (method, url, kwargs) of a CRUD request. kwargs are
+        requests style keyword arguments (params, data, headers)"""
+        if action == "create":
+            if self.create == self._create_first:
+                prepare = self._prepare_create_first
+            else:
+                prepare = self._prepare_create_logged_in
+        else:
+            d_actions = {
+                "read": self._prepare_read,
+                "read_basic": self._prepare_read_basic,
+                "update": self._prepare_update,
+                "delete": self._prepare_delete,
+            }
+            prepare = d_actions[action]
+        method, kwargs = prepare(endpoint, params, version)
+        return method, self._url(endpoint), kwargs
+
+    def handle(self, action, response):
+        """Post-processes the response of a CRUD request"""
+        if action == "create" and self.create == self._create_first:
+            return self._handle_create_first(response)
         return response
 
+    def _create_first(self, endpoint, params, session, version):
+        """Create first = POST with headers=BASIC_HEADERS"""
+        return self.req("create", endpoint, params, session, version)
+
+    def _create_logged_in(self, endpoint, params, session, version):
+        """Create when logged in = POST with headers=LOGGED_IN_HEADERS"""
+        return self.req("create", endpoint, params, session, version)
+
     def read(self, endpoint, params, session, version):
         """Read = GET with headers=LOGGED_IN_HEADERS"""
-        url = self._url(endpoint)
-        session = self._get_session(session)
-        self.HEADERS["LOGGED_IN"]["VERSION"] = version
-        response = session.get(url, params=params, headers=self.HEADERS["LOGGED_IN"])
-        return response
+        return self.req("read", endpoint, params, session, version)
 
     def update(self, endpoint, params, session, version):
         """Update = PUT with headers=LOGGED_IN_HEADERS"""
-        url = self._url(endpoint)
-        session = self._get_session(session)
-        self.HEADERS["LOGGED_IN"]["VERSION"] = version
-        response = session.put(
-            url, data=json.dumps(params), headers=self.HEADERS["LOGGED_IN"]
-        )
-        return response
+        return self.req("update", endpoint, params, session, version)
 
     def delete(self, endpoint, params, session, version):
         """Delete = POST with DELETE_HEADERS"""
-        url = self._url(endpoint)
-        session = self._get_session(session)
-        self.HEADERS["DELETE"]["VERSION"] = version
-        response = session.post(
-            url, data=json.dumps(params), headers=self.HEADERS["DELETE"]
-        )
-        return response
+        return self.req("delete", endpoint, params, session, version)
 
     def req(self, action, endpoint, params, session, version):
         """Send a request (CREATE READ UPDATE or DELETE)"""
-        d_actions = {
-            "create": self.create,
-            "read": self.read,
-            "update": self.update,
-            "delete": self.delete,
-        }
-        return d_actions[action](endpoint, params, session, version)
+        session = self._get_session(session)
+        method, url, kwargs = self.prepare(action, endpoint, params, version)
+        response = session.request(method, url, **kwargs)
+        return self.handle(action, response)
 
     def _set_headers(self, response_headers, update_cst):
-        """Sets headers"""
-        if update_cst:
-            self.CLIENT_TOKEN = response_headers["CST"]
-
-        if "X-SECURITY-TOKEN" in response_headers:
-            self.SECURITY_TOKEN = response_headers["X-SECURITY-TOKEN"]
-        else:
-            self.SECURITY_TOKEN = None
+        """Sets session tokens and headers"""
+        with self._lock:
+            if update_cst:
+                self.CLIENT_TOKEN = response_headers["CST"]
 
-        self.HEADERS["LOGGED_IN"] = {
-            "X-IG-API-KEY": self.API_KEY,
-            "X-SECURITY-TOKEN": self.SECURITY_TOKEN,
-            "CST": self.CLIENT_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json; charset=UTF-8",
-        }
+            if "X-SECURITY-TOKEN" in response_headers:
+                self.SECURITY_TOKEN = response_headers["X-SECURITY-TOKEN"]
+            else:
+                self.SECURITY_TOKEN = None
+
+            self.HEADERS["LOGGED_IN"] = {
+                "X-IG-API-KEY": self.API_KEY,
+                "X-SECURITY-TOKEN": self.SECURITY_TOKEN,
+                "CST": self.CLIENT_TOKEN,
+                "Content-Type": "application/json",
+                "Accept": "application/json; charset=UTF-8",
+            }
 
-        self.HEADERS["DELETE"] = {
-            "X-IG-API-KEY": self.API_KEY,
-            "X-SECURITY-TOKEN": self.SECURITY_TOKEN,
-            "CST": self.CLIENT_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json; charset=UTF-8",
-            "_method": "DELETE",
-        }
+            self.HEADERS["DELETE"] = {
+                "X-IG-API-KEY": self.API_KEY,
+                "X-SECURITY-TOKEN": self.SECURITY_TOKEN,
+                "CST": self.CLIENT_TOKEN,
+                "Content-Type": "application/json",
+                "Accept": "application/json; charset=UTF-8",
+                "_method": "DELETE",
+            }
 
 
 class IGService:
@@ -183,9 +241,27 @@ class IGService:
     IG_USERNAME = None
     IG_PASSWORD = None
 
-    def __init__(self, username, password, api_key, acc_type="demo", session=None):
+    def __init__(
+        self,
+        username,
+        password,
+        api_key,
+        acc_type="demo",
+        session=None,
+        rate_limit=False,
+        bar_store=None,
+    ):
         """Constructor, calls the method required to connect to
-        the API (accepts acc_type = LIVE or DEMO)"""
+        the API (accepts acc_type = LIVE or DEMO)
+
+        rate_limit: False (default) to send requests immediately, True to
+        queue requests according to IG default allowances or a
+        RequestScheduler (which can be shared by services using the same
+        account). A queued request raises RateLimitException instead of
+        waiting more than the max_wait of the scheduler (300 s by default).
+
+        bar_store: a BarStore where historical prices fetched by date range
+        are kept, so that only missing bars are downloaded"""
         self.API_KEY = api_key
         self.IG_USERNAME = username
         self.IG_PASSWORD = password
@@ -197,22 +273,40 @@ class IGService:
                               acc_type)
 
         self.parse_response = self.parse_response_with_exception
+        self.json_loads = json_decoder()
 
         self.return_dataframe = _HAS_PANDAS
         self.return_munch = _HAS_MUNCH
 
         if session is None:
-            self.session = Session()  # Requests Session (global)
+            self.session = self._new_session()
         else:
             self.session = session
 
         self.crud_session = IGSessionCRUD(self.BASE_URL, self.API_KEY, self.session)
 
+        if rate_limit is True:
+            self.scheduler = RequestScheduler()
+        elif rate_limit:
+            self.scheduler = rate_limit
+        else:
+            self.scheduler = None
+
+        self.bar_store = bar_store
+
+    def _new_session(self):
+        """Returns the session used when none is given"""
+        from requests import Session
+
+        return Session()  # Requests Session (global)
+
     def _get_session(self, session):
         """Returns a Requests session (from self.session) if session is None
         or session if it's not None (cached session with requests-cache
         for example)
         """
+        from requests import Session
+
         if session is None:
             session = self.session  # requests Session
         else:
@@ -227,24 +321,55 @@ class IGService:
     def _req(self, action, endpoint, params, session, version='1'):
         """Creates a CRUD request and returns response"""
         session = self._get_session(session)
+        if self.scheduler is not None:
+            self.scheduler.acquire(action, endpoint, params)
         response = self.crud_session.req(action, endpoint, params, session, version)
         response.encoding = 'utf-8'
         return response
 
+    def _sleep(self, seconds):
+        """Pauses a request flow"""
+        time.sleep(seconds)
+
+    def _blocking(self, func, *args):
+        """Runs a blocking call (like BarStore I/O) of a request flow"""
+        return func(*args)
+
+    def _update_allowance(self, data):
+        """Aligns the historical data allowance of the scheduler with
+        the remaining allowance returned by IG with prices"""
+        allowance = data.get("allowance") or data.get("metadata", {}).get(
+            "allowance"
+        )
+        if allowance and self.scheduler is not None:
+            self.scheduler.set_level("historical", allowance["remainingAllowance"])
+
+    def _run(self, flow):
+        """Runs a request flow synchronously: every step yielded by the flow
+        is already the result of a blocking call, so it is sent back as is"""
+        result = None
+        try:
+            while True:
+                result = flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+
     # ---------- PARSE_RESPONSE ----------- #
 
-    def parse_response_without_exception(self, *args, **kwargs):
-        """Parses JSON response
+    def parse_response_without_exception(self, content):
+        """Parses JSON response (response.content bytes or str)
+        with self.json_loads
         returns dict
         no exception raised when error occurs"""
-        response = json.loads(*args, **kwargs)
+        response = self.json_loads(content)
         return response
 
-    def parse_response_with_exception(self, *args, **kwargs):
-        """Parses JSON response
+    def parse_response_with_exception(self, content):
+        """Parses JSON response (response.content bytes or str)
+        with self.json_loads
         returns dict
         exception raised when error occurs"""
-        response = json.loads(*args, **kwargs)
+        response = self.json_loads(content)
         if "errorCode" in response:
             raise (Exception(response["errorCode"]))
         return response
@@ -285,14 +410,16 @@ class IGService:
 
     # -------- ACCOUNT ------- #
 
+    @_flow
     def fetch_accounts(self, session=None):
         """Returns a list of accounts belonging to the logged-in client"""
         params = {}
         endpoint = "/accounts"
         action = "read"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["accounts"])
             d_cols = {"balance": [u"available", u"balance", u"deposit", u"profitLoss"]}
@@ -320,6 +447,7 @@ class IGService:
 
         return data
 
+    @_flow
     def fetch_account_activity_by_period(self, milliseconds, session=None):
         """
         Returns the account activity history for the last specified period
@@ -329,9 +457,10 @@ class IGService:
         url_params = {"milliseconds": milliseconds}
         endpoint = "/history/activity/{milliseconds}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["activities"])
 
@@ -360,6 +489,7 @@ class IGService:
 
         return data
 
+    @_flow
     def fetch_transaction_history_by_type_and_period(
         self, milliseconds, trans_type, session=None
     ):
@@ -372,9 +502,10 @@ class IGService:
             **url_params
         )
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["transactions"])
 
@@ -397,6 +528,7 @@ class IGService:
 
         return data
 
+    @_flow
     def fetch_transaction_history(
         self,
         trans_type=None,
@@ -430,11 +562,10 @@ class IGService:
         endpoint = "/history/transactions"
         action = "read"
 
-        self.crud_session.HEADERS["LOGGED_IN"]["VERSION"] = "2"
-        response = self._req(action, endpoint, params, session)
-        del self.crud_session.HEADERS["LOGGED_IN"]["VERSION"]
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="2")
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["transactions"])
 
@@ -462,6 +593,7 @@ class IGService:
 
     # -------- DEALING -------- #
 
+    @_flow
     def fetch_deal_by_deal_reference(self, deal_reference, session=None):
         """Returns a deal confirmation for the given deal reference"""
         params = {}
@@ -469,23 +601,25 @@ class IGService:
         endpoint = "/confirms/{deal_reference}".format(**url_params)
         action = "read"
         for i in range(5):
-            response = self._req(action, endpoint, params, session, version="1")
+            response = yield self._req(action, endpoint, params, session, version="1")
             if response.status_code == 404:
                 logger.info("Deal reference %s not found, retrying." % deal_reference)
-                time.sleep(1)
+                yield self._sleep(1)
             else:
                 break
-        data = self.parse_response(response.text)
+        data = self.parse_response(response.content)
         return data
 
+    @_flow
     def fetch_open_positions(self, session=None):
         """Returns all open positions for the active account"""
         params = {}
         endpoint = "/positions"
         action = "read"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             lst = data["positions"]
             data = pd.DataFrame(lst)
@@ -533,6 +667,7 @@ class IGService:
 
         return data
 
+    @_flow
     def close_open_position(
         self,
         deal_id,
@@ -559,14 +694,15 @@ class IGService:
         }
         endpoint = "/positions/otc"
         action = "delete"
-        response = self._req(action, endpoint, params, session, version)
+        response = yield self._req(action, endpoint, params, session, version)
 
         if response.status_code == 200:
-            deal_reference = json.loads(response.text)["dealReference"]
-            return self.fetch_deal_by_deal_reference(deal_reference)
+            deal_reference = self.json_loads(response.content)["dealReference"]
+            return (yield self.fetch_deal_by_deal_reference(deal_reference))
         else:
             raise IGException(response.text)
 
+    @_flow
     def create_open_position(
         self,
         currency_code,
@@ -611,42 +747,39 @@ class IGService:
         action = "create"
 
         # Trailing stop is supported in version 2
-        # Version headers should be include
-
-        # self.crud_session.HEADERS['LOGGED_IN']['Version'] = '2'
-        response = self._req(action, endpoint, params, session, version="2")
-        if "Version" in self.crud_session.HEADERS["LOGGED_IN"]:
-            del self.crud_session.HEADERS["LOGGED_IN"]["VERSION"]
+        response = yield self._req(action, endpoint, params, session, version="2")
 
-        # Remove the header to back compatibility
         if response.status_code == 200:
-            deal_reference = json.loads(response.text)["dealReference"]
-            return self.fetch_deal_by_deal_reference(deal_reference)
+            deal_reference = self.json_loads(response.content)["dealReference"]
+            return (yield self.fetch_deal_by_deal_reference(deal_reference))
         else:
             raise IGException(response.text)
 
+    @_flow
     def update_open_position(self, limit_level, stop_level, deal_id, session=None):
         """Updates an OTC position"""
         params = {"limitLevel": limit_level, "stopLevel": stop_level}
         url_params = {"deal_id": deal_id}
         endpoint = "/positions/otc/{deal_id}".format(**url_params)
         action = "update"
-        response = self._req(action, endpoint, params, session)
+        response = yield self._req(action, endpoint, params, session)
 
         if response.status_code == 200:
-            deal_reference = json.loads(response.text)["dealReference"]
-            return self.fetch_deal_by_deal_reference(deal_reference)
+            deal_reference = self.json_loads(response.content)["dealReference"]
+            return (yield self.fetch_deal_by_deal_reference(deal_reference))
         else:
             raise IGException(response.text)
 
+    @_flow
     def fetch_working_orders(self, session=None):
         """Returns all open working orders for the active account"""
         params = {}
         endpoint = "/workingorders"
         action = "read"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             lst = data["workingOrders"]
             data = pd.DataFrame(lst)
@@ -706,6 +839,7 @@ class IGService:
 
         return data
 
+    @_flow
     def create_working_order(
         self,
         currency_code,
@@ -758,29 +892,30 @@ class IGService:
         endpoint = "/workingorders/otc"
         action = "create"
 
-        response = self._req(action, endpoint, params, session, VERSION)
-        del self.crud_session.HEADERS["LOGGED_IN"]["VERSION"]
+        response = yield self._req(action, endpoint, params, session, VERSION)
 
         if response.status_code == 200:
-            deal_reference = json.loads(response.text)["dealReference"]
-            return self.fetch_deal_by_deal_reference(deal_reference)
+            deal_reference = self.json_loads(response.content)["dealReference"]
+            return (yield self.fetch_deal_by_deal_reference(deal_reference))
         else:
             raise IGException(response.text)
 
+    @_flow
     def delete_working_order(self, deal_id, session=None):
         """Deletes an OTC working order"""
         params = {}
         url_params = {"deal_id": deal_id}
         endpoint = "/workingorders/otc/{deal_id}".format(**url_params)
         action = "delete"
-        response = self._req(action, endpoint, params, session)
+        response = yield self._req(action, endpoint, params, session)
 
         if response.status_code == 200:
-            deal_reference = json.loads(response.text)["dealReference"]
-            return self.fetch_deal_by_deal_reference(deal_reference)
+            deal_reference = self.json_loads(response.content)["dealReference"]
+            return (yield self.fetch_deal_by_deal_reference(deal_reference))
         else:
             raise IGException(response.text)
 
+    @_flow
     def update_working_order(
         self,
         good_till_date,
@@ -811,11 +946,11 @@ class IGService:
         url_params = {"deal_id": deal_id}
         endpoint = "/workingorders/otc/{deal_id}".format(**url_params)
         action = "update"
-        response = self._req(action, endpoint, params, session)
+        response = yield self._req(action, endpoint, params, session)
 
         if response.status_code == 200:
-            deal_reference = json.loads(response.text)["dealReference"]
-            return self.fetch_deal_by_deal_reference(deal_reference)
+            deal_reference = self.json_loads(response.content)["dealReference"]
+            return (yield self.fetch_deal_by_deal_reference(deal_reference))
         else:
             raise IGException(response.text)
 
@@ -823,6 +958,7 @@ class IGService:
 
     # -------- MARKETS -------- #
 
+    @_flow
     def fetch_client_sentiment_by_instrument(self, market_id, session=None):
         """Returns the client sentiment for the given instrument's market"""
         params = {}
@@ -834,13 +970,14 @@ class IGService:
             url_params = {"market_id": market_id}
             endpoint = "/clientsentiment/{market_id}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if self.return_munch:
 
             data = munchify(data)
         return data
 
+    @_flow
     def fetch_related_client_sentiment_by_instrument(self, market_id, session=None):
         """Returns a list of related (also traded) client sentiment for
         the given instrument's market"""
@@ -848,22 +985,25 @@ class IGService:
         url_params = {"market_id": market_id}
         endpoint = "/clientsentiment/related/{market_id}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["clientSentiments"])
         return data
 
+    @_flow
     def fetch_top_level_navigation_nodes(self, session=None):
         """Returns all top-level nodes (market categories) in the market
         navigation hierarchy."""
         params = {}
         endpoint = "/marketnavigation"
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data["markets"] = pd.DataFrame(data["markets"])
             if len(data["markets"]) == 0:
@@ -898,6 +1038,7 @@ class IGService:
         #     data = munchify(data)
         return data
 
+    @_flow
     def fetch_sub_nodes_by_node(self, node, session=None):
         """Returns all sub-nodes of the given node in the market
         navigation hierarchy"""
@@ -905,34 +1046,38 @@ class IGService:
         url_params = {"node": node}
         endpoint = "/marketnavigation/{node}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data["markets"] = pd.DataFrame(data["markets"])
             data["nodes"] = pd.DataFrame(data["nodes"])
         return data
 
+    @_flow
     def fetch_market_by_epic(self, epic, session=None):
         """Returns the details of the given market"""
         url_params = {"epic": epic}
         endpoint = "/markets/{epic}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, {}, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, {}, session)
+        data = self.parse_response(response.content)
         if _HAS_MUNCH and self.return_munch:
 
             data = munchify(data)
         return data
 
+    @_flow
     def search_markets(self, search_term, session=None):
         """Returns all markets matching the search term"""
         endpoint = "/markets"
         params = {"searchTerm": search_term}
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["markets"])
         return data
@@ -945,6 +1090,7 @@ class IGService:
                 Open High Low Close as Minor_axis axis
          - 'volume' : a timeserie for lastTradedVolume
         """
+        import pandas as pd
 
         df = pd.DataFrame(prices)
         df = df.set_index("snapshotTime")
@@ -979,64 +1125,82 @@ class IGService:
         return prices
 
     def format_prices(self, prices, version, flag_calc_spread=False):
-        """Format prices data as a DataFrame with hierarchical columns"""
+        """Format prices data as a DataFrame with hierarchical columns
+
+        Bid, ask and last traded OHLC values are collected in a single pass
+        over the price dicts and converted by one NumPy call (None becomes
+        NaN), snapshot times are parsed as ISO 8601 strings by NumPy."""
+        import numpy as np
+        import pandas as pd
 
         if len(prices) == 0:
             raise (Exception("Historical price data not found"))
 
-        def cols(typ):
-            return {
-                "openPrice.%s" % typ: "Open",
-                "highPrice.%s" % typ: "High",
-                "lowPrice.%s" % typ: "Low",
-                "closePrice.%s" % typ: "Close",
-                "lastTradedVolume": "Volume",
-            }
-
         last = prices[0]["lastTradedVolume"] or prices[0]["closePrice"]["lastTraded"]
-        df = json_normalize(prices)
-        df = df.set_index("snapshotTime")
-        df.index = pd.to_datetime(df.index, format=DATE_FORMATS[int(version)])
-        df.index.name = "DateTime"
-
-        df_ask = df[
-            ["openPrice.ask", "highPrice.ask", "lowPrice.ask", "closePrice.ask"]
-        ]
-        df_ask = df_ask.rename(columns=cols("ask"))
-
-        df_bid = df[
-            ["openPrice.bid", "highPrice.bid", "lowPrice.bid", "closePrice.bid"]
-        ]
-        df_bid = df_bid.rename(columns=cols("bid"))
 
+        times = []
+        volumes = []
+        rows = []
+        for price in prices:
+            op = price["openPrice"]
+            hp = price["highPrice"]
+            lp = price["lowPrice"]
+            cp = price["closePrice"]
+            times.append(price["snapshotTime"])
+            volumes.append(price["lastTradedVolume"])
+            rows.append(
+                (
+                    op["bid"], hp["bid"], lp["bid"], cp["bid"],
+                    op["ask"], hp["ask"], lp["ask"], cp["ask"],
+                    op["lastTraded"], hp["lastTraded"],
+                    lp["lastTraded"], cp["lastTraded"],
+                )
+            )
+        values = np.array(rows, dtype=float)
+
+        index = self._snapshot_times(times, version)
+        ohlc = ["Open", "High", "Low", "Close"]
+        d = {}
+        for i, col in enumerate(ohlc):
+            d[("bid", col)] = values[:, i]
+        for i, col in enumerate(ohlc):
+            d[("ask", col)] = values[:, 4 + i]
         if flag_calc_spread:
-            df_spread = df_ask - df_bid
-
+            for i, col in enumerate(ohlc):
+                d[("spread", col)] = values[:, 4 + i] - values[:, i]
         if last:
-            df_last = df[
-                [
-                    "openPrice.lastTraded",
-                    "highPrice.lastTraded",
-                    "lowPrice.lastTraded",
-                    "closePrice.lastTraded",
-                    "lastTradedVolume",
-                ]
-            ]
-            df_last = df_last.rename(columns=cols("lastTraded"))
+            for i, col in enumerate(ohlc):
+                d[("last", col)] = values[:, 8 + i]
+            volume = np.array(volumes)
+            if volume.dtype == object:
+                volume = volume.astype(float)
+            d[("last", "Volume")] = volume
 
-        data = [df_bid, df_ask]
-        keys = ["bid", "ask"]
-        if flag_calc_spread:
-            data.append(df_spread)
-            keys.append("spread")
+        return pd.DataFrame(d, index=index)
 
-        if last:
-            data.append(df_last)
-            keys.append("last")
+    def _snapshot_times(self, times, version):
+        """Returns snapshot times as a DatetimeIndex named DateTime"""
+        import numpy as np
+        import pandas as pd
 
-        df2 = pd.concat(data, axis=1, keys=keys)
-        return df2
+        try:
+            if int(version) == 1:
+                # 2014:12:15-00:00:00
+                iso = [
+                    t[:4] + "-" + t[5:7] + "-" + t[8:10] + " " + t[11:] for t in times
+                ]
+            else:
+                # 2014/12/15 00:00:00
+                iso = [t.replace("/", "-") for t in times]
+            index = pd.DatetimeIndex(
+                np.array(iso, dtype="datetime64[s]").astype("datetime64[ns]")
+            )
+        except ValueError:
+            index = pd.to_datetime(times, format=DATE_FORMATS[int(version)])
+        index.name = "DateTime"
+        return index
 
+    @_flow
     def fetch_historical_prices_by_epic(
         self,
         epic,
@@ -1066,14 +1230,16 @@ class IGService:
             params["pageNumber"] = pagenumber
         endpoint = "/prices/" + epic
         action = "read"
-        response = self._req(action, endpoint, params, session, version)
-        del self.crud_session.HEADERS["LOGGED_IN"]["VERSION"]
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version)
+        data = self.parse_response(response.content)
+        self._update_allowance(data)
         if _HAS_PANDAS and self.return_dataframe:
+            import numpy as np
             data["prices"] = self.format_prices(data["prices"], version)
             data['prices'] = data['prices'].fillna(value=np.nan)
         return data
 
+    @_flow
     def fetch_historical_prices_by_epic_and_num_points(
         self, epic, resolution, numpoints, session=None, version="1"
     ):
@@ -1085,21 +1251,45 @@ class IGService:
         url_params = {"epic": epic, "resolution": resolution, "numpoints": numpoints}
         endpoint = "/prices/{epic}/{resolution}/{numpoints}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session, version)
-        del self.crud_session.HEADERS["LOGGED_IN"]["VERSION"]
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version)
+        data = self.parse_response(response.content)
+        self._update_allowance(data)
         if _HAS_PANDAS and self.return_dataframe:
+            import numpy as np
             data["prices"] = self.format_prices(data["prices"], version)
             data['prices'] = data['prices'].fillna(value=np.nan)
         return data
 
+    @_flow
     def fetch_historical_prices_by_epic_and_date_range(
         self, epic, resolution, start_date, end_date, session=None, version="1"
     ):
         """Returns a list of historical prices for the given epic, resolution,
-        multiplier and date range"""
+        multiplier and date range. With a bar_store, only the sub-ranges
+        missing from the store are downloaded, prices are read from the store"""
         if _HAS_PANDAS and self.return_dataframe:
             resolution = conv_resol(resolution)
+            if self.bar_store is not None:
+                data = yield self._fetch_stored_prices(
+                    epic, resolution, start_date, end_date, session, version
+                )
+                return data
+
+        data = yield self._fetch_prices_by_date_range(
+            epic, resolution, start_date, end_date, session, version
+        )
+        if _HAS_PANDAS and self.return_dataframe:
+            import numpy as np
+            data["prices"] = self.format_prices(data["prices"], version)
+            data['prices'] = data['prices'].fillna(value=np.nan)
+        return data
+
+    @_flow
+    def _fetch_prices_by_date_range(
+        self, epic, resolution, start_date, end_date, session, version
+    ):
+        """Returns the price response (not formatted) for the given epic,
+        IG resolution and date range"""
 
         # v2
         # start_date = conv_datetime(start_date, 2)
@@ -1121,160 +1311,377 @@ class IGService:
         url_params = {"epic": epic, "resolution": resolution}
         endpoint = "/prices/{epic}/{resolution}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session, version)
-        del self.crud_session.HEADERS["LOGGED_IN"]["VERSION"]
-        data = self.parse_response(response.text)
-        if _HAS_PANDAS and self.return_dataframe:
-            data["prices"] = self.format_prices(data["prices"], version)
-            data['prices'] = data['prices'].fillna(value=np.nan)
+        response = yield self._req(action, endpoint, params, session, version)
+        data = self.parse_response(response.content)
+        self._update_allowance(data)
         return data
 
+    @_flow
+    def _fetch_stored_prices(
+        self, epic, resolution, start_date, end_date, session, version
+    ):
+        """Downloads the sub-ranges missing from the bar store, then returns
+        the prices of the whole range read from the store (with the other
+        keys of the last response, if any)"""
+        data = {}
+        missing = yield self._blocking(
+            self.bar_store.missing, epic, resolution, start_date, end_date
+        )
+        for (start, end) in missing:
+            data = yield self._fetch_prices_by_date_range(
+                epic, resolution, start, end, session, version
+            )
+            prices = None
+            if data["prices"]:
+                prices = self.format_prices(data["prices"], version)
+            yield self._blocking(
+                self.bar_store.save, epic, resolution, prices, start, end
+            )
+        data["prices"] = yield self._blocking(
+            self.bar_store.load, epic, resolution, start_date, end_date
+        )
+        return data
+
+    def _price_pages(self, data):
+        """Returns the number of pages of a v3 price response"""
+        page_data = data.get("metadata", {}).get("pageData", {})
+        return max(int(page_data.get("totalPages") or 1), 1)
+
+    def _fetch_price_page(
+        self, epic, resolution, start_date, end_date, pagesize, session, pagenumber
+    ):
+        """Fetches one page of a v3 price request"""
+        if hasattr(start_date, "isoformat"):
+            start_date = start_date.isoformat()
+        if hasattr(end_date, "isoformat"):
+            end_date = end_date.isoformat()
+        return self.fetch_historical_prices_by_epic(
+            epic,
+            resolution,
+            start_date,
+            end_date,
+            pagesize=pagesize,
+            pagenumber=pagenumber,
+            session=session,
+            version="3",
+        )
+
+    def iter_historical_prices(
+        self,
+        epic,
+        resolution,
+        start_date,
+        end_date,
+        pagesize=500,
+        prefetch=0,
+        session=None,
+    ):
+        """Yields the historical prices for the given epic, resolution and
+        date range one page at a time (following metadata.pageData of the v3
+        price request), so a long download is never held in memory at once.
+        With prefetch > 0, up to prefetch next pages are fetched by a thread
+        pool while the current one is processed."""
+        fetch_page = functools.partial(
+            self._fetch_price_page,
+            epic,
+            resolution,
+            start_date,
+            end_date,
+            pagesize,
+            session,
+        )
+
+        data = fetch_page(1)
+        pagenumbers = iter(range(2, self._price_pages(data) + 1))
+        prices = data["prices"]
+        del data
+
+        if prefetch <= 0:
+            yield prices
+            for pagenumber in pagenumbers:
+                yield fetch_page(pagenumber)["prices"]
+            return
+
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        futures = deque(
+            executor.submit(fetch_page, pagenumber)
+            for pagenumber in islice(pagenumbers, prefetch)
+        )
+        try:
+            yield prices
+            while futures:
+                prices = futures.popleft().result()["prices"]
+                for pagenumber in islice(pagenumbers, 1):
+                    futures.append(executor.submit(fetch_page, pagenumber))
+                yield prices
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _checkpoint_file(self, checkpoint, epic):
+        return os.path.join(checkpoint, "%s.pickle" % epic)
+
+    def _checkpoint_params(self, resolution, start_date, end_date):
+        """Returns the request parameters saved with each checkpoint entry"""
+        return (str(resolution), str(start_date), str(end_date))
+
+    def _load_checkpoint(self, checkpoint, epics, params):
+        """Returns {epic: data} of the epics already saved in checkpoint
+        for the request parameters params (entries saved for other
+        parameters are ignored, and overwritten once fetched again)"""
+        results = {}
+        if checkpoint is None:
+            return results
+        if not os.path.isdir(checkpoint):
+            os.makedirs(checkpoint)
+        for epic in epics:
+            filename = self._checkpoint_file(checkpoint, epic)
+            if os.path.exists(filename):
+                with open(filename, "rb") as f:
+                    saved = pickle.load(f)
+                if isinstance(saved, dict) and saved.get("params") == params:
+                    results[epic] = saved["data"]
+                else:
+                    logger.info("Ignoring checkpoint %s of other parameters" % filename)
+        return results
+
+    def _save_checkpoint(self, checkpoint, epic, params, data):
+        """Saves data of epic, with its request parameters params, in
+        checkpoint (atomically, an interrupted write never leaves a
+        truncated file)"""
+        if checkpoint is None:
+            return
+        filename = self._checkpoint_file(checkpoint, epic)
+        with open(filename + ".tmp", "wb") as f:
+            pickle.dump({"params": params, "data": data}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + ".tmp", filename)
+
+    def fetch_historical_prices_bulk(
+        self,
+        epics,
+        resolution,
+        start_date,
+        end_date,
+        max_workers=4,
+        checkpoint=None,
+        progress=None,
+        session=None,
+    ):
+        """Returns the historical prices of many epics for the given
+        resolution and date range, fetched concurrently by max_workers
+        threads (requests are still queued by the rate limiter).
+
+        Returns {"results": {epic: data}, "errors": {epic: exception}},
+        data being the response of fetch_historical_prices_by_epic_and_date_range.
+        progress(done, total, epic, error) is called after each epic.
+        checkpoint is a directory where each fetched epic is saved, so that
+        an interrupted download is resumed without fetching them again
+        (epics saved for another resolution or date range are fetched
+        again)."""
+        epics = list(epics)
+        params = self._checkpoint_params(resolution, start_date, end_date)
+        results = self._load_checkpoint(checkpoint, epics, params)
+        errors = {}
+        todo = [epic for epic in epics if epic not in results]
+        total, done = len(epics), len(results)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict(
+                (
+                    executor.submit(
+                        self.fetch_historical_prices_by_epic_and_date_range,
+                        epic,
+                        resolution,
+                        start_date,
+                        end_date,
+                        session,
+                    ),
+                    epic,
+                )
+                for epic in todo
+            )
+            for future in as_completed(futures):
+                epic = futures[future]
+                error = future.exception()
+                if error is None:
+                    results[epic] = future.result()
+                    self._save_checkpoint(checkpoint, epic, params, results[epic])
+                else:
+                    logger.warning("Can't fetch prices of %s: %r" % (epic, error))
+                    errors[epic] = error
+                done += 1
+                if progress is not None:
+                    progress(done, total, epic, error)
+
+        return {"results": results, "errors": errors}
+
     # -------- END -------- #
 
     # -------- WATCHLISTS -------- #
 
+    @_flow
     def fetch_all_watchlists(self, session=None):
         """Returns all watchlists belonging to the active account"""
         params = {}
         endpoint = "/watchlists"
         action = "read"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["watchlists"])
         return data
 
+    @_flow
     def create_watchlist(self, name, epics, session=None):
         """Creates a watchlist"""
         params = {"name": name, "epics": epics}
         endpoint = "/watchlists"
         action = "create"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         return data
 
+    @_flow
     def delete_watchlist(self, watchlist_id, session=None):
         """Deletes a watchlist"""
         params = {}
         url_params = {"watchlist_id": watchlist_id}
         endpoint = "/watchlists/{watchlist_id}".format(**url_params)
         action = "delete"
-        response = self._req(action, endpoint, params, session)
+        response = yield self._req(action, endpoint, params, session)
         return response.text
 
+    @_flow
     def fetch_watchlist_markets(self, watchlist_id, session=None):
         """Returns the given watchlist's markets"""
         params = {}
         url_params = {"watchlist_id": watchlist_id}
         endpoint = "/watchlists/{watchlist_id}".format(**url_params)
         action = "read"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         if _HAS_PANDAS and self.return_dataframe:
+            import pandas as pd
 
             data = pd.DataFrame(data["markets"])
         return data
 
+    @_flow
     def add_market_to_watchlist(self, watchlist_id, epic, session=None):
         """Adds a market to a watchlist"""
         params = {"epic": epic}
         url_params = {"watchlist_id": watchlist_id}
         endpoint = "/watchlists/{watchlist_id}".format(**url_params)
         action = "update"
-        response = self._req(action, endpoint, params, session, version="1")
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version="1")
+        data = self.parse_response(response.content)
         return data
 
+    @_flow
     def remove_market_from_watchlist(self, watchlist_id, epic, session=None):
         """Remove an market from a watchlist"""
         params = {}
         url_params = {"watchlist_id": watchlist_id, "epic": epic}
         endpoint = "/watchlists/{watchlist_id}/{epic}".format(**url_params)
         action = "delete"
-        response = self._req(action, endpoint, params, session, version="1")
+        response = yield self._req(action, endpoint, params, session, version="1")
         return response.text
 
     # -------- END -------- #
 
     # -------- LOGIN -------- #
 
+    @_flow
     def logout(self, session=None):
         """Log out of the current session"""
         params = {}
         endpoint = "/session"
         action = "delete"
-        self._req(action, endpoint, params, session)
+        yield self._req(action, endpoint, params, session)
 
+    @_flow
     def get_encryption_key(self, session=None):
         """Get encryption key to encrypt the password"""
         endpoint = "/session/encryptionKey"
-        session = self._get_session(session)
-        response = session.get(
-            self.BASE_URL + endpoint, headers=self.crud_session.HEADERS["BASIC"]
-        )
-        if not response.ok:
+        action = "read_basic"
+        response = yield self._req(action, endpoint, {}, session)
+        if response.status_code >= 400:
             raise IGException("Could not get encryption key for login.")
         data = response.json()
         return data["encryptionKey"], data["timeStamp"]
 
+    @_flow
     def encrypted_password(self, session=None):
         """Encrypt password for login"""
-        key, timestamp = self.get_encryption_key(session)
+        from Crypto.Cipher import PKCS1_v1_5
+        from Crypto.PublicKey import RSA
+
+        key, timestamp = yield self.get_encryption_key(session)
         rsakey = RSA.importKey(b64decode(key))
         string = self.IG_PASSWORD + "|" + str(int(timestamp))
         message = b64encode(string.encode())
         return b64encode(PKCS1_v1_5.new(rsakey).encrypt(message)).decode()
 
+    @_flow
     def create_session(self, session=None, encryption=False, version='2'):
         """Creates a trading session, obtaining session tokens for
         subsequent API access"""
-        password = self.encrypted_password(session) if encryption else self.IG_PASSWORD
+        if encryption:
+            password = yield self.encrypted_password(session)
+        else:
+            password = self.IG_PASSWORD
         params = {"identifier": self.IG_USERNAME, "password": password}
         if encryption:
             params["encryptedPassword"] = True
         endpoint = "/session"
         action = "create"
         # this is the first create (BASIC_HEADERS)
-        response = self._req(action, endpoint, params, session, version)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session, version)
+        data = self.parse_response(response.content)
         self.ig_session = data  # store IG session
         return data
 
+    @_flow
     def switch_account(self, account_id, default_account, session=None):
         """Switches active accounts, optionally setting the default account"""
         params = {"accountId": account_id, "defaultAccount": default_account}
         endpoint = "/session"
         action = "update"
-        response = self._req(action, endpoint, params, session)
+        response = yield self._req(action, endpoint, params, session)
         self.crud_session._set_headers(response.headers, False)
-        data = self.parse_response(response.text)
+        data = self.parse_response(response.content)
         return data
 
+    @_flow
     def read_session(self, session=None):
         """Retrieves current session details"""
         params = {}
         endpoint = "/session"
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        if not response.ok:
+        response = yield self._req(action, endpoint, params, session)
+        if response.status_code >= 400:
             raise IGException("Error in read_session() %s" % response.status_code)
-        data = self.parse_response(response.text)
+        data = self.parse_response(response.content)
         return data
 
     # -------- END -------- #
 
     # -------- GENERAL -------- #
 
+    @_flow
     def get_client_apps(self, session=None):
         """Returns a list of client-owned applications"""
         params = {}
         endpoint = "/operations/application"
         action = "read"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         return data
 
+    @_flow
     def update_client_app(
         self,
         allowance_account_overall,
@@ -1292,10 +1699,11 @@ class IGService:
         }
         endpoint = "/operations/application"
         action = "update"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         return data
 
+    @_flow
     def disable_client_app_key(self, session=None):
         """
         Disables the current application key from processing further requests.
@@ -1305,8 +1713,8 @@ class IGService:
         params = {}
         endpoint = "/operations/application/disable"
         action = "update"
-        response = self._req(action, endpoint, params, session)
-        data = self.parse_response(response.text)
+        response = yield self._req(action, endpoint, params, session)
+        data = self.parse_response(response.content)
         return data
 
     # -------- END -------- #
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Client side rate limiting of IG REST requests
+
+IG enforces per account allowances for trading and non-trading requests
+(per minute) and for historical price data (data points per week). The
+RequestScheduler queues requests until the allowances they count against
+have enough tokens, instead of letting IG answer with
+'error.public-api.exceeded-account-allowance'.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60.0
+WEEK = 7 * 24 * 3600.0
+
+# allowance name: (tokens, period in seconds)
+ALLOWANCES = {
+    "trading": (100, MINUTE),
+    "non_trading": (30, MINUTE),
+    "historical": (10000, WEEK),
+}
+
+TRADING_ENDPOINTS = ("/positions/otc", "/workingorders/otc")
+HISTORICAL_ENDPOINTS = ("/prices",)
+
+# lane name: priority (lower goes first)
+LANES = {"dealing": 0, "data": 1}
+DEALING_ENDPOINTS = TRADING_ENDPOINTS + ("/confirms",)
+
+
+class RateLimitException(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """Holds up to capacity tokens, refilled continuously at
+    capacity tokens per period seconds.
+    Not thread safe: RequestScheduler serializes access to its buckets."""
+
+    def __init__(self, capacity, period=MINUTE, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    @property
+    def rate(self):
+        """Tokens added per second"""
+        return self.capacity / self.period
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    @property
+    def level(self):
+        """Current number of tokens"""
+        self._refill()
+        return self._tokens
+
+    def set_level(self, tokens):
+        """Sets the number of tokens (to align with the server allowance)"""
+        self._refill()
+        self._tokens = min(self.capacity, float(tokens))
+
+    def wait_time(self, tokens=1):
+        """Returns seconds until tokens are available (0 if they are now)"""
+        missing = tokens - self.level
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate
+
+    def consume(self, tokens=1):
+        self._refill()
+        self._tokens -= tokens
+
+
+class _Ticket(object):
+    """A request waiting in the scheduler queue"""
+
+    __slots__ = ("costs", "lane", "priority")
+
+    def __init__(self, costs, lane):
+        self.costs = costs
+        self.lane = lane
+        self.priority = LANES[lane]
+
+
+class RequestScheduler(object):
+    """Token bucket scheduler for IG REST requests.
+
+    Every request takes tokens from the allowances it counts against (see
+    classify). Requests are granted in arrival order per allowance: a
+    request only waits for earlier requests sharing one of its allowances,
+    so a queued trading request doesn't delay data reads.
+
+    Requests also belong to a priority lane (see lane): dealing requests
+    (positions, working orders and deal confirmations) are queued ahead of
+    every data request. Time spent waiting is recorded per lane
+    (see lane_stats).
+
+    The same scheduler can be shared by the IGService instances using
+    the same account. Requests which would wait more than max_wait seconds
+    raise RateLimitException instead (None to always wait).
+    """
+
+    def __init__(self, allowances=None, max_wait=300.0, clock=time.monotonic):
+        if allowances is None:
+            allowances = ALLOWANCES
+        self.buckets = dict(
+            (name, TokenBucket(tokens, period, clock))
+            for (name, (tokens, period)) in allowances.items()
+        )
+        self.max_wait = max_wait
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._queue = []
+        self._lane_stats = dict(
+            (lane, {"requests": 0, "total_wait": 0.0, "max_wait": 0.0})
+            for lane in LANES
+        )
+
+    def classify(self, action, endpoint, params=None):
+        """Returns {allowance name: tokens} used by a request, at most the
+        capacity of the allowance"""
+        if action in ("create", "update", "delete") and endpoint.startswith(
+            TRADING_ENDPOINTS
+        ):
+            costs = {"trading": 1}
+        else:
+            costs = {"non_trading": 1}
+        if endpoint.startswith(HISTORICAL_ENDPOINTS):
+            costs["historical"] = self._historical_points(endpoint, params)
+        return dict(
+            (k, min(v, self.buckets[k].capacity))
+            for (k, v) in costs.items()
+            if k in self.buckets
+        )
+
+    def lane(self, action, endpoint):
+        """Returns the priority lane of a request"""
+        if endpoint.startswith(DEALING_ENDPOINTS):
+            return "dealing"
+        return "data"
+
+    def _historical_points(self, endpoint, params):
+        """Estimates the number of data points of a price request: the max
+        number of points when known, 1 otherwise (the level is aligned
+        with the allowance returned by IG afterwards)"""
+        params = params or {}
+        points = params.get("max") or params.get("pageSize")
+        if not points:
+            toks = endpoint.split("/")
+            # /prices/{epic}/{resolution}/{numpoints}
+            if len(toks) == 5 and toks[4].isdigit():
+                points = toks[4]
+        return int(points or 1)
+
+    def _poll(self, ticket):
+        """Grants ticket if possible and returns 0, or returns the estimated
+        number of seconds to wait. Must be called with the lock held."""
+        pending = {}
+        for other in self._queue:
+            if other is ticket:
+                break
+            for name, cost in other.costs.items():
+                pending[name] = pending.get(name, 0) + cost
+        blocked = any(name in pending for name in ticket.costs)
+        wait = 0.0
+        for name, cost in ticket.costs.items():
+            bucket = self.buckets[name]
+            # requests queued before it may need more than a full bucket
+            need = min(pending.get(name, 0) + cost, bucket.capacity)
+            wait = max(wait, bucket.wait_time(need))
+        if not blocked and wait == 0:
+            for name, cost in ticket.costs.items():
+                self.buckets[name].consume(cost)
+            self._queue.remove(ticket)
+            self._cond.notify_all()
+            return 0.0
+        return max(wait, 0.001)
+
+    def _enqueue(self, action, endpoint, params):
+        """Queues a ticket after the tickets of same or higher priority"""
+        costs = self.classify(action, endpoint, params)
+        ticket = _Ticket(costs, self.lane(action, endpoint))
+        i = len(self._queue)
+        while i > 0 and self._queue[i - 1].priority > ticket.priority:
+            i -= 1
+        self._queue.insert(i, ticket)
+        return ticket
+
+    def _record(self, ticket, wait):
+        """Records the time a granted ticket waited in its lane"""
+        stats = self._lane_stats[ticket.lane]
+        stats["requests"] += 1
+        stats["total_wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+
+    def _check_wait(self, ticket, wait, endpoint):
+        if self.max_wait is not None and wait > self.max_wait:
+            self._cancel(ticket)
+            raise RateLimitException(
+                "%s would wait %.0f s for allowance %s"
+                % (endpoint, wait, sorted(ticket.costs))
+            )
+
+    def _cancel(self, ticket):
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            self._cond.notify_all()
+
+    def acquire(self, action, endpoint, params=None):
+        """Blocks until the request can be sent, returns seconds waited"""
+        start = self._clock()
+        with self._cond:
+            ticket = self._enqueue(action, endpoint, params)
+            try:
+                wait = self._poll(ticket)
+                if wait:
+                    self._check_wait(ticket, wait, endpoint)
+                while wait:
+                    self._cond.wait(wait)
+                    wait = self._poll(ticket)
+            except BaseException:
+                self._cancel(ticket)
+                raise
+            waited = self._clock() - start
+            self._record(ticket, waited)
+        return waited
+
+    async def acquire_async(self, action, endpoint, params=None):
+        """Coroutine version of acquire, waits with asyncio.sleep"""
+        import asyncio
+
+        start = self._clock()
+        with self._cond:
+            ticket = self._enqueue(action, endpoint, params)
+            wait = self._poll(ticket)
+            if wait:
+                self._check_wait(ticket, wait, endpoint)
+        try:
+            while wait:
+                await asyncio.sleep(wait)
+                with self._cond:
+                    wait = self._poll(ticket)
+        except BaseException:
+            with self._cond:
+                self._cancel(ticket)
+            raise
+        with self._cond:
+            waited = self._clock() - start
+            self._record(ticket, waited)
+        return waited
+
+    def set_level(self, name, tokens):
+        """Aligns an allowance with the remaining allowance returned by IG"""
+        with self._cond:
+            if name in self.buckets:
+                self.buckets[name].set_level(tokens)
+                self._cond.notify_all()
+
+    @property
+    def limits(self):
+        """Returns {allowance name: (tokens, period in seconds)}"""
+        return dict(
+            (name, (bucket.capacity, bucket.period))
+            for (name, bucket) in self.buckets.items()
+        )
+
+    def stats(self):
+        """Returns {allowance name: {capacity, period, level, queued}}"""
+        with self._cond:
+            d = {}
+            for name, bucket in self.buckets.items():
+                d[name] = {
+                    "capacity": bucket.capacity,
+                    "period": bucket.period,
+                    "level": bucket.level,
+                    "queued": sum(1 for t in self._queue if name in t.costs),
+                }
+            return d
+
+    def lane_stats(self):
+        """Returns {lane: {requests, queued, total_wait, mean_wait, max_wait}},
+        waits being the queueing latency added by the scheduler in seconds"""
+        with self._cond:
+            d = {}
+            for lane, stats in self._lane_stats.items():
+                stats = dict(stats)
+                stats["queued"] = sum(1 for t in self._queue if t.lane == lane)
+                if stats["requests"]:
+                    stats["mean_wait"] = stats["total_wait"] / stats["requests"]
+                else:
+                    stats["mean_wait"] = 0.0
+                d[lane] = stats
+            return d
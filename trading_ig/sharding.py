@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Subscriptions spread over several Lightstreamer sessions
+
+A ShardedLSClient has the subscribe/unsubscribe API of LSClient, but each
+subscription is placed in one of several sessions (shards), each with its
+own connection and reader thread. Listeners are unchanged: they are added
+to the Subscription, whatever its shard. A subscription goes to a shard
+chosen by:
+ - HASH: a hash of its item names, the same in every process
+ - LOAD: the shard with the fewest subscribed items
+"""
+
+import functools
+import logging
+import time
+import zlib
+from collections import OrderedDict
+
+from .lightstreamer import ERROR_CMD, OK_CMD
+
+logger = logging.getLogger(__name__)
+
+HASH = "hash"
+LOAD = "load"
+STRATEGIES = (HASH, LOAD)
+
+
+def item_shard(item_names, shards):
+    """Returns the shard of the items of a subscription among shards"""
+    return zlib.crc32(" ".join(item_names).encode("utf-8")) % shards
+
+
+class ShardedLSClient(object):
+    """Lightstreamer client spreading subscriptions over the sessions of
+    clients (LSClient or WSLSClient), subscription keys are global
+
+        ls_client = ShardedLSClient([LSClient(...) for _ in range(4)])
+        ls_client.connect()
+        key = ls_client.subscribe(subscription)
+        print(ls_client.stats())
+    """
+
+    def __init__(self, clients, strategy=HASH):
+        if strategy not in STRATEGIES:
+            raise ValueError(
+                "strategy must be one of %s not %r" % (", ".join(STRATEGIES), strategy)
+            )
+        self.clients = list(clients)
+        self.strategy = strategy
+        self._subscriptions = {}
+        # subscription key: (shard, subscription key in the shard)
+        self._shard_keys = {}
+        self._current_subscription_key = 0
+        # number of subscribed items of each shard
+        self._loads = [0] * len(self.clients)
+        self._outages = [0] * len(self.clients)
+        self._last_stats = [(time.time(), 0)] * len(self.clients)
+        for shard, client in enumerate(self.clients):
+            client.addrecoverylistener(functools.partial(self._on_recovery, shard))
+
+    def _on_recovery(self, shard, outage):
+        self._outages[shard] += 1
+
+    def _shard(self, subscription):
+        """Returns the shard of a new subscription"""
+        if self.strategy == HASH:
+            return item_shard(subscription.item_names, len(self.clients))
+        return self._loads.index(min(self._loads))
+
+    def _register(self, subscription, shard, shard_key):
+        """Registers the subscription of a shard, returns its key"""
+        self._current_subscription_key += 1
+        self._subscriptions[self._current_subscription_key] = subscription
+        self._shard_keys[self._current_subscription_key] = (shard, shard_key)
+        self._loads[shard] += len(subscription.item_names)
+        return self._current_subscription_key
+
+    def _unregister(self, subcription_key):
+        subscription = self._subscriptions.pop(subcription_key)
+        shard, _ = self._shard_keys.pop(subcription_key)
+        self._loads[shard] -= len(subscription.item_names)
+
+    def connect(self):
+        """Creates the session of every shard"""
+        for client in self.clients:
+            client.connect()
+
+    def disconnect(self):
+        for client in self.clients:
+            client.disconnect()
+
+    def destroy(self):
+        for client in self.clients:
+            client.destroy()
+
+    def _join(self):
+        for client in self.clients:
+            client._join()
+
+    def addrecoverylistener(self, listener):
+        """Adds a listener called with the Outage of every recovered shard
+        session"""
+        for client in self.clients:
+            client.addrecoverylistener(listener)
+
+    def subscribe(self, subscription):
+        """Subscribes in the shard of subscription, returns its key"""
+        shard = self._shard(subscription)
+        shard_key = self.clients[shard].subscribe(subscription)
+        return self._register(subscription, shard, shard_key)
+
+    def subscribe_many(self, subscriptions):
+        """Subscribes with the batched control requests of each shard,
+        returns a list of (subscription key, server response) in the
+        order of subscriptions. The subscriptions whose request failed are
+        unregistered, those of a shard whose requests fail are dropped,
+        with an ERROR,<message> response."""
+        subscriptions = list(subscriptions)
+        by_shard = OrderedDict()
+        keys = []
+        for subscription in subscriptions:
+            shard = self._shard(subscription)
+            # the load is known before the shards subscribe
+            key = self._register(subscription, shard, None)
+            by_shard.setdefault(shard, []).append(key)
+            keys.append(key)
+        responses = {}
+        for shard, shard_keys in by_shard.items():
+            try:
+                results = self.clients[shard].subscribe_many(
+                    [self._subscriptions[key] for key in shard_keys]
+                )
+            except Exception as e:
+                logger.error("Can't subscribe in shard {0}: {1!r}".format(shard, e))
+                self._rollback(shard, shard_keys)
+                for key in shard_keys:
+                    responses[key] = ERROR_CMD + "," + str(e)
+                continue
+            for key, (shard_key, response) in zip(shard_keys, results):
+                self._shard_keys[key] = (shard, shard_key)
+                responses[key] = response
+                if response != OK_CMD:
+                    # unregistered by the client of the shard
+                    self._unregister(key)
+        return [(key, responses[key]) for key in keys]
+
+    def _rollback(self, shard, subcription_keys):
+        """Drops the subscriptions of subcription_keys allocated to shard,
+        and their registration by the client of the shard"""
+        client = self.clients[shard]
+        subscriptions = [self._subscriptions[key] for key in subcription_keys]
+        for key in subcription_keys:
+            self._unregister(key)
+        for shard_key, subscription in list(client._subscriptions.items()):
+            if any(subscription is s for s in subscriptions):
+                del client._subscriptions[shard_key]
+
+    def unsubscribe(self, subcription_key):
+        """Unsubscribes subcription_key in its shard"""
+        if subcription_key not in self._shard_keys:
+            logger.warning("No subscription key {0} found!".format(subcription_key))
+            return
+        shard, shard_key = self._shard_keys[subcription_key]
+        client = self.clients[shard]
+        client.unsubscribe(shard_key)
+        if shard_key not in client._subscriptions:
+            self._unregister(subcription_key)
+
+    def unsubscribe_many(self, subcription_keys):
+        """Unsubscribes with the batched control requests of each shard,
+        returns a list of (subscription key, server response)"""
+        by_shard = OrderedDict()
+        keys = []
+        for key in subcription_keys:
+            if key in self._shard_keys:
+                shard, shard_key = self._shard_keys[key]
+                by_shard.setdefault(shard, {})[shard_key] = key
+                keys.append(key)
+            else:
+                logger.warning("No subscription key {0} found!".format(key))
+        responses = {}
+        for shard, shard_keys in by_shard.items():
+            for shard_key, response in self.clients[shard].unsubscribe_many(
+                list(shard_keys)
+            ):
+                key = shard_keys[shard_key]
+                responses[key] = response
+                if shard_key not in self.clients[shard]._subscriptions:
+                    self._unregister(key)
+        return [(key, responses[key]) for key in keys]
+
+    def reconfigure(self, subcription_key, max_frequency):
+        """Changes the requested max frequency of a subscription in its
+        shard, returns the server response"""
+        if subcription_key not in self._shard_keys:
+            logger.warning("No subscription key {0} found!".format(subcription_key))
+            return None
+        shard, shard_key = self._shard_keys[subcription_key]
+        return self.clients[shard].reconfigure(shard_key, max_frequency)
+
+    def stats(self):
+        """Returns the health and throughput of each shard: session id,
+        connected, subscriptions, items, updates (received since connect),
+        updates_per_second (since the previous call), last_message_age
+        (seconds) and outages (recovered sessions)"""
+        now = time.time()
+        stats = []
+        for shard, client in enumerate(self.clients):
+            last_time, last_count = self._last_stats[shard]
+            updates = client.update_count
+            self._last_stats[shard] = (now, updates)
+            last_message_time = client._last_message_time
+            stats.append(
+                {
+                    "shard": shard,
+                    "session": client._session.get("SessionId"),
+                    "connected": client._stream_connection is not None,
+                    "subscriptions": len(client._subscriptions),
+                    "items": self._loads[shard],
+                    "updates": updates,
+                    "updates_per_second": (updates - last_count)
+                    / max(now - last_time, 1e-9),
+                    "last_message_age": None
+                    if last_message_time is None
+                    else now - last_message_time,
+                    "outages": self._outages[shard],
+                }
+            )
+        return stats
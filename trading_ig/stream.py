@@ -3,27 +3,66 @@
 
 from __future__ import absolute_import, division, print_function
 
-import sys
 import traceback
 import logging
 
-from .lightstreamer import LSClient
+from .lightstreamer import LSClient, Backoff
+from .lightstreamer_ws import WSLSClient
+from .sharding import ShardedLSClient, HASH, STRATEGIES
 
 logger = logging.getLogger(__name__)
 
 
 class IGStreamService(object):
-    def __init__(self, ig_service):
+    """Streaming service of an IGService session
+
+    transport: "http" for HTTP streaming, "ws" for a single WebSocket
+    connection carrying the stream and the control requests
+
+    recovery: Backoff of the attempts to recover a lost session (with the
+    same subscriptions), True for the default Backoff, None to end the
+    stream with the session
+
+    shards: number of Lightstreamer sessions the subscriptions are spread
+    over (see ShardedLSClient), placed by item hash (sharding="hash") or
+    by load (sharding="load")
+    """
+
+    TRANSPORTS = {"http": LSClient, "ws": WSLSClient}
+
+    def __init__(
+        self, ig_service, transport="http", recovery=True, shards=1, sharding=HASH
+    ):
+        if transport not in self.TRANSPORTS:
+            raise ValueError(
+                "transport must be one of %s not %r"
+                % (", ".join(self.TRANSPORTS), transport)
+            )
         self.ig_service = ig_service
         self.ig_session = None
         self.ls_client = None
+        self.transport = transport
+        if recovery is True:
+            recovery = Backoff()
+        self.recovery = recovery or None
+        if shards < 1:
+            raise ValueError("shards must be at least 1 not %r" % shards)
+        if sharding not in STRATEGIES:
+            raise ValueError(
+                "sharding must be one of %s not %r" % (", ".join(STRATEGIES), sharding)
+            )
+        self.shards = shards
+        self.sharding = sharding
 
     def create_session(self, encryption=False):
         ig_session = self.ig_service.create_session(encryption=encryption)
         self.ig_session = ig_session
         return ig_session
 
-    def connect(self, accountId):
+    def _new_ls_client(self, accountId):
+        """Returns a Lightstreamer client (of the transport) for the
+        account, logged in with the tokens of the IG session, sharded if
+        there are several shards"""
         cst = self.ig_service.crud_session.CLIENT_TOKEN
         xsecuritytoken = self.ig_service.crud_session.SECURITY_TOKEN
         lightstreamerEndpoint = self.ig_session[u"lightstreamerEndpoint"]
@@ -34,22 +73,34 @@ class IGStreamService(object):
         logger.info("Starting connection with %s" % lightstreamerEndpoint)
         # self.ls_client = LSClient("http://localhost:8080", "DEMO")
         # self.ls_client = LSClient("http://push.lightstreamer.com", "DEMO")
-        self.ls_client = LSClient(
-            lightstreamerEndpoint, adapter_set="", user=accountId, password=ls_password
-        )
+        ls_client_class = self.TRANSPORTS[self.transport]
+        ls_clients = [
+            ls_client_class(
+                lightstreamerEndpoint,
+                adapter_set="",
+                user=accountId,
+                password=ls_password,
+                recovery=self.recovery,
+            )
+            for _ in range(self.shards)
+        ]
+        if self.shards == 1:
+            return ls_clients[0]
+        return ShardedLSClient(ls_clients, self.sharding)
+
+    def connect(self, accountId):
+        self.ls_client = self._new_ls_client(accountId)
         try:
             self.ls_client.connect()
-            return
         except Exception:
             logger.error("Unable to connect to Lightstreamer Server")
             logger.error(traceback.format_exc())
-            sys.exit(1)
+            raise
 
     def unsubscribe_all(self):
-        # To avoid a RuntimeError: dictionary changed size during iteration
-        subscriptions = self.ls_client._subscriptions.copy()
-        for subcription_key in subscriptions:
-            self.ls_client.unsubscribe(subcription_key)
+        """Unsubscribes every subscription with batched control requests,
+        returns a list of (subscription key, server response)"""
+        return self.ls_client.unsubscribe_many(list(self.ls_client._subscriptions))
 
     def disconnect(self):
         self.unsubscribe_all()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Subscriptions to a changing set of epics
+
+A Lightstreamer subscription can't add or remove items, so watching a
+changing set of epics with one Subscription means subscribing to the whole
+set again at each change. A SubscriptionSet has one Subscription per epic:
+updating the set to the wanted epics only unsubscribes the removed epics
+and subscribes the added ones, with batched control requests. The epics
+which stay keep their Subscription, item state and listeners.
+"""
+
+import logging
+from collections import OrderedDict
+
+from .lightstreamer import Subscription, OK_CMD
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionSet(object):
+    """Subscriptions of a Lightstreamer client (LSClient, WSLSClient or
+    ShardedLSClient) to a changing set of epics, item names being prefix
+    and epic
+
+        watched = SubscriptionSet(ig_stream_service.ls_client, ["BID", "OFFER"])
+        watched.addlistener(on_update)
+        watched.update(["CS.D.GBPUSD.CFD.IP", "CS.D.USDJPY.CFD.IP"])
+        ...
+        watched.update(["CS.D.GBPUSD.CFD.IP", "CS.D.EURUSD.CFD.IP"])
+    """
+
+    def __init__(self, ls_client, fields, mode="MERGE", prefix="L1:", adapter=""):
+        self.ls_client = ls_client
+        self.fields = list(fields)
+        self.mode = mode
+        self.prefix = prefix
+        self.adapter = adapter
+        # {epic: Subscription} and {epic: subscription key}, in subscription order
+        self.subscriptions = OrderedDict()
+        self._keys = {}
+        self._listeners = []
+        # {epic: server response} of the epics the last update couldn't
+        # subscribe to
+        self.failed = OrderedDict()
+
+    @property
+    def epics(self):
+        """Subscribed epics"""
+        return list(self.subscriptions)
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def __contains__(self, epic):
+        return epic in self.subscriptions
+
+    def _new_subscription(self, epic):
+        subscription = Subscription(
+            self.mode, [self.prefix + epic], self.fields, self.adapter
+        )
+        for listener, fields in self._listeners:
+            subscription.addlistener(listener, fields)
+        return subscription
+
+    def addlistener(self, listener, fields=None):
+        """Adds a listener to the subscription of every epic, present and
+        future (see Subscription.addlistener)"""
+        if fields is not None:
+            self._check_fields(fields, self.fields)
+        self._listeners.append((listener, fields))
+        for subscription in self.subscriptions.values():
+            subscription.addlistener(listener, fields)
+
+    def removelistener(self, listener):
+        """Removes a listener added with addlistener"""
+        self._listeners = [(f, m) for (f, m) in self._listeners if f != listener]
+        for subscription in self.subscriptions.values():
+            subscription.removelistener(listener)
+
+    def _check_fields(self, fields, subscribed):
+        for field in fields:
+            if field not in subscribed:
+                raise ValueError("{0} is not a subscribed field".format(field))
+
+    def update(self, epics, fields=None):
+        """Subscribes to epics (and fields, if not None) only, returns the
+        lists of (added, removed) epics. When the fields change, every epic
+        is subscribed again. The epics the server rejects are not added,
+        they are in failed with the server response."""
+        wanted = OrderedDict.fromkeys(epics)
+        if fields is not None and list(fields) != self.fields:
+            for _, listener_fields in self._listeners:
+                if listener_fields is not None:
+                    self._check_fields(listener_fields, fields)
+            self.fields = list(fields)
+            removed = list(self.subscriptions)
+        else:
+            removed = [epic for epic in self.subscriptions if epic not in wanted]
+        removed = self._unsubscribe(removed)
+        added = self._subscribe(
+            [epic for epic in wanted if epic not in self.subscriptions]
+        )
+        return added, removed
+
+    def clear(self):
+        """Unsubscribes from every epic, returns the removed epics"""
+        return self._unsubscribe(list(self.subscriptions))
+
+    def _subscribe(self, epics):
+        """Subscribes to epics, returns those which were subscribed. Those
+        which fail stay out of the set (to be subscribed again by the next
+        update) and go to failed, the client unregisters them."""
+        self.failed = OrderedDict()
+        if not epics:
+            return []
+        subscriptions = [self._new_subscription(epic) for epic in epics]
+        results = self.ls_client.subscribe_many(subscriptions)
+        added = []
+        for epic, subscription, (key, response) in zip(epics, subscriptions, results):
+            if response == OK_CMD:
+                self.subscriptions[epic] = subscription
+                self._keys[epic] = key
+                added.append(epic)
+            else:
+                logger.warning("Can't subscribe to {0}: {1}".format(epic, response))
+                self.failed[epic] = response
+        return added
+
+    def _unsubscribe(self, epics):
+        """Unsubscribes from epics, returns those which were unsubscribed"""
+        if not epics:
+            return []
+        epics_of_keys = OrderedDict((self._keys[epic], epic) for epic in epics)
+        responses = dict(self.ls_client.unsubscribe_many(list(epics_of_keys)))
+        removed = []
+        for key, epic in epics_of_keys.items():
+            # keys the client doesn't know any more are already unsubscribed
+            if responses.get(key, OK_CMD) == OK_CMD:
+                del self.subscriptions[epic]
+                del self._keys[epic]
+                removed.append(epic)
+        return removed
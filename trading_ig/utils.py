@@ -2,32 +2,74 @@
 # -*- coding:utf-8 -*-
 
 import os
+import json
 import logging
 import traceback
+from importlib.util import find_spec
+
 import six
 
 logger = logging.getLogger(__name__)
 
-try:
-    import pandas as pd
-except ImportError:
+# pandas is only imported when a DataFrame is built (it's slow to import)
+if find_spec("pandas") is None:
     _HAS_PANDAS = False
     logger.info("Can't import pandas")
 else:
     _HAS_PANDAS = True
 
-try:
-    from munch import munchify  # noqa
-except ImportError:
+if find_spec("munch") is None:
     _HAS_MUNCH = False
     logger.info("Can't import munch")
 else:
     _HAS_MUNCH = True
 
+try:
+    import orjson
+except ImportError:
+    _HAS_ORJSON = False
+else:
+    _HAS_ORJSON = True
+
+try:
+    import ujson
+except ImportError:
+    _HAS_UJSON = False
+else:
+    _HAS_UJSON = True
+
 
 DATE_FORMATS = {1: "%Y:%m:%d-%H:%M:%S", 2: "%Y/%m/%d %H:%M:%S", 3: "%Y/%m/%d %H:%M:%S"}
 
 
+def json_decoder(name=None):
+    """Returns a function decoding JSON (bytes or str) to Python objects
+    name: "orjson", "ujson", "json" or None for the fastest one installed
+    """
+    if name is None:
+        if _HAS_ORJSON:
+            name = "orjson"
+        elif _HAS_UJSON:
+            name = "ujson"
+        else:
+            name = "json"
+    if name == "orjson" and _HAS_ORJSON:
+        return orjson.loads
+    elif name == "ujson" and _HAS_UJSON:
+        return ujson.loads
+    elif name == "json":
+        return json.loads
+    else:
+        raise ValueError("JSON decoder '%s' is not available" % name)
+
+
+def munchify(x):
+    """Recursively transforms dicts of x into Munch (attribute access)"""
+    from munch import munchify
+
+    return munchify(x)
+
+
 def conv_resol(resolution):
     """Returns a string for resolution (from a Pandas)
     """
@@ -70,6 +112,8 @@ def conv_datetime(dt, version=2):
     try:
         if isinstance(dt, six.string_types):
             if _HAS_PANDAS:
+                import pandas as pd
+
                 dt = pd.to_datetime(dt)
 
         fmt = DATE_FORMATS[int(version)]